@@ -0,0 +1,366 @@
+import math
+import datetime
+from typing import Dict, Optional, Sequence, Tuple
+
+import numpy as np
+
+EPOCH = datetime.datetime(1970, 1, 1)
+
+# Afegim el diccionari de períodes d'exportació (en segons)
+EXPORT_PERIODS = {
+    "20 segons": 20,
+    "1 minut": 60,
+    "10 minuts": 600,
+    "30 minuts": 1800,
+    "1 hora": 3600,
+    "12 hores": 43200,
+    "1 dia": 86400
+}
+
+# Estadístiques que es poden calcular per a cada bucket.
+ESTADISTIQUES = ("mean", "min", "max", "count", "first", "last", "std")
+
+# Les sumes es guarden en enters d'aquesta unitat (mil·lèsimes): els valors llegits ja estan
+# arrodonits a 3 decimals, de manera que les sumes són exactes i no depenen de l'ordre.
+ESCALA_SUMA = 1000
+
+# Els quadrats de les mostres amb |valor| < 2**31 mil·lèsimes es sumen en dues meitats int64.
+_LIMIT_QUADRATS = 1 << 31
+
+# Les sumes d'un segment es fan en int64 si no poden arribar a aquest valor (amb marge fins a 2**63).
+_LIMIT_SUMES = float(1 << 62)
+
+
+
+class Agregat:
+    """
+    Acumuladors per bucket de temps calculats de forma vectoritzada.
+
+    Cada posició dels arrays correspon a un bucket (índex = timestamp_ms // period_ms) i
+    guarda el nombre de mostres, la suma dels valors en unitats de 1/'ESCALA_SUMA' ('sum') i la
+    dels seus quadrats ('sum2'), com a enters de Python en arrays d'objectes perquè poden passar
+    de 64 bits, el mínim, el màxim i la primera/última mostra amb el seu timestamp. Els buckets
+    amb mostres infinites tenen sumes float (inf o NaN), que es propaguen a la mitjana i a la
+    desviació estàndard com abans.
+
+    Com que les sumes són enteres, fusionar agregats entre fitxers o blocs, o reagrupar-los a un
+    període més gran, dona exactament el mateix resultat que agregar directament les mostres,
+    sigui quin sigui l'ordre o la partició. D'aquests acumuladors se'n deriven totes les
+    estadístiques de 'ESTADISTIQUES'. La mitjana i la desviació estàndard es calculen sobre els
+    valors arrodonits a 1/'ESCALA_SUMA'.
+    """
+
+    __slots__ = ("period_ms", "bucket", "count", "sum", "sum2", "min", "max",
+                 "first", "last", "first_ts", "last_ts")
+
+    def __init__(self, period_ms: int, bucket: np.ndarray, count: np.ndarray, sum: np.ndarray,
+                 sum2: np.ndarray, min: np.ndarray, max: np.ndarray, first: np.ndarray,
+                 last: np.ndarray, first_ts: np.ndarray, last_ts: np.ndarray):
+        self.period_ms = period_ms
+        self.bucket = bucket
+        self.count = count
+        self.sum = sum
+        self.sum2 = sum2
+        self.min = min
+        self.max = max
+        self.first = first
+        self.last = last
+        self.first_ts = first_ts
+        self.last_ts = last_ts
+
+    @classmethod
+    def buit(cls, period_ms: int) -> "Agregat":
+        """Retorna un agregat sense cap bucket."""
+        i64 = np.empty(0, dtype=np.int64)
+        f64 = np.empty(0, dtype=np.float64)
+        obj = np.empty(0, dtype=object)
+        return cls(period_ms, i64, i64, obj, obj, f64, f64, f64, f64, i64, i64)
+
+    @classmethod
+    def des_de_mostres(cls, timestamps: np.ndarray, values: np.ndarray, export_period_sec: int) -> "Agregat":
+        """
+        Agrupa les mostres en buckets de 'export_period_sec' segons en una sola passada.
+
+        Args:
+            timestamps (np.ndarray): Timestamps int64 en mil·lisegons epoch UTC.
+            values (np.ndarray): Valors float64 (sense NaN).
+            export_period_sec (int): Durada del bucket en segons.
+
+        Returns:
+            Agregat: Acumuladors per bucket ordenats per temps.
+        """
+        period_ms = int(export_period_sec) * 1000
+        n = len(values)
+        if n == 0:
+            return cls.buit(period_ms)
+        timestamps = np.asarray(timestamps, dtype=np.int64)
+        values = np.asarray(values, dtype=np.float64)
+        if n > 1 and np.any(timestamps[1:] < timestamps[:-1]):
+            order = np.argsort(timestamps, kind="stable")
+            timestamps = timestamps[order]
+            values = values[order]
+
+        ids = timestamps // period_ms
+        starts, segment = _segments(ids)
+        ends = np.append(starts[1:], n)
+        count = ends - starts
+        suma, suma2 = _sumes(values, starts, int(count.max()))
+        return cls(
+            period_ms,
+            ids[starts],
+            count.astype(np.int64),
+            suma,
+            suma2,
+            np.minimum.reduceat(values, starts),
+            np.maximum.reduceat(values, starts),
+            values[starts],
+            values[ends - 1],
+            timestamps[starts],
+            timestamps[ends - 1],
+        )
+
+    @classmethod
+    def fusionar(cls, parts: Sequence["Agregat"]) -> "Agregat":
+        """
+        Fusiona diversos agregats del mateix període en un de sol.
+
+        Els buckets comuns es combinen sumant comptadors i sumes (enteres, exactes); la
+        primera/última mostra es tria pel seu timestamp. A igualtat de condicions preval l'ordre
+        de 'parts', de manera que el resultat no depèn de com s'han partit les dades.
+        """
+        if not parts:
+            raise ValueError("Cal com a mínim un agregat per fusionar.")
+        period_ms = parts[0].period_ms
+        if any(p.period_ms != period_ms for p in parts):
+            raise ValueError("No es poden fusionar agregats de períodes diferents.")
+        parts = [p for p in parts if len(p)]
+        if not parts:
+            return cls.buit(period_ms)
+        if len(parts) == 1:
+            return parts[0]
+
+        cat = {name: np.concatenate([getattr(p, name) for p in parts])
+               for name in cls.__slots__ if name != "period_ms"}
+        bucket = cat["bucket"]
+        if np.any(bucket[1:] < bucket[:-1]):
+            order = np.argsort(bucket, kind="stable")
+            cat = {name: arr[order] for name, arr in cat.items()}
+        return cls._reduir(period_ms, cat)
+
+    @classmethod
+    def _reduir(cls, period_ms: int, cat: Dict[str, np.ndarray]) -> "Agregat":
+        """Combina les entrades consecutives de 'cat' (ordenades per bucket) que tenen el mateix bucket."""
+        bucket = cat["bucket"]
+        starts, segment = _segments(bucket)
+        if len(starts) == len(bucket):
+            return cls(period_ms, **cat)
+
+        ends = np.append(starts[1:], len(bucket))
+        # np.lexsort és estable: a igualtat de timestamp es manté l'ordre de 'parts'.
+        first_idx = np.lexsort((cat["first_ts"], segment))[starts]
+        last_idx = np.lexsort((cat["last_ts"], segment))[ends - 1]
+        return cls(
+            period_ms,
+            bucket[starts],
+            np.add.reduceat(cat["count"], starts),
+            _sumar_segments(cat["sum"], starts),
+            _sumar_segments(cat["sum2"], starts),
+            np.minimum.reduceat(cat["min"], starts),
+            np.maximum.reduceat(cat["max"], starts),
+            cat["first"][first_idx],
+            cat["last"][last_idx],
+            cat["first_ts"][first_idx],
+            cat["last_ts"][last_idx],
+        )
+
+    def reagrupar(self, export_period_sec: int) -> "Agregat":
+        """
+        Agrupa els buckets en buckets de 'export_period_sec' segons, que ha de ser múltiple del
+        període actual. Com que es combinen comptadors i sumes enteres, el resultat és idèntic al
+        d'agregar directament les mostres.
+        """
+        period_ms = int(export_period_sec) * 1000
+        if period_ms % self.period_ms:
+            raise ValueError("El període nou ha de ser múltiple del període de l'agregat.")
+        if period_ms == self.period_ms:
+            return self
+        if not len(self):
+            return Agregat.buit(period_ms)
+        cat = {name: getattr(self, name) for name in self.__slots__ if name != "period_ms"}
+        cat["bucket"] = self.bucket * self.period_ms // period_ms
+        return Agregat._reduir(period_ms, cat)
+
+    def __len__(self) -> int:
+        return len(self.bucket)
+
+    def seleccionar(self, index) -> "Agregat":
+        """Retorna un nou agregat amb els buckets indicats per 'index' (slice, màscara o índexs)."""
+        return Agregat(self.period_ms, *(getattr(self, name)[index] for name in self.__slots__[1:]))
+
+    def tallar(self, fins_ms: int) -> Tuple["Agregat", "Agregat"]:
+        """
+        Separa els buckets que acaben abans de 'fins_ms' (tancats) de la resta (oberts).
+
+        Returns:
+            tuple: (tancats, oberts)
+        """
+        cut = int(np.searchsorted(self.bucket, fins_ms // self.period_ms, side="left"))
+        return self.seleccionar(slice(None, cut)), self.seleccionar(slice(cut, None))
+
+    @property
+    def temps_ms(self) -> np.ndarray:
+        """Timestamp d'inici de cada bucket en mil·lisegons epoch UTC."""
+        return self.bucket * self.period_ms
+
+    def estadistiques(self, noms: Optional[Sequence[str]] = None) -> Dict[str, np.ndarray]:
+        """
+        Calcula les estadístiques demanades per a cada bucket.
+
+        Args:
+            noms (list, opcional): Subconjunt de 'ESTADISTIQUES'. Per defecte, totes.
+
+        Returns:
+            dict: {nom_estadística: array} amb un valor per bucket.
+        """
+        noms = ESTADISTIQUES if noms is None else noms
+        result = {}
+        for name in noms:
+            if name == "mean":
+                # Divisió d'enters de Python: arrodonida correctament encara que la suma no càpiga en un float.
+                result[name] = (self.sum / (self.count.astype(object) * ESCALA_SUMA)).astype(np.float64)
+            elif name == "std":
+                result[name] = _desviacio(self.count.astype(object), self.sum, self.sum2).astype(np.float64)
+            elif name in ("min", "max", "count", "first", "last"):
+                result[name] = getattr(self, name)
+            else:
+                raise ValueError(f"Estadística desconeguda: {name}")
+        return result
+
+
+def _segments(ids: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Donat un array ordenat d'identificadors de bucket, retorna l'índex d'inici de cada
+    segment i, per a cada posició, el número de segment al qual pertany.
+    """
+    change = np.empty(len(ids), dtype=bool)
+    change[:1] = True
+    np.not_equal(ids[1:], ids[:-1], out=change[1:])
+    starts = np.flatnonzero(change)
+    segment = np.cumsum(change) - 1
+    return starts, segment
+
+
+def _sumes(values: np.ndarray, starts: np.ndarray, max_segment: int) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Sumes exactes per segment (vegeu '_segments') dels valors en unitats de 1/'ESCALA_SUMA' i dels
+    seus quadrats, com a arrays d'objectes. Si cap suma d'un segment de 'max_segment' elements no pot
+    desbordar, es fan en int64; si no (valors molt grans o infinits), mostra a mostra amb enters de
+    Python. Els valors no finits es deixen com a float, de manera que la suma del segment és inf o
+    NaN com en una suma en coma flotant.
+    """
+    with np.errstate(invalid="ignore", over="ignore"):
+        escalats = np.rint(values * ESCALA_SUMA)
+        maxim = float(np.abs(escalats).max()) * max_segment
+    if maxim < _LIMIT_SUMES:
+        enters = escalats.astype(np.int64)
+        return np.add.reduceat(enters, starts).astype(object), _suma_quadrats(enters, starts, max_segment)
+    # Un valor finit que desborda en escalar-lo (|valor| > 1.8e305) ja és enter: s'escala com a enter.
+    enters = np.array([int(e) if math.isfinite(e) else int(x) * ESCALA_SUMA if math.isfinite(x) else x
+                       for e, x in zip(escalats.tolist(), values.tolist())], dtype=object)
+    return _sumar_segments(enters, starts), _sumar_segments(enters * enters, starts)
+
+
+def _sumar(a, b):
+    """Suma dos acumuladors: si un enter massa gran per a un float es troba amb un inf o NaN, guanya el float."""
+    try:
+        return a + b
+    except OverflowError:
+        return a if isinstance(a, float) else b
+
+
+_sumar_objectes = np.frompyfunc(_sumar, 2, 1)
+
+
+def _sumar_segments(sumes: np.ndarray, starts: np.ndarray) -> np.ndarray:
+    """Suma per segment un array d'objectes d'acumuladors (enters de Python, o inf/NaN si hi ha mostres infinites)."""
+    with np.errstate(invalid="ignore"):
+        try:
+            return np.add.reduceat(sumes, starts)
+        except OverflowError:
+            return _sumar_objectes.reduceat(sumes, starts).astype(object)
+
+
+def _desviacio_bucket(count: int, suma, suma2) -> float:
+    """
+    Desviació estàndard d'un bucket a partir de count² · variància · ESCALA_SUMA² = count · sum2 - sum²,
+    calculat amb enters exactes. Amb mostres infinites (sumes float) és NaN.
+    """
+    if isinstance(suma, float) or isinstance(suma2, float):
+        return math.nan
+    dispersio = count * suma2 - suma * suma
+    escala = count * ESCALA_SUMA
+    try:
+        return math.sqrt(dispersio / (escala * escala))
+    except OverflowError:
+        # Variància més gran que el màxim float: l'arrel entera no perd precisió a aquesta magnitud.
+        return math.isqrt(dispersio) / escala
+
+
+_desviacio = np.frompyfunc(_desviacio_bucket, 3, 1)
+
+
+def _suma_quadrats(enters: np.ndarray, starts: np.ndarray, max_segment: int) -> np.ndarray:
+    """
+    Suma exacta dels quadrats de 'enters' per segment (vegeu '_segments'), com a enters de Python.
+    Si tots els valors són petits, cada quadrat cap en int64: si la suma d'un segment de
+    'max_segment' elements també hi cap, es fa directament en int64 i, si no, se'n sumen per
+    separat les dues meitats de 32 bits. Amb valors més grans se sumen com a enters de Python.
+    """
+    if not len(enters):
+        return np.empty(0, dtype=object)
+    maxim = max(int(enters.max()), -int(enters.min()))
+    if maxim < _LIMIT_QUADRATS:
+        quadrats = enters * enters
+        if maxim * maxim * max_segment < 1 << 63:
+            return np.add.reduceat(quadrats, starts).astype(object)
+        alts = np.add.reduceat(quadrats >> 32, starts).astype(object)
+        baixos = np.add.reduceat(quadrats & 0xFFFFFFFF, starts).astype(object)
+        return alts * (1 << 32) + baixos
+    enters = enters.astype(object)
+    return np.add.reduceat(enters * enters, starts)
+
+
+def agregar_columnes(timestamps: np.ndarray, values: np.ndarray, export_period_sec: int,
+                     estadistiques: Optional[Sequence[str]] = None) -> Tuple[np.ndarray, Dict[str, np.ndarray]]:
+    """
+    Agrupa mostres columnars en buckets i calcula-hi les estadístiques demanades.
+
+    Args:
+        timestamps (np.ndarray): Timestamps int64 en mil·lisegons epoch UTC.
+        values (np.ndarray): Valors float64.
+        export_period_sec (int): Durada del bucket en segons.
+        estadistiques (list, opcional): Subconjunt de 'ESTADISTIQUES'. Per defecte, totes.
+
+    Returns:
+        tuple: (inici de cada bucket en ms, {nom_estadística: array})
+    """
+    agregat = Agregat.des_de_mostres(timestamps, values, export_period_sec)
+    return agregat.temps_ms, agregat.estadistiques(estadistiques)
+
+
+def aggregate_samples(samples: list, export_period_sec: int) -> list:
+    """
+    Agrupa les mostres basant-se en buckets de temps amb la durada 'export_period_sec'.
+    Calcula la mitjana dels valors de cada bucket.
+
+    Vista de compatibilitat sobre 'Agregat' per a llistes de diccionaris amb 'time' i 'value'.
+    """
+    if not samples:
+        return []
+    timestamps = np.fromiter(((s["time"] - EPOCH) // datetime.timedelta(milliseconds=1) for s in samples),
+                             dtype=np.int64, count=len(samples))
+    values = np.fromiter((s["value"] for s in samples), dtype=np.float64, count=len(samples))
+    agregat = Agregat.des_de_mostres(timestamps, values, export_period_sec)
+    means = agregat.estadistiques(("mean",))["mean"]
+    return [{"time": EPOCH + datetime.timedelta(milliseconds=ts), "value": round(value, 3)}
+            for ts, value in zip(agregat.temps_ms.tolist(), means.tolist())]
@@ -0,0 +1,171 @@
+import os
+import datetime
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Tuple, Union
+
+import numpy as np
+
+from Llegir_Fitxer_Dades import llegir_dades_columnes, rang_mostres
+from Agregar_Mostres import EPOCH
+from Exportar_Dades import datetime_a_epoch_ms, llistar_fitxers_dades, preparar_fitxers
+
+# Mostres per bloc descodificat: és la unitat que es desa a la memòria cau.
+MIDA_BLOC_ARXIU = 1 << 18
+
+# Memòria màxima per defecte (en MB) dels blocs descodificats que es mantenen a la memòria cau.
+MEMORIA_ARXIU_MB = 256
+
+Instant = Union[None, int, str, datetime.datetime, np.datetime64]
+
+
+def instant_a_epoch_ms(valor: Instant) -> Optional[int]:
+    """
+    Converteix un límit d'interval a mil·lisegons epoch UTC: text ISO 8601 ('2026-01-01' o
+    '2026-01-01T08:00'), datetime (sense zona horària = UTC), np.datetime64 o enter (ja en ms).
+    """
+    if valor is None:
+        return None
+    if isinstance(valor, (int, np.integer)):
+        return int(valor)
+    if isinstance(valor, np.datetime64):
+        return int(valor.astype("datetime64[ms]").astype(np.int64))
+    if isinstance(valor, str):
+        valor = datetime.datetime.fromisoformat(valor)
+    if isinstance(valor, datetime.datetime):
+        if valor.tzinfo is not None:
+            valor = valor.astimezone(datetime.timezone.utc).replace(tzinfo=None)
+        return datetime_a_epoch_ms(valor)
+    raise TypeError(f"Límit d'interval no vàlid: {valor!r}")
+
+
+class TrendArchive:
+    """
+    Vista d'una subcarpeta TR2 com una sola sèrie temporal contínua, indexable per temps:
+
+        arxiu = TrendArchive(r"D:\\Trends\\TAG_TR2")
+        timestamps, valors = arxiu["2026-01-01":"2026-02-01"]
+
+    En crear-la només es llegeixen les capçaleres. Cada consulta [inici, fi) descodifica, bloc a
+    bloc, només les mostres dels fitxers que intersecten l'interval, i retorna els timestamps (int64,
+    mil·lisegons epoch UTC) i els valors (float64, sense NaN) ordenats per temps, com
+    'llegir_dades_columnes'.
+
+    Els blocs descodificats (de 'mida_bloc' mostres, alineats dins de cada fitxer) es guarden en una
+    memòria cau LRU de com a màxim 'memoria_mb', de manera que les consultes repetides sobre el mateix
+    període no tornen a llegir el disc. Els blocs s'identifiquen per la mida i la data de modificació
+    del fitxer: després de 'refrescar', els d'un fitxer que ha canviat ja no es fan servir.
+    """
+
+    def __init__(self, source_folder: str, cataleg=None, memoria_mb: float = MEMORIA_ARXIU_MB,
+                 mida_bloc: int = MIDA_BLOC_ARXIU, decimals: Optional[int] = 3):
+        self.source_folder = source_folder
+        self.cataleg = cataleg
+        self.memoria = int(memoria_mb * (1 << 20))
+        self.mida_bloc = mida_bloc
+        self.decimals = decimals
+        self.fitxers: List[Dict[str, Any]] = []
+        self.log_messages: List[str] = []
+        # (path, mida, mtime_ns, índex del bloc) -> (timestamps, valors)
+        self._blocs: "OrderedDict[Tuple[str, int, int, int], Tuple[np.ndarray, np.ndarray]]" = OrderedDict()
+        self._bytes = 0
+        self.encerts = 0
+        self.errades = 0
+        self._lock = threading.Lock()
+        self.refrescar()
+
+    def refrescar(self) -> None:
+        """Torna a llistar els fitxers i a llegir-ne les capçaleres (p. ex. si Citect hi ha escrit)."""
+        log_messages = []
+        fitxers = preparar_fitxers(self.source_folder, llistar_fitxers_dades(self.source_folder, self.cataleg),
+                                   log_messages, cataleg=self.cataleg)
+        for fitxer in fitxers:
+            st = os.stat(fitxer["path"])
+            fitxer["st"] = (st.st_size, st.st_mtime_ns)
+        self.fitxers, self.log_messages = fitxers, log_messages
+
+    @property
+    def inici(self) -> Optional[datetime.datetime]:
+        """Instant (UTC) de la primera mostra de l'arxiu segons les capçaleres."""
+        if not self.fitxers:
+            return None
+        return EPOCH + datetime.timedelta(milliseconds=min(f["start_ms"] for f in self.fitxers))
+
+    @property
+    def fi(self) -> Optional[datetime.datetime]:
+        """Instant (UTC) de l'última mostra de l'arxiu segons les capçaleres."""
+        if not self.fitxers:
+            return None
+        return EPOCH + datetime.timedelta(milliseconds=max(f["end_ms"] for f in self.fitxers))
+
+    def __repr__(self) -> str:
+        return (f"TrendArchive({self.source_folder!r}, {len(self.fitxers)} fitxers, "
+                f"{self.inici} - {self.fi}, memòria cau {self._bytes / 1e6:.1f} MB)")
+
+    def __getitem__(self, interval: slice) -> Tuple[np.ndarray, np.ndarray]:
+        if not isinstance(interval, slice):
+            raise TypeError("Cal un interval temporal, p. ex. arxiu['2026-01-01':'2026-02-01'].")
+        if interval.step is not None:
+            raise ValueError("L'interval temporal no admet pas; per agregar, vegeu 'Agregat.des_de_mostres'.")
+        return self.llegir(interval.start, interval.stop)
+
+    def llegir(self, inici: Instant = None, fi: Instant = None) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Retorna (timestamps, valors) de les mostres amb temps dins de [inici, fi), ordenades per temps.
+        Sense límits es retorna tot l'arxiu. Si els fitxers se solapen es mantenen totes les mostres.
+        """
+        inici_ms, fi_ms = instant_a_epoch_ms(inici), instant_a_epoch_ms(fi)
+        parts_temps, parts_valors = [], []
+        for fitxer in self.fitxers:
+            primera, ultima = rang_mostres(fitxer["header"], inici_ms, fi_ms)
+            if primera >= ultima:
+                continue
+            for index in range(primera // self.mida_bloc, (ultima - 1) // self.mida_bloc + 1):
+                bloc = self._bloc(fitxer, index)
+                if bloc is None:
+                    break
+                timestamps, values = bloc
+                lo = 0 if inici_ms is None else int(np.searchsorted(timestamps, inici_ms, side="left"))
+                hi = len(timestamps) if fi_ms is None else int(np.searchsorted(timestamps, fi_ms, side="left"))
+                if lo < hi:
+                    parts_temps.append(timestamps[lo:hi])
+                    parts_valors.append(values[lo:hi])
+        if not parts_temps:
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float64)
+        timestamps, values = np.concatenate(parts_temps), np.concatenate(parts_valors)
+        if len(timestamps) > 1 and np.any(timestamps[1:] < timestamps[:-1]):
+            ordre = np.argsort(timestamps, kind="stable")
+            timestamps, values = timestamps[ordre], values[ordre]
+        return timestamps, values
+
+    def _bloc(self, fitxer: Dict[str, Any], index: int) -> Optional[Tuple[np.ndarray, np.ndarray]]:
+        """Bloc 'index' descodificat del fitxer, des de la memòria cau o del disc (None si no es pot llegir)."""
+        clau = (fitxer["path"],) + fitxer["st"] + (index,)
+        with self._lock:
+            bloc = self._blocs.get(clau)
+            if bloc is not None:
+                self._blocs.move_to_end(clau)
+                self.encerts += 1
+                return bloc
+            self.errades += 1
+        bloc = llegir_dades_columnes(fitxer["path"], fitxer["header"], self.decimals, index * self.mida_bloc,
+                                     self.mida_bloc)
+        if bloc is None:
+            return None
+        mida = bloc[0].nbytes + bloc[1].nbytes
+        if mida > self.memoria:
+            return bloc
+        with self._lock:
+            if clau not in self._blocs:
+                self._blocs[clau] = bloc
+                self._bytes += mida
+            while self._bytes > self.memoria:
+                _, (timestamps, values) = self._blocs.popitem(last=False)
+                self._bytes -= timestamps.nbytes + values.nbytes
+        return bloc
+
+    def buidar_cache(self) -> None:
+        """Descarta tots els blocs descodificats."""
+        with self._lock:
+            self._blocs.clear()
+            self._bytes = 0
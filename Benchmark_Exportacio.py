@@ -0,0 +1,350 @@
+"""
+Benchmarks de les etapes de l'exportació sobre fitxers de tendència sintètics.
+
+Mesura la lectura de capçaleres, la descodificació de mostres, l'agregació a cada període de
+'EXPORT_PERIODS', l'escriptura del CSV i l'exportació completa, i en dona el rendiment (unitats/s
+i MB/s) i el pic de memòria (RSS). Els resultats es poden desar com a referència en JSON i
+comparar amb una referència anterior per detectar regressions. Amb '--verificar' també es comprova
+que l'exportació de diversos períodes en una passada dona els mateixos fitxers que cada període sol,
+que les estadístiques de mostres infinites o molt grans són correctes i que la lectura anticipada
+allibera el buffer d'un fitxer abandonat a mitges.
+
+Exemples:
+    python Benchmark_Exportacio.py --mostres 1000000 --fitxers 4 --carpetes 2 --desar referencia.json
+    python Benchmark_Exportacio.py --mostres 1000000 --fitxers 4 --carpetes 2 --comparar referencia.json
+    python Benchmark_Exportacio.py --mostres 100000 --verificar
+"""
+import os
+import sys
+import json
+import math
+import time
+import shutil
+import filecmp
+import argparse
+import platform
+import tempfile
+from fractions import Fraction
+from typing import Any, Callable, Dict, List, Sequence, Tuple
+
+import numpy as np
+
+from Llegir_Fitxer_Dades import HEADER_SIZE, SAMPLE_DTYPE, llegir_header_datafile, llegir_dades_columnes
+from Agregar_Mostres import ESTADISTIQUES, EXPORT_PERIODS, Agregat
+from Escriptors_Sortida import crear_escriptor
+from Exportar_Dades import exportar_carpetes, llistar_fitxers_dades, nom_sortida, parcials_fitxer, preparar_fitxers
+from Generar_Fitxers_Sintetics import generar_carpetes
+from Instrumentacio import reiniciar_pic_memoria, pic_memoria_mb
+from Lectura_Anticipada import LecturaAnticipada
+
+# Versió del format del fitxer de referència.
+VERSIO_REFERENCIA = 1
+
+# Caiguda de rendiment (o augment de memòria) a partir de la qual es marca una regressió.
+TOLERANCIA_PER_DEFECTE = 0.10
+
+
+def mesurar(nom: str, funcio: Callable[[], Tuple[int, int]], unitat: str, repeticions: int) -> Dict[str, Any]:
+    """
+    Executa 'funcio' 'repeticions' vegades i en retorna el millor temps i el rendiment.
+
+    'funcio' retorna (unitats processades, bytes processats) d'una execució.
+    """
+    millor = None
+    reiniciar_pic_memoria()
+    for _ in range(repeticions):
+        inici = time.perf_counter()
+        unitats, n_bytes = funcio()
+        durada = time.perf_counter() - inici
+        millor = durada if millor is None else min(millor, durada)
+    pic = pic_memoria_mb()
+    resultat = {
+        "unitat": unitat,
+        "unitats": unitats,
+        "bytes": n_bytes,
+        "temps_s": round(millor, 6),
+        "per_segon": round(unitats / millor, 1) if millor > 0 else None,
+        "mb_s": round(n_bytes / millor / 1e6, 2) if millor > 0 else None,
+        "pic_rss_mb": round(pic, 1) if pic is not None else None,
+    }
+    print(f"{nom:<22} {resultat['per_segon'] or 0:>14,.0f} {unitat}/s {resultat['mb_s'] or 0:>10.1f} MB/s "
+          f"{millor:>9.4f} s  pic {resultat['pic_rss_mb'] or 0:>8.1f} MB", file=sys.stderr)
+    return resultat
+
+
+def executar_benchmarks(folders: List[str], export_folder: str, repeticions: int = 3) -> Dict[str, Dict[str, Any]]:
+    """Executa tots els benchmarks sobre les subcarpetes 'folders' i retorna {nom: resultat}."""
+    paths = [os.path.join(folder, name) for folder in folders for name in llistar_fitxers_dades(folder)]
+    headers = [llegir_header_datafile(path) for path in paths]
+    mida_mostres = sum(os.path.getsize(path) - HEADER_SIZE for path in paths)
+    n_mostres = sum(header["header"]["DataLength"] for header in headers)
+    resultats = {}
+
+    def capcaleres():
+        for path in paths:
+            llegir_header_datafile(path)
+        return len(paths), len(paths) * HEADER_SIZE
+    resultats["capcaleres"] = mesurar("capcaleres", capcaleres, "capçaleres", repeticions)
+
+    columnes = []
+
+    def descodificacio():
+        columnes.clear()
+        for path, header in zip(paths, headers):
+            columnes.append(llegir_dades_columnes(path, header))
+        return n_mostres, mida_mostres
+    resultats["descodificacio"] = mesurar("descodificacio", descodificacio, "mostres", repeticions)
+
+    n_valides = sum(len(values) for _, values in columnes)
+    agregats = {}
+    for export_period_sec in EXPORT_PERIODS.values():
+        def agregacio():
+            agregats[export_period_sec] = [Agregat.des_de_mostres(timestamps, values, export_period_sec)
+                                           for timestamps, values in columnes]
+            return n_valides, n_valides * 16
+        resultats[f"agregacio_{export_period_sec}s"] = mesurar(f"agregacio_{export_period_sec}s", agregacio,
+                                                               "mostres", repeticions)
+
+    export_period_sec = min(EXPORT_PERIODS.values())
+    blocs = agregats[export_period_sec]
+    csv_path = os.path.join(export_folder, "benchmark.csv")
+
+    def escriptura_csv():
+        escriptor = crear_escriptor(csv_path, ("mean", "min", "max"))
+        for bloc in blocs:
+            escriptor.escriure(bloc)
+        escriptor.tancar()
+        return sum(len(bloc) for bloc in blocs), os.path.getsize(csv_path)
+    resultats["escriptura_csv"] = mesurar("escriptura_csv", escriptura_csv, "files", repeticions)
+    os.remove(csv_path)
+    columnes.clear()
+    agregats.clear()
+
+    def exportacio():
+        for _ in exportar_carpetes(folders, export_folder, 60):
+            pass
+        return n_mostres, mida_mostres
+    resultats["exportacio_60s"] = mesurar("exportacio_60s", exportacio, "mostres", repeticions)
+    return resultats
+
+
+def verificar_periodes(folders: List[str], export_folder: str, periodes: Sequence[int] = tuple(EXPORT_PERIODS.values()),
+                       statistics: Sequence[str] = ESTADISTIQUES) -> List[str]:
+    """
+    Exporta 'folders' a tots els 'periodes' en una sola passada i després a cada període per
+    separat, i comprova que cada fitxer derivat és idèntic byte a byte al de l'exportació d'aquell
+    període sol. Retorna la llista de diferències (buida si tot coincideix).
+    """
+    diferencies = []
+    carpeta_periodes = os.path.join(export_folder, "verificacio_periodes")
+    os.makedirs(carpeta_periodes, exist_ok=True)
+    for _ in exportar_carpetes(folders, carpeta_periodes, list(periodes), statistics=statistics):
+        pass
+    for export_period_sec in periodes:
+        carpeta_sol = os.path.join(export_folder, f"verificacio_{export_period_sec}s")
+        os.makedirs(carpeta_sol, exist_ok=True)
+        for _ in exportar_carpetes(folders, carpeta_sol, export_period_sec, statistics=statistics):
+            pass
+        for folder in folders:
+            derivat = nom_sortida(folder, carpeta_periodes, export_period_sec=export_period_sec)
+            esperat = nom_sortida(folder, carpeta_sol)
+            if os.path.exists(derivat) != os.path.exists(esperat):
+                diferencies.append(f"{os.path.basename(folder)} a {export_period_sec} s: només hi ha "
+                                   f"{derivat if os.path.exists(derivat) else esperat}")
+            elif os.path.exists(derivat) and not filecmp.cmp(derivat, esperat, shallow=False):
+                with open(derivat) as a, open(esperat) as b:
+                    files = sum(x != y for x, y in zip(a, b))
+                diferencies.append(f"{os.path.basename(folder)} a {export_period_sec} s: {files} files "
+                                   f"diferents entre {derivat} i {esperat}")
+    return diferencies
+
+
+# Mostres amb valors infinits o prou grans per desbordar les sumes int64 de 'Agregat'.
+CASOS_EXTREMS = {
+    "inf": [1.0, math.inf, 2.0, 3.0, 4.0, 5.0],
+    "-inf": [1.0, 2.0, -math.inf, 3.0, 4.0, 5.0],
+    "inf i -inf": [math.inf, 1.0, 2.0, -math.inf, 4.0, 5.0],
+    "1e17": [1e17, 1e17, 3.0, 4.0, 5.0, 6.0],
+    "-1e300": [-1e300, 3.0, 4.0, 5.0, 6.0, 7.0],
+    "1.7e308": [1.7e308, 1.7e308, 1.7e308, 1.0, 1.0, 1.0],
+    "normals": [1.5, 2.5, 3.0, 4.0, 5.0, 6.0],
+}
+
+
+def _referencia(valors: Sequence[float]) -> Tuple[float, float]:
+    """Mitjana i desviació estàndard (poblacional) calculades amb fraccions exactes."""
+    if not all(math.isfinite(v) for v in valors):
+        return sum(valors) / len(valors), math.nan
+    n = len(valors)
+    mitjana = sum(Fraction(v) for v in valors) / n
+    variancia = sum((Fraction(v) - mitjana) ** 2 for v in valors) / n
+    try:
+        return float(mitjana), math.sqrt(variancia)
+    except OverflowError:
+        return float(mitjana), math.isqrt(int(variancia))
+
+
+def verificar_valors_extrems(casos: Dict[str, Sequence[float]] = CASOS_EXTREMS) -> List[str]:
+    """
+    Agrega cada cas de 'casos' en un sol bucket, directament i fusionant dos trossos agregats a un
+    període més petit, i comprova que la mitjana i la desviació estàndard coincideixen entre si i
+    amb la referència exacta (inf o NaN si hi ha mostres infinites). Retorna les diferències.
+    """
+    diferencies = []
+    for nom, valors in casos.items():
+        values = np.array(valors, dtype=np.float64)
+        timestamps = np.arange(len(values), dtype=np.int64) * 1000
+        directe = Agregat.des_de_mostres(timestamps, values, 60).estadistiques(("mean", "std"))
+        meitat = len(values) // 2
+        fusionat = Agregat.fusionar([Agregat.des_de_mostres(timestamps[:meitat], values[:meitat], 1),
+                                     Agregat.des_de_mostres(timestamps[meitat:], values[meitat:], 1)])
+        fusionat = fusionat.reagrupar(60).estadistiques(("mean", "std"))
+        for stat, esperat in zip(("mean", "std"), _referencia(valors)):
+            obtingut = float(directe[stat][0])
+            if not (math.isclose(obtingut, esperat, rel_tol=1e-9) or obtingut == esperat
+                    or math.isnan(obtingut) and math.isnan(esperat)):
+                diferencies.append(f"valors {nom}: {stat} {obtingut!r} en lloc de {esperat!r}")
+            elif not np.array_equal(directe[stat], fusionat[stat], equal_nan=True):
+                diferencies.append(f"valors {nom}: {stat} {float(fusionat[stat][0])!r} en fusionar "
+                                   f"en lloc de {obtingut!r}")
+    return diferencies
+
+
+def verificar_lectura_abandonada(folder: str) -> List[str]:
+    """
+    Llegeix els fitxers de 'folder' amb una 'LecturaAnticipada' on només hi cap un fitxer, abandona
+    el primer després del primer bloc i llegeix la resta: si el buffer abandonat no s'allibera, cap
+    altre fitxer es pot llegir per avançat. Retorna les diferències (buida si tot es llegeix del buffer).
+    """
+    fitxers = preparar_fitxers(folder, llistar_fitxers_dades(folder), [])
+    if len(fitxers) < 2:
+        return []
+    memoria_mb = max(fitxer["nombre_mostres"] for fitxer in fitxers) * SAMPLE_DTYPE.itemsize / (1 << 20)
+    with LecturaAnticipada(fitxers, 2, memoria_mb) as lectura:
+        primer = fitxers[0]
+        parts = lectura.consumir(primer["path"], parcials_fitxer(primer, 60, max(primer["nombre_mostres"] // 2, 1),
+                                                                 llegir=lectura.llegir))
+        next(parts, None)
+        parts.close()
+        for fitxer in fitxers[1:]:
+            for _ in lectura.consumir(fitxer["path"], parcials_fitxer(fitxer, 60, llegir=lectura.llegir)):
+                pass
+    if lectura.errades:
+        return [f"lectura anticipada de {os.path.basename(folder)}: {lectura.errades} lectures del disc "
+                f"després d'abandonar {os.path.basename(primer['path'])}"]
+    return []
+
+
+def comparar(resultats: Dict[str, Dict[str, Any]], referencia: Dict[str, Dict[str, Any]],
+             tolerancia: float = TOLERANCIA_PER_DEFECTE) -> List[str]:
+    """
+    Compara els resultats amb una referència i retorna la llista de regressions: benchmarks amb
+    un rendiment més de 'tolerancia' per sota de la referència o un pic de memòria per sobre.
+    """
+    regressions = []
+    for nom, resultat in resultats.items():
+        base = referencia.get(nom)
+        if base is None:
+            continue
+        if base.get("per_segon") and resultat.get("per_segon") is not None:
+            ratio = resultat["per_segon"] / base["per_segon"]
+            if ratio < 1 - tolerancia:
+                regressions.append(f"{nom}: rendiment {ratio:.0%} de la referència "
+                                   f"({resultat['per_segon']:,.0f} vs {base['per_segon']:,.0f} {resultat['unitat']}/s)")
+        if base.get("pic_rss_mb") and resultat.get("pic_rss_mb") is not None:
+            ratio = resultat["pic_rss_mb"] / base["pic_rss_mb"]
+            if ratio > 1 + tolerancia:
+                regressions.append(f"{nom}: pic de memòria {ratio:.0%} de la referència "
+                                   f"({resultat['pic_rss_mb']:.1f} vs {base['pic_rss_mb']:.1f} MB)")
+    return regressions
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Benchmarks de l'exportació amb fitxers de tendència sintètics.")
+    parser.add_argument("--mostres", type=int, default=1000000, help="Mostres per fitxer (per defecte 1000000).")
+    parser.add_argument("--periode-mostreig", type=int, default=1000,
+                        help="SamplePeriod en mil·lisegons (per defecte 1000).")
+    parser.add_argument("--nans", type=float, default=0.05, help="Fracció de mostres NaN (per defecte 0.05).")
+    parser.add_argument("--fitxers", type=int, default=4, help="Fitxers per subcarpeta (per defecte 4).")
+    parser.add_argument("--carpetes", type=int, default=2, help="Nombre de subcarpetes TR2 (per defecte 2).")
+    parser.add_argument("--repeticions", type=int, default=3,
+                        help="Execucions de cada benchmark; es pren la més ràpida (per defecte 3).")
+    parser.add_argument("--dades", metavar="CARPETA",
+                        help="Carpeta on es generen les dades (per defecte, una carpeta temporal que s'esborra).")
+    parser.add_argument("--desar", metavar="FITXER", help="Desa els resultats com a referència JSON.")
+    parser.add_argument("--comparar", metavar="FITXER", help="Compara amb una referència JSON desada abans.")
+    parser.add_argument("--tolerancia", type=float, default=TOLERANCIA_PER_DEFECTE,
+                        help="Variació admesa respecte a la referència (per defecte 0.10 = 10%%).")
+    parser.add_argument("--verificar", action="store_true",
+                        help="Comprova que l'exportació de tots els períodes en una passada coincideix "
+                             "amb l'exportació de cada període sol, les estadístiques de valors extrems i "
+                             "l'alliberament dels buffers de la lectura anticipada.")
+    args = parser.parse_args(argv)
+
+    parametres = {
+        "mostres": args.mostres,
+        "periode_mostreig_ms": args.periode_mostreig,
+        "nans": args.nans,
+        "fitxers": args.fitxers,
+        "carpetes": args.carpetes,
+    }
+    root = args.dades or tempfile.mkdtemp(prefix="benchmark_citect_")
+    try:
+        data_root = os.path.join(root, "dades")
+        export_folder = os.path.join(root, "export")
+        os.makedirs(export_folder, exist_ok=True)
+        print(f"Generant dades sintètiques a {data_root}...", file=sys.stderr)
+        folders = generar_carpetes(data_root, args.carpetes, args.fitxers, args.mostres, args.periode_mostreig,
+                                   args.nans)
+        resultats = executar_benchmarks(folders, export_folder, args.repeticions)
+        diferencies = None
+        if args.verificar:
+            diferencies = (verificar_periodes(folders, export_folder) + verificar_valors_extrems()
+                           + verificar_lectura_abandonada(folders[0]))
+    finally:
+        if not args.dades:
+            shutil.rmtree(root, ignore_errors=True)
+
+    informe = {
+        "versio": VERSIO_REFERENCIA,
+        "data": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "plataforma": {"python": platform.python_version(), "numpy": np.__version__,
+                       "sistema": platform.platform(), "cpus": os.cpu_count()},
+        "parametres": parametres,
+        "resultats": resultats,
+    }
+    codi = 0
+    if diferencies is not None:
+        informe["verificacio_periodes"] = diferencies
+        for diferencia in diferencies:
+            print(f"[!] Diferència: {diferencia}", file=sys.stderr)
+        if diferencies:
+            codi = 1
+        else:
+            print("[OK] Cada període derivat coincideix amb la seva exportació individual i les estadístiques "
+                  "de valors extrems són correctes, i la lectura anticipada allibera els fitxers abandonats.",
+                  file=sys.stderr)
+    if args.comparar:
+        with open(args.comparar, "r") as f:
+            referencia = json.load(f)
+        if referencia.get("parametres") != parametres:
+            print("[!] La referència s'ha mesurat amb altres paràmetres: la comparació és orientativa.",
+                  file=sys.stderr)
+        regressions = comparar(resultats, referencia.get("resultats", {}), args.tolerancia)
+        informe["regressions"] = regressions
+        for regressio in regressions:
+            print(f"[!] Regressió: {regressio}", file=sys.stderr)
+        if regressions:
+            codi = 1
+        else:
+            print("[OK] Cap regressió respecte a la referència.", file=sys.stderr)
+    if args.desar:
+        with open(args.desar, "w") as f:
+            json.dump(informe, f, ensure_ascii=False, indent=1)
+    json.dump(informe, sys.stdout, ensure_ascii=False, indent=1)
+    sys.stdout.write("\n")
+    return codi
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,235 @@
+import os
+import sqlite3
+from contextlib import closing
+from typing import Any, Dict, Optional, Tuple
+
+import numpy as np
+
+from Llegir_Fitxer_Dades import SAMPLE_DTYPE, llegir_dades_columnes, blocs_mostres, filetime_a_epoch_ms
+from Agregar_Mostres import EXPORT_PERIODS, Agregat
+from Instrumentacio import mesurar_etapa
+
+_ESQUEMA = """
+CREATE TABLE IF NOT EXISTS agregats (
+    path TEXT NOT NULL,
+    period_ms INTEGER NOT NULL,
+    size INTEGER NOT NULL,
+    mtime_ns INTEGER NOT NULL,
+    buckets INTEGER NOT NULL,
+    dades BLOB NOT NULL,
+    PRIMARY KEY (path, period_ms)
+);
+"""
+
+# Períodes (en segons) de la piràmide d'agregats que es desa per a cada fitxer. Cada nivell es
+# calcula a partir del nivell més gruixut anterior del qual és múltiple.
+PERIODES_PIRAMIDE = tuple(sorted(set(EXPORT_PERIODS.values())))
+
+# Versió del format dels agregats desats (PRAGMA user_version): si no coincideix, la memòria cau
+# existent es descarta en obrir-la.
+VERSIO_CACHE = 3
+
+# Tipus de cada array de l'agregat, en l'ordre en què es desen al BLOB. 'sum' i 'sum2' (enters de
+# Python) es desen en dues parts int64, la de dalt amb signe i la dels 62 bits de baix.
+_CAMPS = (("bucket", np.int64), ("count", np.int64), ("sum_alt", np.int64), ("sum_baix", np.int64),
+          ("sum2_alt", np.int64), ("sum2_baix", np.int64), ("min", np.float64), ("max", np.float64),
+          ("first", np.float64), ("last", np.float64), ("first_ts", np.int64), ("last_ts", np.int64))
+
+_BITS_BAIX = 62
+
+_SUMES = ("sum", "sum2")
+
+
+def serialitzar_agregat(agregat: Agregat) -> Optional[bytes]:
+    """
+    Converteix els arrays de l'agregat en un sol bloc de bytes (vegeu 'deserialitzar_agregat').
+    Retorna None si alguna suma no es pot desar: buckets amb mostres infinites (sumes float) o
+    sumes de més de 125 bits.
+    """
+    arrays = {name: getattr(agregat, name) for name in Agregat.__slots__[1:]}
+    try:
+        for name in _SUMES:
+            sumes = arrays.pop(name)
+            arrays[name + "_alt"] = np.asarray(sumes >> _BITS_BAIX, dtype=np.int64)
+            arrays[name + "_baix"] = np.asarray(sumes & ((1 << _BITS_BAIX) - 1), dtype=np.int64)
+    except (TypeError, OverflowError):
+        return None
+    return b"".join(np.ascontiguousarray(arrays[name], dtype=dtype).tobytes() for name, dtype in _CAMPS)
+
+
+def deserialitzar_agregat(period_ms: int, buckets: int, dades: bytes) -> Agregat:
+    """Reconstrueix un agregat de 'buckets' buckets a partir dels bytes de 'serialitzar_agregat'."""
+    arrays = {name: np.frombuffer(dades, dtype=dtype, count=buckets, offset=i * buckets * 8)
+              for i, (name, dtype) in enumerate(_CAMPS)}
+    for name in _SUMES:
+        alt, baix = arrays.pop(name + "_alt"), arrays.pop(name + "_baix")
+        arrays[name] = (alt.astype(object) << _BITS_BAIX) | baix.astype(object)
+    return Agregat(period_ms, **arrays)
+
+
+def piramide(base: Agregat, periodes=PERIODES_PIRAMIDE) -> Dict[int, Agregat]:
+    """
+    Construeix els nivells de la piràmide a partir de l'agregat 'base': cada període de 'periodes'
+    múltiple del de 'base' es calcula amb 'Agregat.reagrupar' des del nivell més gruixut ja calculat
+    del qual és múltiple. Retorna {period_ms: agregat}.
+    """
+    nivells = {base.period_ms: base}
+    for export_period_sec in sorted(periodes):
+        period_ms = export_period_sec * 1000
+        if period_ms in nivells or period_ms % base.period_ms:
+            continue
+        origen = max(p for p in nivells if period_ms % p == 0)
+        nivells[period_ms] = nivells[origen].reagrupar(export_period_sec)
+    return nivells
+
+
+def buckets_finestra(fitxer: Dict[str, Any], period_ms: int) -> Optional[Tuple[int, int]]:
+    """
+    Rang de buckets [primer, últim] de 'period_ms' que contenen l'interval de mostres del fitxer
+    ('primera_mostra', 'nombre_mostres'). Retorna None si algun bucket de les vores també conté
+    mostres del fitxer de fora de l'interval: llavors aquest nivell no el pot reproduir exactament.
+    """
+    header = fitxer["header"]["header"]
+    start_ms = filetime_a_epoch_ms(header["StartTime"])
+    sample_ms = header["SamplePeriod"]
+    primera = fitxer["primera_mostra"]
+    fi = primera + fitxer["nombre_mostres"]
+    primer = (start_ms + primera * sample_ms) // period_ms
+    ultim = (start_ms + (fi - 1) * sample_ms) // period_ms
+    if primera > 0 and (start_ms + (primera - 1) * sample_ms) // period_ms == primer:
+        return None
+    if fi < header["DataLength"] and (start_ms + fi * sample_ms) // period_ms == ultim:
+        return None
+    return primer, ultim
+
+
+class CacheAgregats:
+    """
+    Memòria cau persistent (SQLite) d'agregats per fitxer de dades: una piràmide de nivells, un
+    per període de 'PERIODES_PIRAMIDE', amb els acumuladors de 'Agregat' (comptador, suma, suma de
+    quadrats, mínim, màxim i primera/última mostra) de tot el fitxer.
+
+    Cada nivell es guarda amb la mida i la data de modificació del fitxer i es descarta quan alguna
+    de les dues canvia. Una exportació a qualsevol període múltiple del més petit de la piràmide
+    llegeix el nivell més gruixut que el divideix i el reagrupa, sense tornar a descodificar les
+    mostres. La piràmide es construeix la primera vegada que s'exporta el fitxer sencer; la dels
+    fitxers amb mostres infinites o sumes massa grans per al format no es desa.
+    """
+
+    def __init__(self, db_path: str = "agregats.sqlite"):
+        self.db_path = db_path
+        with closing(self._connexio()) as con:
+            if con.execute("PRAGMA user_version").fetchone()[0] != VERSIO_CACHE:
+                # Agregats desats amb un format anterior: es tornaran a calcular.
+                with con:
+                    con.execute("DROP TABLE IF EXISTS agregats")
+                con.execute(f"PRAGMA user_version = {VERSIO_CACHE}")
+            con.executescript(_ESQUEMA)
+
+    def _connexio(self) -> sqlite3.Connection:
+        # Amb processos treballadors hi pot haver escriptures concurrents: s'espera el bloqueig.
+        return sqlite3.connect(self.db_path, timeout=60)
+
+    def nivells(self, path: str, st: os.stat_result) -> Dict[int, int]:
+        """Retorna {period_ms: nombre de buckets} dels nivells vàlids (mateixa mida i data) del fitxer."""
+        with closing(self._connexio()) as con:
+            rows = con.execute("SELECT period_ms, size, mtime_ns, buckets FROM agregats WHERE path = ?",
+                               (path,)).fetchall()
+        return {period_ms: buckets for period_ms, size, mtime_ns, buckets in rows
+                if size == st.st_size and mtime_ns == st.st_mtime_ns}
+
+    def carregar(self, path: str, period_ms: int) -> Optional[Agregat]:
+        """Llegeix un nivell de la piràmide del fitxer (sense comprovar-ne la validesa)."""
+        with closing(self._connexio()) as con:
+            row = con.execute("SELECT buckets, dades FROM agregats WHERE path = ? AND period_ms = ?",
+                              (path, period_ms)).fetchone()
+        if row is None:
+            return None
+        return deserialitzar_agregat(period_ms, row[0], row[1])
+
+    def desar(self, path: str, st: os.stat_result, nivells: Dict[int, Agregat]) -> bool:
+        """
+        Substitueix la piràmide desada del fitxer per 'nivells'. Retorna False, sense desar res, si
+        algun nivell no es pot serialitzar (vegeu 'serialitzar_agregat').
+        """
+        files = [(path, period_ms, st.st_size, st.st_mtime_ns, len(agregat), serialitzar_agregat(agregat))
+                 for period_ms, agregat in nivells.items()]
+        if any(fila[-1] is None for fila in files):
+            return False
+        with closing(self._connexio()) as con:
+            with con:
+                con.execute("DELETE FROM agregats WHERE path = ?", (path,))
+                con.executemany("INSERT INTO agregats (path, period_ms, size, mtime_ns, buckets, dades) "
+                                "VALUES (?, ?, ?, ?, ?, ?)", files)
+        return True
+
+    def _construir(self, fitxer: Dict[str, Any], st: os.stat_result, instrumentacio=None,
+                   llegir=llegir_dades_columnes) -> Optional[Dict[int, Agregat]]:
+        """
+        Descodifica el fitxer sencer (amb 'llegir', per defecte 'llegir_dades_columnes'), n'agrega les
+        mostres al període més petit de la piràmide, en calcula la resta de nivells i els desa.
+        Retorna None si alguna part no es pot llegir.
+        """
+        path, header_info = fitxer["path"], fitxer["header"]
+        carpeta = fitxer.get("carpeta")
+        base_sec = PERIODES_PIRAMIDE[0]
+        parts = [Agregat.buit(base_sec * 1000)]
+        # Els blocs d'un fitxer no se solapen: es fusionen tots de cop al final.
+        for primera, n_samples in blocs_mostres(path, header_info):
+            with mesurar_etapa(instrumentacio, carpeta, "descodificacio") as mesura:
+                columns = llegir(path, header_info, primera_mostra=primera, nombre_mostres=n_samples)
+                if columns is not None:
+                    mesura["bytes"] += n_samples * SAMPLE_DTYPE.itemsize
+                    mesura["mostres"] += n_samples
+                    mesura["nans"] += n_samples - len(columns[1])
+            if columns is None:
+                return None
+            with mesurar_etapa(instrumentacio, carpeta, "agregacio") as mesura:
+                parts.append(Agregat.des_de_mostres(columns[0], columns[1], base_sec))
+                mesura["mostres"] += len(columns[1])
+        with mesurar_etapa(instrumentacio, carpeta, "agregacio"):
+            nivells = piramide(Agregat.fusionar(parts))
+        with mesurar_etapa(instrumentacio, carpeta, "cache") as mesura:
+            if self.desar(path, st, nivells):
+                mesura["bytes"] += sum(len(agregat) for agregat in nivells.values()) * len(_CAMPS) * 8
+        return nivells
+
+    def agregat_fitxer(self, fitxer: Dict[str, Any], export_period_sec: int, instrumentacio=None,
+                       llegir=llegir_dades_columnes) -> Optional[Agregat]:
+        """
+        Retorna l'agregat a 'export_period_sec' de l'interval de mostres del fitxer preparat
+        (vegeu 'preparar_fitxers') a partir de la piràmide, o None si no es pot obtenir així:
+        període que no és múltiple de cap nivell, finestra que talla un bucket de tots els nivells
+        vàlids, o piràmide inexistent o caducada per a un fitxer que no es llegeix sencer (no es
+        reconstrueix per no llegir més mostres de les que demana l'exportació). Per construir la
+        piràmide les mostres es llegeixen amb 'llegir'.
+        """
+        period_ms = int(export_period_sec) * 1000
+        path = fitxer["path"]
+        carpeta = fitxer.get("carpeta")
+        with mesurar_etapa(instrumentacio, carpeta, "cache"):
+            st = os.stat(path)
+            disponibles = [p for p in self.nivells(path, st) if period_ms % p == 0]
+        sencer = fitxer["primera_mostra"] == 0 and fitxer["nombre_mostres"] >= fitxer["header"]["header"]["DataLength"]
+        for nivell_ms in sorted(disponibles, reverse=True):
+            rang = None if sencer else buckets_finestra(fitxer, nivell_ms)
+            if not sencer and rang is None:
+                continue
+            with mesurar_etapa(instrumentacio, carpeta, "cache") as mesura:
+                agregat = self.carregar(path, nivell_ms)
+                if agregat is None:
+                    break
+                mesura["fitxers"] += 1
+                mesura["bytes"] += len(agregat) * len(_CAMPS) * 8
+            if rang is not None:
+                agregat = agregat.seleccionar(slice(*np.searchsorted(agregat.bucket, (rang[0], rang[1] + 1))))
+            with mesurar_etapa(instrumentacio, carpeta, "agregacio"):
+                return agregat.reagrupar(export_period_sec)
+        if not sencer or period_ms % (PERIODES_PIRAMIDE[0] * 1000):
+            return None
+        nivells = self._construir(fitxer, st, instrumentacio, llegir)
+        if nivells is None:
+            return None
+        origen = max(p for p in nivells if period_ms % p == 0)
+        with mesurar_etapa(instrumentacio, carpeta, "agregacio"):
+            return nivells[origen].reagrupar(export_period_sec)
@@ -0,0 +1,127 @@
+import os
+import json
+import sqlite3
+import fnmatch
+from contextlib import closing
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+from Llegir_Fitxer_Dades import llegir_header_datafile
+
+_ESQUEMA = """
+CREATE TABLE IF NOT EXISTS fitxers (
+    path TEXT PRIMARY KEY,
+    carpeta TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    mtime_ns INTEGER NOT NULL,
+    header TEXT
+);
+CREATE INDEX IF NOT EXISTS fitxers_carpeta ON fitxers (carpeta);
+CREATE TABLE IF NOT EXISTS carpetes (
+    path TEXT NOT NULL,
+    tipus TEXT NOT NULL,
+    mtime_ns INTEGER NOT NULL,
+    entrades TEXT NOT NULL,
+    PRIMARY KEY (path, tipus)
+);
+"""
+
+
+def coincideix_filtre(nom: str, filtre: str) -> bool:
+    """
+    Indica si el nom d'una subcarpeta passa el filtre: si 'filtre' té comodins ('*', '?', '[')
+    s'interpreta com a patró glob; si no, n'hi ha prou que aparegui dins el nom (p. ex. "TR2").
+    """
+    if any(c in filtre for c in "*?["):
+        return fnmatch.fnmatchcase(nom, filtre)
+    return filtre in nom
+
+
+class CatalegCapcaleres:
+    """
+    Catàleg persistent (SQLite) de capçaleres DATAFILEHEADER i de llistats de carpetes.
+
+    Cada capçalera es guarda amb la mida i la data de modificació del fitxer, i només es torna a
+    llegir del disc quan alguna de les dues canvia. Els llistats de carpetes es guarden amb la data
+    de modificació de la carpeta, que canvia quan s'hi afegeixen, s'esborren o es reanomenen
+    entrades. Així les exportacions repetides no han de tornar a obrir cada fitxer de dades.
+    """
+
+    def __init__(self, db_path: str = "cataleg.sqlite"):
+        self.db_path = db_path
+        with closing(self._connexio()) as con:
+            con.executescript(_ESQUEMA)
+
+    def _connexio(self) -> sqlite3.Connection:
+        return sqlite3.connect(self.db_path)
+
+    def _llistat(self, folder: str, tipus: str, llistar) -> List[str]:
+        """Retorna el llistat en memòria cau de 'folder' o el recalcula amb 'llistar' si la carpeta ha canviat."""
+        mtime_ns = os.stat(folder).st_mtime_ns
+        with closing(self._connexio()) as con:
+            row = con.execute("SELECT mtime_ns, entrades FROM carpetes WHERE path = ? AND tipus = ?",
+                              (folder, tipus)).fetchone()
+            if row is not None and row[0] == mtime_ns:
+                return json.loads(row[1])
+            entrades = llistar()
+            with con:
+                con.execute("INSERT OR REPLACE INTO carpetes (path, tipus, mtime_ns, entrades) VALUES (?, ?, ?, ?)",
+                            (folder, tipus, mtime_ns, json.dumps(entrades)))
+            return entrades
+
+    def llistar_subcarpetes(self, source_folder: str, filtre: str = "TR2") -> List[str]:
+        """Retorna les subcarpetes de 'source_folder' que coincideixen amb 'filtre' (vegeu 'coincideix_filtre')."""
+        def llistar():
+            with os.scandir(source_folder) as it:
+                return sorted(entry.name for entry in it if entry.is_dir() and coincideix_filtre(entry.name, filtre))
+        names = self._llistat(source_folder, "subcarpetes:" + filtre, llistar)
+        return [os.path.join(source_folder, name) for name in names]
+
+    def llistar_fitxers_dades(self, source_folder: str) -> List[str]:
+        """Retorna, ordenats, els noms dels fitxers de dades (extensió numèrica) d'una subcarpeta."""
+        def llistar():
+            with os.scandir(source_folder) as it:
+                return sorted(entry.name for entry in it
+                              if os.path.splitext(entry.name)[1][1:].isdigit())
+        return self._llistat(source_folder, "fitxers", llistar)
+
+    def capcaleres(self, source_folder: str,
+                   data_files: Sequence[str]) -> List[Tuple[str, Optional[Dict[str, Any]]]]:
+        """
+        Retorna (ruta, capçalera) per a cada fitxer de 'data_files', en el mateix ordre.
+
+        Les mides i dates de modificació s'obtenen d'un sol llistat de la carpeta; només es llegeixen
+        del disc les capçaleres dels fitxers nous o modificats. La capçalera és None si no es pot llegir.
+        """
+        stats = {}
+        with os.scandir(source_folder) as it:
+            for entry in it:
+                stats[entry.name] = entry.stat()
+
+        with closing(self._connexio()) as con:
+            cached = {path: (size, mtime_ns, header) for path, size, mtime_ns, header in
+                      con.execute("SELECT path, size, mtime_ns, header FROM fitxers WHERE carpeta = ?",
+                                  (source_folder,))}
+            result = []
+            updates = []
+            for data_file in data_files:
+                path = os.path.join(source_folder, data_file)
+                st = stats.get(data_file)
+                if st is None:
+                    result.append((path, None))
+                    continue
+                entry = cached.get(path)
+                if entry is not None and entry[0] == st.st_size and entry[1] == st.st_mtime_ns:
+                    header_info = json.loads(entry[2]) if entry[2] is not None else None
+                else:
+                    header_info = llegir_header_datafile(path)
+                    updates.append((path, source_folder, st.st_size, st.st_mtime_ns,
+                                    json.dumps(header_info) if header_info else None))
+                result.append((path, header_info))
+
+            gone = [(path,) for path in cached if os.path.basename(path) not in stats]
+            if updates or gone:
+                with con:
+                    con.executemany("INSERT OR REPLACE INTO fitxers (path, carpeta, size, mtime_ns, header) "
+                                    "VALUES (?, ?, ?, ?, ?)", updates)
+                    con.executemany("DELETE FROM fitxers WHERE path = ?", gone)
+        return result
@@ -0,0 +1,301 @@
+import io
+import os
+import csv
+import gzip
+from abc import ABC, abstractmethod
+from itertools import repeat
+from typing import List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from Agregar_Mostres import Agregat
+
+# Capçalera (nom de columna) de cada estadística exportable.
+STATISTIC_HEADERS = {
+    "mean": "Value",
+    "min": "Min",
+    "max": "Max",
+    "count": "Count",
+    "first": "First",
+    "last": "Last",
+    "std": "Std"
+}
+
+# Formats de sortida i compressions admeses per cadascun (None = sense compressió).
+FORMATS_SORTIDA = {
+    "csv": (None, "gzip", "zstd"),
+    "parquet": (None, "snappy", "gzip", "zstd"),
+    "feather": (None, "lz4", "zstd"),
+}
+
+# Decimals amb què s'exporten els valors (com a l'export CSV original).
+DECIMALS = 3
+
+# Codificació de la capçalera CSV de la taula ampla: els noms de columna porten títols i unitats
+# (p. ex. "°C") i, amb el BOM, Excel els obre com a UTF-8 en lloc de la pàgina de codis local.
+CODIFICACIO_TAULA_AMPLA = "utf-8-sig"
+
+# Posicions de 'YYYY-MM-DDTHH:MM:SS' que formen 'DD/MM/YYYY HH:MM:SS'.
+_ORDRE_TEMPS = np.array([8, 9, 4, 5, 6, 7, 0, 1, 2, 3, 10, 11, 12, 13, 14, 15, 16, 17, 18])
+
+
+def extensio_sortida(output_format: str = "csv", compression: Optional[str] = None) -> str:
+    """Retorna l'extensió del fitxer de sortida per a un format i una compressió."""
+    if output_format not in FORMATS_SORTIDA:
+        raise ValueError(f"Format de sortida desconegut: {output_format}")
+    if compression not in FORMATS_SORTIDA[output_format]:
+        raise ValueError(f"Compressió '{compression}' no admesa pel format {output_format}")
+    if output_format == "csv":
+        return ".csv" + {None: "", "gzip": ".gz", "zstd": ".zst"}[compression]
+    return "." + output_format
+
+
+def formatar_temps(temps_ms: np.ndarray) -> List[str]:
+    """
+    Formata en bloc els timestamps (ms epoch UTC) com a 'dd/mm/YYYY HH:MM:SS', sense passar per
+    datetime.strftime per a cada fila: es reordenen els bytes de la representació ISO de NumPy.
+    """
+    seconds = (np.asarray(temps_ms, dtype=np.int64) // 1000).astype("datetime64[s]")
+    iso = np.datetime_as_string(seconds, unit="s").astype("S19")
+    chars = iso.view(np.uint8).reshape(-1, 19)[:, _ORDRE_TEMPS]
+    chars[:, 2] = chars[:, 5] = ord("/")
+    chars[:, 10] = ord(" ")
+    return np.ascontiguousarray(chars).view("S19").ravel().astype("U19").tolist()
+
+
+def arrodonir(valors: np.ndarray) -> List[float]:
+    """
+    Arrodoneix els valors a 'DECIMALS' amb el 'round' de Python (arrodoniment correcte sobre el
+    valor decimal exacte), que en els casos límit pot diferir de np.round.
+    """
+    return list(map(round, valors.tolist(), repeat(DECIMALS)))
+
+
+def formatar_columna(nom: str, valors: np.ndarray) -> List[str]:
+    """
+    Formata en bloc una columna d'estadístiques igual que ho fa el mòdul csv (repr dels valors
+    arrodonits). Els NaN (buckets sense dades en una taula ampla) es deixen buits.
+    """
+    buits = np.isnan(valors) if valors.dtype.kind == "f" else None
+    if buits is not None and not buits.any():
+        buits = None
+    if nom == "count":
+        enters = valors if buits is None else np.where(buits, 0, valors)
+        text = list(map(str, enters.astype(np.int64).tolist()))
+    else:
+        text = list(map(repr, arrodonir(valors)))
+    if buits is not None:
+        for i in np.flatnonzero(buits).tolist():
+            text[i] = ""
+    return text
+
+
+def columnes_estadistiques(statistics: Sequence[str]) -> List[Tuple[str, str]]:
+    """Retorna les columnes (capçalera, estadística) d'un export d'una sola subcarpeta."""
+    return [(STATISTIC_HEADERS[name], name) for name in statistics]
+
+
+class Escriptor(ABC):
+    """
+    Etapa de sortida d'una exportació. Rep blocs d'agregats en ordre de temps amb 'escriure' (o
+    files ja calculades amb 'escriure_columnes'), i 'tancar' deixa el fitxer definitiu. Els fitxers
+    nous s'escriuen a '<fitxer>.part' i només substitueixen l'anterior en tancar; 'avortar'
+    descarta el que s'ha escrit.
+
+    'columnes' són parells (capçalera, estadística) i, per defecte, les de 'statistics'.
+    """
+
+    def __init__(self, path: str, statistics: Sequence[str],
+                 columnes: Optional[Sequence[Tuple[str, str]]] = None):
+        self.path = path
+        self.part_path = path + ".part"
+        self.statistics = tuple(statistics)
+        self.columnes = list(columnes) if columnes is not None else columnes_estadistiques(self.statistics)
+        # (offset, inici del bucket en ms) de l'última fila escrita, si el format ho permet.
+        self.ultima_fila: Optional[Tuple[int, int]] = None
+
+    def escriure(self, bloc: Agregat) -> None:
+        if not len(bloc):
+            return
+        columns = bloc.estadistiques(self.statistics)
+        self.escriure_columnes(bloc.temps_ms, [columns[name] for name in self.statistics])
+
+    @abstractmethod
+    def escriure_columnes(self, temps_ms: np.ndarray, valors: Sequence[np.ndarray]) -> None:
+        """Escriu una fila per bucket: 'valors' té un array per cada element de 'columnes'."""
+
+    @abstractmethod
+    def tancar(self) -> None:
+        """Tanca la sortida i deixa el fitxer definitiu."""
+
+    @abstractmethod
+    def avortar(self) -> None:
+        """Tanca la sortida i descarta el que s'ha escrit."""
+
+
+class EscriptorCSV(Escriptor):
+    """
+    Escriptor CSV que formata cada bloc sencer de cop (timestamps i valors en bloc) i l'escriu
+    amb una sola crida, opcionalment comprimit en streaming amb gzip o zstd.
+
+    Amb 'offset' (només sense compressió) el CSV existent es trunca en aquesta posició i les files
+    noves s'hi afegeixen; si l'escriptura s'avorta, es restaura el contingut truncat.
+
+    'codificacio' és la de la capçalera ("utf-8-sig" hi afegeix el BOM); les files són ASCII.
+    """
+
+    def __init__(self, path: str, statistics: Sequence[str], compression: Optional[str] = None,
+                 offset: Optional[int] = None, columnes: Optional[Sequence[Tuple[str, str]]] = None,
+                 codificacio: str = "utf-8"):
+        super().__init__(path, statistics, columnes)
+        self.offset = offset
+        self._cua_original = None
+        self._raw = None
+        if offset is not None:
+            if compression is not None:
+                raise ValueError("No es pot afegir a un CSV comprimit.")
+            with open(path, "rb") as f:
+                f.seek(offset)
+                self._cua_original = f.read()
+            os.truncate(path, offset)
+            self._file = open(path, "ab")
+            self.posicio = offset
+            return
+
+        if compression is None:
+            self._file = open(self.part_path, "wb")
+        elif compression == "gzip":
+            self._file = gzip.open(self.part_path, "wb")
+        elif compression == "zstd":
+            try:
+                import zstandard
+            except ImportError:
+                raise ImportError("Cal instal·lar 'zstandard' per comprimir amb zstd.")
+            self._raw = open(self.part_path, "wb")
+            self._file = zstandard.ZstdCompressor().stream_writer(self._raw)
+        else:
+            raise ValueError(f"Compressió '{compression}' no admesa pel format csv")
+        self.posicio = 0
+        capcalera = io.StringIO()
+        csv.writer(capcalera).writerow(["Time"] + [header for header, _ in self.columnes])
+        self._escriure_bytes(capcalera.getvalue().encode(codificacio))
+
+    def _escriure_bytes(self, data: bytes) -> None:
+        self._file.write(data)
+        self.posicio += len(data)
+
+    def escriure_columnes(self, temps_ms: np.ndarray, valors: Sequence[np.ndarray]) -> None:
+        if not len(temps_ms):
+            return
+        rows = list(map(",".join, zip(formatar_temps(temps_ms),
+                                      *(formatar_columna(name, column)
+                                        for (_, name), column in zip(self.columnes, valors)))))
+        last = (rows.pop() + "\r\n").encode("ascii")
+        body = ("\r\n".join(rows) + "\r\n").encode("ascii") if rows else b""
+        self.ultima_fila = (self.posicio + len(body), int(temps_ms[-1]))
+        self._escriure_bytes(body + last)
+
+    def _tancar_fitxers(self) -> None:
+        self._file.close()
+        if self._raw is not None:
+            self._raw.close()
+
+    def tancar(self) -> None:
+        self._tancar_fitxers()
+        if self.offset is None:
+            os.replace(self.part_path, self.path)
+
+    def avortar(self) -> None:
+        self._tancar_fitxers()
+        if self.offset is None:
+            os.remove(self.part_path)
+        else:
+            os.truncate(self.path, self.offset)
+            with open(self.path, "ab") as f:
+                f.write(self._cua_original)
+
+
+class EscriptorArrow(Escriptor):
+    """
+    Escriptor columnar binari amb pyarrow: Parquet (un row group per bloc) o Feather v2 (fitxer
+    Arrow IPC, un record batch per bloc). La columna 'Time' és un timestamp en mil·lisegons (UTC) i
+    els valors s'arrodoneixen com al CSV. Els NaN (buckets sense dades) s'escriuen com a nuls.
+    """
+
+    def __init__(self, path: str, statistics: Sequence[str], output_format: str = "parquet",
+                 compression: Optional[str] = None, columnes: Optional[Sequence[Tuple[str, str]]] = None):
+        super().__init__(path, statistics, columnes)
+        try:
+            import pyarrow as pa
+            import pyarrow.ipc
+            import pyarrow.parquet
+        except ImportError:
+            raise ImportError("Cal instal·lar 'pyarrow' per exportar a Parquet o Feather.")
+        self._pa = pa
+        self.schema = pa.schema([("Time", pa.timestamp("ms"))] + [
+            (header, pa.int64() if name == "count" else pa.float64()) for header, name in self.columnes])
+        if output_format == "parquet":
+            self._writer = pa.parquet.ParquetWriter(self.part_path, self.schema, compression=compression or "none")
+            self._sink = None
+        elif output_format == "feather":
+            self._sink = pa.OSFile(self.part_path, "wb")
+            self._writer = pa.ipc.new_file(self._sink, self.schema,
+                                           options=pa.ipc.IpcWriteOptions(compression=compression))
+        else:
+            raise ValueError(f"Format de sortida desconegut: {output_format}")
+
+    def escriure_columnes(self, temps_ms: np.ndarray, valors: Sequence[np.ndarray]) -> None:
+        if not len(temps_ms):
+            return
+        pa = self._pa
+        arrays = [pa.array(temps_ms, type=pa.timestamp("ms"))]
+        for (_, name), column in zip(self.columnes, valors):
+            buits = np.isnan(column) if column.dtype.kind == "f" else None
+            if name == "count":
+                values = column if buits is None else np.where(buits, 0, column).astype(np.int64)
+                arrays.append(pa.array(values, type=pa.int64(), mask=buits))
+            else:
+                arrays.append(pa.array(np.array(arrodonir(column)), type=pa.float64(), mask=buits))
+        batch = pa.record_batch(arrays, schema=self.schema)
+        if self._sink is None:
+            self._writer.write_table(pa.Table.from_batches([batch]))
+        else:
+            self._writer.write_batch(batch)
+
+    def _tancar_fitxers(self) -> None:
+        self._writer.close()
+        if self._sink is not None:
+            self._sink.close()
+
+    def tancar(self) -> None:
+        self._tancar_fitxers()
+        os.replace(self.part_path, self.path)
+
+    def avortar(self) -> None:
+        self._tancar_fitxers()
+        os.remove(self.part_path)
+
+
+def crear_escriptor(path: str, statistics: Sequence[str], output_format: str = "csv",
+                    compression: Optional[str] = None, offset: Optional[int] = None,
+                    columnes: Optional[Sequence[Tuple[str, str]]] = None,
+                    codificacio: str = "utf-8") -> Escriptor:
+    """
+    Crea l'escriptor adequat per al format i la compressió indicats.
+
+    Args:
+        path (str): Ruta del fitxer de sortida.
+        statistics (list): Estadístiques a escriure com a columnes.
+        output_format (str, opcional): "csv", "parquet" o "feather".
+        compression (str, opcional): Compressió (vegeu 'FORMATS_SORTIDA').
+        offset (int, opcional): Només CSV sense compressió: afegeix a partir d'aquesta posició.
+        columnes (list, opcional): Parells (capçalera, estadística) de les columnes a escriure amb
+            'escriure_columnes' (per defecte, les de 'statistics').
+        codificacio (str, opcional): Només CSV: codificació de la capçalera (p. ex. "utf-8-sig").
+    """
+    extensio_sortida(output_format, compression)
+    if output_format == "csv":
+        return EscriptorCSV(path, statistics, compression, offset, columnes, codificacio)
+    if offset is not None:
+        raise ValueError(f"El format {output_format} no admet exportació incremental.")
+    return EscriptorArrow(path, statistics, output_format, compression, columnes)
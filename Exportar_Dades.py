@@ -0,0 +1,1181 @@
+import os
+import json
+import heapq
+import queue
+import threading
+import datetime
+from math import gcd
+from functools import reduce
+from contextlib import ExitStack, contextmanager, nullcontext
+from typing import Any, Callable, Dict, Iterator, List, Optional, Sequence, Tuple, Union
+
+import numpy as np
+
+from Llegir_Fitxer_Dades import (HEADER_SIZE, SAMPLE_DTYPE, llegir_header_datafile, llegir_dades_columnes,
+                                 blocs_mostres, filetime_a_epoch_ms, rang_mostres)
+from Agregar_Mostres import EPOCH, Agregat
+from Cataleg_Capcaleres import coincideix_filtre
+from Instrumentacio import Instrumentacio, mesurar_etapa
+from Escriptors_Sortida import CODIFICACIO_TAULA_AMPLA, STATISTIC_HEADERS, crear_escriptor, extensio_sortida
+from Lectura_Anticipada import MEMORIA_LECTURA_MB, LecturaAnticipada, llegir_capcaleres
+
+# Nom base del fitxer de l'exportació en taula ampla (se li afegeix el període i l'extensió).
+NOM_TAULA_AMPLA = "taula_ampla"
+
+# Nombre màxim de mostres que es llegeixen de cop d'un fitxer.
+MIDA_BLOC = 1 << 20
+
+
+class ExportacioCancellada(Exception):
+    """L'exportació s'ha aturat a petició de l'usuari (entre dos fitxers)."""
+
+
+def datetime_a_epoch_ms(dt: Optional[datetime.datetime]) -> Optional[int]:
+    """Converteix un datetime UTC sense zona horària (com els del CSV) a mil·lisegons epoch."""
+    if dt is None:
+        return None
+    return (dt - EPOCH) // datetime.timedelta(milliseconds=1)
+
+
+def llistar_fitxers_dades(source_folder: str, cataleg=None) -> List[str]:
+    """
+    Retorna, ordenats, els noms dels fitxers de dades (extensió numèrica) d'una subcarpeta.
+    Si es passa un 'CatalegCapcaleres', el llistat es respon des del catàleg.
+    """
+    if cataleg is not None:
+        return cataleg.llistar_fitxers_dades(source_folder)
+    data_files = [f for f in os.listdir(source_folder)
+                  if os.path.splitext(f)[1][1:].isdigit()]
+    data_files.sort()
+    return data_files
+
+
+def llistar_subcarpetes(source_folder: str, filtre: str = "TR2", cataleg=None) -> List[str]:
+    """
+    Retorna, ordenades, les rutes de les subcarpetes de 'source_folder' que coincideixen amb
+    'filtre' (vegeu 'coincideix_filtre'). Si es passa un 'CatalegCapcaleres', es respon des del catàleg.
+    """
+    if cataleg is not None:
+        return cataleg.llistar_subcarpetes(source_folder, filtre)
+    with os.scandir(source_folder) as it:
+        names = sorted(entry.name for entry in it if entry.is_dir() and coincideix_filtre(entry.name, filtre))
+    return [os.path.join(source_folder, name) for name in names]
+
+
+def rang_temporal(header_info: Dict[str, Any]) -> Optional[Tuple[int, int]]:
+    """
+    Calcula el rang temporal (inici, fi) en mil·lisegons epoch UTC que cobreixen les mostres
+    d'un fitxer a partir de la seva capçalera. Es pren el màxim entre 'EndTime' i el final
+    implícit per 'DataLength' * 'SamplePeriod'.
+    """
+    header = header_info["header"]
+    start_ms = filetime_a_epoch_ms(header["StartTime"])
+    if start_ms is None:
+        return None
+    end_ms = start_ms + max(header["DataLength"] - 1, 0) * header["SamplePeriod"]
+    if header["EndTime"] > header["StartTime"]:
+        end_ms = max(end_ms, filetime_a_epoch_ms(header["EndTime"]))
+    return start_ms, end_ms
+
+
+def preparar_fitxers(source_folder: str, data_files: Sequence[str], log_messages: List[str],
+                     progress_callback=None, cataleg=None, inici_ms: Optional[int] = None,
+                     fi_ms: Optional[int] = None, fils: int = 1) -> List[Dict[str, Any]]:
+    """
+    Llegeix la capçalera de cada fitxer i retorna la llista de fitxers ordenada per 'StartTime'.
+
+    Cada element és un diccionari amb 'path', 'carpeta', 'header', 'start_ms', 'end_ms' i l'interval de
+    mostres a llegir ('primera_mostra', 'nombre_mostres'). Els fitxers amb la capçalera il·legible
+    s'anoten a 'log_messages' i compten ja com a processats. Si es passa un 'CatalegCapcaleres',
+    només es llegeixen del disc les capçaleres que han canviat.
+
+    Amb una finestra temporal [inici_ms, fi_ms) es descarten, sense obrir-los, els fitxers que no
+    la intersecten, i dels fitxers de les vores només es llegeixen les mostres dins la finestra.
+
+    Sense catàleg i amb 'fils' > 1, les capçaleres es llegeixen en paral·lel en un pool de fils.
+    """
+    if cataleg is not None:
+        capcaleres = cataleg.capcaleres(source_folder, data_files)
+    elif fils > 1:
+        capcaleres = llegir_capcaleres([os.path.join(source_folder, data_file) for data_file in data_files], fils)
+    else:
+        capcaleres = ((path, llegir_header_datafile(path))
+                      for path in (os.path.join(source_folder, data_file) for data_file in data_files))
+    fitxers = []
+    for data_file_path, header_info in capcaleres:
+        rang = rang_temporal(header_info) if header_info else None
+        if rang is None:
+            if not header_info:
+                log_messages.append(f"[!] Error llegint la capçalera del fitxer: {data_file_path}")
+            if progress_callback:
+                progress_callback()
+            continue
+        fitxers.append({"path": data_file_path, "carpeta": source_folder, "header": header_info,
+                        "start_ms": rang[0], "end_ms": rang[1],
+                        "primera_mostra": 0, "nombre_mostres": header_info["header"]["DataLength"]})
+    fitxers.sort(key=lambda f: f["start_ms"])
+    return aplicar_finestra(fitxers, inici_ms, fi_ms, progress_callback)
+
+
+def aplicar_finestra(fitxers: Sequence[Dict[str, Any]], inici_ms: Optional[int] = None, fi_ms: Optional[int] = None,
+                     progress_callback=None) -> List[Dict[str, Any]]:
+    """
+    Limita els fitxers preparats a la finestra temporal [inici_ms, fi_ms).
+
+    Els fitxers que no la intersecten es descarten (i compten com a processats); dels altres
+    només es llegiran les mostres dins la finestra.
+    """
+    if inici_ms is None and fi_ms is None:
+        return list(fitxers)
+    result = []
+    for fitxer in fitxers:
+        primera, ultima = rang_mostres(fitxer["header"], inici_ms, fi_ms)
+        if primera >= ultima:
+            if progress_callback:
+                progress_callback()
+            continue
+        period_ms = fitxer["header"]["header"]["SamplePeriod"]
+        start_ms = fitxer["start_ms"] + primera * period_ms
+        end_ms = fitxer["end_ms"]
+        if fi_ms is not None:
+            end_ms = min(end_ms, start_ms + (ultima - primera - 1) * period_ms)
+        result.append(dict(fitxer, start_ms=start_ms, end_ms=end_ms,
+                           primera_mostra=primera, nombre_mostres=ultima - primera))
+    return result
+
+
+def parcials_fitxer(fitxer: Dict[str, Any], export_period_sec: int, mida_bloc: int = MIDA_BLOC,
+                    instrumentacio: Optional[Instrumentacio] = None, cache_agregats=None,
+                    llegir=llegir_dades_columnes) -> Iterator[Agregat]:
+    """
+    Llegeix l'interval de mostres d'un fitxer bloc a bloc i retorna l'agregat parcial de cada bloc.
+    Si un bloc no es pot llegir, s'atura la lectura del fitxer (l'error ja queda registrat al log).
+
+    Amb un 'CacheAgregats', si la piràmide d'agregats del fitxer pot donar l'agregat de l'interval
+    es retorna aquest agregat sencer sense descodificar cap mostra.
+
+    'llegir' llegeix cada bloc (per defecte 'llegir_dades_columnes'; vegeu 'LecturaAnticipada.llegir').
+    """
+    if cache_agregats is not None:
+        agregat = cache_agregats.agregat_fitxer(fitxer, export_period_sec, instrumentacio, llegir)
+        if agregat is not None:
+            if len(agregat):
+                yield agregat
+            return
+    path, header_info = fitxer["path"], fitxer["header"]
+    carpeta = fitxer.get("carpeta")
+    for primera, n_samples in blocs_mostres(path, header_info, mida_bloc, fitxer["primera_mostra"],
+                                            fitxer["nombre_mostres"]):
+        with mesurar_etapa(instrumentacio, carpeta, "descodificacio") as mesura:
+            columns = llegir(path, header_info, primera_mostra=primera, nombre_mostres=n_samples)
+            if columns is not None:
+                mesura["bytes"] += n_samples * SAMPLE_DTYPE.itemsize
+                mesura["mostres"] += n_samples
+                mesura["nans"] += n_samples - len(columns[1])
+        if columns is None:
+            return
+        timestamps, values = columns
+        if len(timestamps):
+            with mesurar_etapa(instrumentacio, carpeta, "agregacio") as mesura:
+                part = Agregat.des_de_mostres(timestamps, values, export_period_sec)
+                mesura["mostres"] += len(values)
+            yield part
+
+
+def hi_ha_solapaments(fitxers: Sequence[Dict[str, Any]]) -> bool:
+    """Indica si algun fitxer (ordenats per inici) comença abans que acabi algun dels anteriors."""
+    end_ms = None
+    for fitxer in fitxers:
+        if end_ms is not None and fitxer["start_ms"] <= end_ms:
+            return True
+        end_ms = fitxer["end_ms"] if end_ms is None else max(end_ms, fitxer["end_ms"])
+    return False
+
+
+def iterar_agregats(fitxers: Sequence[Dict[str, Any]], export_period_sec: int, progress_callback=None,
+                    obrir: Optional[Callable[[Dict[str, Any]], Iterator[Agregat]]] = None,
+                    file_callback=None, cancel_event=None, instrumentacio: Optional[Instrumentacio] = None,
+                    cache_agregats=None) -> Iterator[Agregat]:
+    """
+    Pipeline en streaming: plega els agregats parcials de cada fitxer en acumuladors per bucket
+    i retorna, en ordre de temps, els blocs de buckets que ja no poden rebre més mostres.
+
+    Si els fitxers no se solapen es llegeixen un rere l'altre i, després de cada bloc, es tanquen
+    els buckets anteriors a l'última mostra llegida. Si se solapen, es fa una fusió k-way dels
+    blocs de tots els fitxers oberts i només es tanquen els buckets anteriors a la mostra més
+    antiga pendent de llegir. La memòria necessària no depèn de la mida total de l'arxiu.
+
+    Args:
+        fitxers (list): Fitxers retornats per 'preparar_fitxers'.
+        export_period_sec (int): Durada del bucket en segons.
+        progress_callback (func, opcional): Funció cridada en acabar cada fitxer.
+        obrir (func, opcional): Retorna els agregats parcials d'un fitxer (per defecte 'parcials_fitxer').
+        file_callback (func, opcional): Funció cridada amb la ruta de cada fitxer en acabar-lo.
+        cancel_event (threading.Event, opcional): Si s'activa, es llença 'ExportacioCancellada'
+            abans d'obrir el fitxer següent.
+        instrumentacio (Instrumentacio, opcional): Mesura la descodificació, l'agregació i la fusió.
+        cache_agregats (CacheAgregats, opcional): Piràmide d'agregats per fitxer (per defecte 'obrir').
+
+    Yields:
+        Agregat: Blocs de buckets tancats, ordenats i sense repeticions.
+    """
+    if obrir is None:
+        def obrir(fitxer):
+            return parcials_fitxer(fitxer, export_period_sec, instrumentacio=instrumentacio,
+                                   cache_agregats=cache_agregats)
+    obert = Agregat.buit(int(export_period_sec) * 1000)
+    carpeta = fitxers[0].get("carpeta") if fitxers else None
+
+    def fitxer_acabat(fitxer):
+        if progress_callback:
+            progress_callback()
+        if file_callback:
+            file_callback(fitxer["path"])
+
+    def comprovar_cancellacio():
+        if cancel_event is not None and cancel_event.is_set():
+            raise ExportacioCancellada()
+
+    if not hi_ha_solapaments(fitxers):
+        for fitxer in fitxers:
+            comprovar_cancellacio()
+            for part in obrir(fitxer):
+                with mesurar_etapa(instrumentacio, carpeta, "fusio"):
+                    tancat, obert = Agregat.fusionar([obert, part]).tallar(int(part.last_ts[-1]))
+                if len(tancat):
+                    yield tancat
+            fitxer_acabat(fitxer)
+    else:
+        # Cada fitxer té com a màxim una entrada al heap: (primer timestamp pendent, índex, bloc).
+        # Una entrada sense bloc indica un fitxer encara per obrir.
+        heap: List[Tuple[int, int, Optional[Agregat]]] = [(f["start_ms"], i, None) for i, f in enumerate(fitxers)]
+        heapq.heapify(heap)
+        iterators: Dict[int, Iterator[Agregat]] = {}
+        while heap:
+            _, i, part = heapq.heappop(heap)
+            if part is None:
+                comprovar_cancellacio()
+                iterators[i] = obrir(fitxers[i])
+            else:
+                with mesurar_etapa(instrumentacio, carpeta, "fusio"):
+                    obert = Agregat.fusionar([obert, part])
+            seguent = next(iterators[i], None)
+            if seguent is not None:
+                heapq.heappush(heap, (int(seguent.first_ts[0]), i, seguent))
+            else:
+                del iterators[i]
+                fitxer_acabat(fitxers[i])
+            if heap:
+                with mesurar_etapa(instrumentacio, carpeta, "fusio"):
+                    tancat, obert = obert.tallar(heap[0][0])
+                if len(tancat):
+                    yield tancat
+    if len(obert):
+        yield obert
+
+
+def normalitzar_periodes(export_period_sec: Union[int, Sequence[int]]) -> List[int]:
+    """Retorna la llista ordenada i sense repeticions dels períodes d'exportació (un enter o una seqüència)."""
+    periodes = [export_period_sec] if isinstance(export_period_sec, int) else export_period_sec
+    periodes = sorted({int(periode) for periode in periodes})
+    if not periodes or periodes[0] <= 0:
+        raise ValueError("Cal com a mínim un període d'exportació positiu.")
+    return periodes
+
+
+def periode_base(periodes: Sequence[int]) -> int:
+    """Període (en segons) al qual s'agreguen les mostres per derivar-ne tots els de 'periodes': el seu MCD."""
+    return reduce(gcd, periodes)
+
+
+def iterar_periodes(blocs: Iterator[Agregat], periodes: Sequence[int], instrumentacio: Optional[Instrumentacio] = None,
+                    carpeta: Optional[str] = None) -> Iterator[Tuple[int, Agregat]]:
+    """
+    A partir dels blocs de buckets tancats d'un període base (vegeu 'iterar_agregats'), retorna
+    (període, bloc) amb els blocs de buckets tancats de cada període de 'periodes', que han de ser
+    múltiples del període base. Cada bucket es calcula amb 'Agregat.reagrupar' a partir dels
+    acumuladors del període base (amb sumes enteres, de manera que el resultat és idèntic al d'una
+    exportació d'aquell període sol), i només es guarda el bucket obert de cada període.
+    """
+    oberts: Dict[int, Agregat] = {}
+    for bloc in blocs:
+        # Els buckets base fins a l'últim del bloc ja són definitius.
+        fins_ms = (int(bloc.bucket[-1]) + 1) * bloc.period_ms
+        for export_period_sec in periodes:
+            with mesurar_etapa(instrumentacio, carpeta, "agregacio"):
+                part = bloc.reagrupar(export_period_sec)
+                obert = oberts.get(export_period_sec)
+                obert = part if obert is None else Agregat.fusionar([obert, part])
+                tancat, oberts[export_period_sec] = obert.tallar(fins_ms)
+            if len(tancat):
+                yield export_period_sec, tancat
+    for export_period_sec, obert in oberts.items():
+        if len(obert):
+            yield export_period_sec, obert
+
+
+def escriure_sortida(output_filename: str, blocs: Iterator[Agregat], statistics: Sequence[str] = ("mean",),
+                     output_format: str = "csv", compression: Optional[str] = None,
+                     offset: Optional[int] = None, instrumentacio: Optional[Instrumentacio] = None,
+                     carpeta: Optional[str] = None) -> Tuple[int, Optional[Tuple[int, int]]]:
+    """
+    Escriu els blocs d'agregats al fitxer de sortida a mesura que arriben (vegeu 'Escriptors_Sortida').
+
+    El fitxer només es crea (o es modifica) quan arriba el primer bloc amb dades. Si l'escriptura
+    s'interromp, l'escriptor descarta el fitxer a mig fer o restaura el CSV al qual s'afegia.
+    Amb 'instrumentacio' el temps d'escriptura es compta a l'etapa "escriptura" de 'carpeta'.
+
+    Returns:
+        tuple: (nombre de files escrites, (offset, inici del bucket en ms) de l'última fila o None)
+    """
+    escriptor = None
+    rows_written = 0
+    carpeta = carpeta or output_filename
+    try:
+        for bloc in blocs:
+            if not len(bloc):
+                continue
+            with mesurar_etapa(instrumentacio, carpeta, "escriptura") as mesura:
+                if escriptor is None:
+                    escriptor = crear_escriptor(output_filename, statistics, output_format, compression, offset)
+                escriptor.escriure(bloc)
+                mesura["files"] += len(bloc)
+            rows_written += len(bloc)
+    except BaseException:
+        if escriptor is not None:
+            escriptor.avortar()
+        raise
+    if escriptor is None:
+        return 0, None
+    with mesurar_etapa(instrumentacio, carpeta, "escriptura") as mesura:
+        escriptor.tancar()
+        mesura["bytes"] += os.path.getsize(output_filename) - (offset or 0)
+    return rows_written, escriptor.ultima_fila
+
+
+def escriure_csv(csv_filename: str, blocs: Iterator[Agregat], statistics: Sequence[str] = ("mean",),
+                 offset: Optional[int] = None) -> Tuple[int, Optional[Tuple[int, int]]]:
+    """Escriu els blocs d'agregats a un CSV (vegeu 'escriure_sortida')."""
+    return escriure_sortida(csv_filename, blocs, statistics, offset=offset)
+
+
+def escriure_sortides(output_filenames: Dict[int, str], blocs: Iterator[Tuple[int, Agregat]],
+                      statistics: Sequence[str] = ("mean",), output_format: str = "csv",
+                      compression: Optional[str] = None, instrumentacio: Optional[Instrumentacio] = None,
+                      carpeta: Optional[str] = None) -> Dict[int, int]:
+    """
+    Escriu els blocs (període, bloc) de 'iterar_periodes' al fitxer de sortida de cada període
+    (vegeu 'escriure_sortida'). Si l'escriptura s'interromp, es descarten tots els fitxers a mig fer.
+
+    Returns:
+        dict: {període: nombre de files escrites}
+    """
+    escriptors = {}
+    rows_written = dict.fromkeys(output_filenames, 0)
+    try:
+        for export_period_sec, bloc in blocs:
+            with mesurar_etapa(instrumentacio, carpeta, "escriptura") as mesura:
+                escriptor = escriptors.get(export_period_sec)
+                if escriptor is None:
+                    escriptor = escriptors[export_period_sec] = crear_escriptor(
+                        output_filenames[export_period_sec], statistics, output_format, compression)
+                escriptor.escriure(bloc)
+                mesura["files"] += len(bloc)
+            rows_written[export_period_sec] += len(bloc)
+    except BaseException:
+        for escriptor in escriptors.values():
+            escriptor.avortar()
+        raise
+    for export_period_sec, escriptor in escriptors.items():
+        with mesurar_etapa(instrumentacio, carpeta, "escriptura") as mesura:
+            escriptor.tancar()
+            mesura["bytes"] += os.path.getsize(output_filenames[export_period_sec])
+    return rows_written
+
+
+def _ruta_watermark(csv_filename: str) -> str:
+    return csv_filename + ".watermark.json"
+
+
+def _estat_fitxers(fitxers: Sequence[Dict[str, Any]]) -> Dict[str, Dict[str, int]]:
+    """Mida, data de modificació i rang temporal de cada fitxer, per detectar canvis entre exportacions."""
+    estat = {}
+    for fitxer in fitxers:
+        st = os.stat(fitxer["path"])
+        estat[os.path.basename(fitxer["path"])] = {"size": st.st_size, "mtime_ns": st.st_mtime_ns,
+                                                   "start_ms": fitxer["start_ms"], "end_ms": fitxer["end_ms"]}
+    return estat
+
+
+def llegir_watermark(csv_filename: str) -> Optional[Dict[str, Any]]:
+    """Llegeix el watermark desat al costat del CSV (vegeu 'desar_watermark') sense validar-lo."""
+    try:
+        with open(_ruta_watermark(csv_filename), "r") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def carregar_watermark(csv_filename: str, export_period_sec: int, statistics: Sequence[str],
+                       estat: Dict[str, Dict[str, int]]) -> Optional[Dict[str, Any]]:
+    """
+    Carrega el watermark desat al costat del CSV i comprova que permet una exportació incremental.
+
+    Retorna None (cal exportar-ho tot) si no hi ha watermark, si el període o les columnes han
+    canviat, si el CSV s'ha modificat des de l'última exportació o si algun fitxer anterior al
+    watermark ha canviat, ha desaparegut o és nou.
+    """
+    marca = llegir_watermark(csv_filename)
+    if marca is None:
+        return None
+    try:
+        st = os.stat(csv_filename)
+    except OSError:
+        return None
+    if (marca.get("period") != export_period_sec or marca.get("statistics") != list(statistics)
+            or marca.get("csv_size") != st.st_size or marca.get("csv_mtime_ns") != st.st_mtime_ns):
+        return None
+    watermark_ms = marca["watermark_ms"]
+    anterior = marca["fitxers"]
+    for name, old in anterior.items():
+        new = estat.get(name)
+        canviat = new is None or new["size"] != old["size"] or new["mtime_ns"] != old["mtime_ns"]
+        if canviat and old["end_ms"] < watermark_ms:
+            return None
+    for name, new in estat.items():
+        if name not in anterior and new["start_ms"] < watermark_ms:
+            return None
+    return marca
+
+
+def desar_watermark(csv_filename: str, export_period_sec: int, statistics: Sequence[str], watermark_ms: int,
+                    offset: int, estat: Dict[str, Dict[str, int]]) -> None:
+    """
+    Desa al costat del CSV el watermark de l'exportació: inici de l'últim bucket escrit (que encara
+    pot rebre mostres i es recalcularà), posició on comença la seva fila i estat dels fitxers llegits.
+    """
+    st = os.stat(csv_filename)
+    marca = {
+        "period": export_period_sec,
+        "statistics": list(statistics),
+        "watermark_ms": watermark_ms,
+        "offset": offset,
+        "csv_size": st.st_size,
+        "csv_mtime_ns": st.st_mtime_ns,
+        "fitxers": estat,
+    }
+    with open(_ruta_watermark(csv_filename), "w") as f:
+        json.dump(marca, f, indent=1)
+
+
+def nom_sortida(source_folder: str, export_folder: str, output_format: str = "csv",
+                compression: Optional[str] = None, export_period_sec: Optional[int] = None) -> str:
+    """
+    Ruta del fitxer de sortida d'una subcarpeta: el nom de la subcarpeta i, quan s'exporten diversos
+    períodes alhora, el període en segons (p. ex. 'TAG_TR2_600s.csv').
+    """
+    nom = os.path.basename(source_folder)
+    if export_period_sec is not None:
+        nom = f"{nom}_{export_period_sec}s"
+    return os.path.join(export_folder, nom + extensio_sortida(output_format, compression))
+
+
+def _preparar_carpeta(source_folder: str, export_folder: str, export_period_sec: int, statistics,
+                      progress_callback=None, cataleg=None, inici_ms: Optional[int] = None,
+                      fi_ms: Optional[int] = None, incremental: bool = False, output_format: str = "csv",
+                      compression: Optional[str] = None, instrumentacio: Optional[Instrumentacio] = None,
+                      fils_capcaleres: int = 1) -> Dict[str, Any]:
+    """
+    Llista i prepara els fitxers d'una subcarpeta i decideix si l'export pot ser incremental.
+
+    Retorna un diccionari amb 'source_folder', 'output_filename', 'log_messages', 'fitxers' (None si
+    no hi ha fitxers de dades), 'marca' (watermark vàlid o None) i 'estat' (estat dels fitxers a desar).
+    """
+    preparada = {
+        "source_folder": source_folder,
+        "output_filename": nom_sortida(source_folder, export_folder, output_format, compression),
+        "log_messages": [],
+        "fitxers": None,
+        "marca": None,
+        "estat": None,
+    }
+    with mesurar_etapa(instrumentacio, source_folder, "llistat") as mesura:
+        data_files = llistar_fitxers_dades(source_folder, cataleg)
+        mesura["fitxers"] += len(data_files)
+    if not data_files:
+        return preparada
+    # L'export incremental no té sentit amb un final fix, i només es pot afegir a un CSV sense
+    # comprimir: en aquests casos es fa l'export complet.
+    incremental = incremental and fi_ms is None and output_format == "csv" and compression is None
+    with mesurar_etapa(instrumentacio, source_folder, "capcaleres") as mesura:
+        if not incremental:
+            fitxers = preparar_fitxers(source_folder, data_files, preparada["log_messages"],
+                                       progress_callback, cataleg, inici_ms, fi_ms, fils_capcaleres)
+        else:
+            fitxers = preparar_fitxers(source_folder, data_files, preparada["log_messages"], progress_callback,
+                                       cataleg, fils=fils_capcaleres)
+        mesura["fitxers"] += len(data_files)
+        if cataleg is None:
+            mesura["bytes"] += len(data_files) * HEADER_SIZE
+    if not incremental:
+        preparada["fitxers"] = fitxers
+        return preparada
+
+    preparada["estat"] = _estat_fitxers(fitxers)
+    preparada["marca"] = carregar_watermark(preparada["output_filename"], export_period_sec, statistics,
+                                            preparada["estat"])
+    if preparada["marca"] is not None:
+        inici_ms = preparada["marca"]["watermark_ms"]
+    preparada["fitxers"] = aplicar_finestra(fitxers, inici_ms, None, progress_callback)
+    return preparada
+
+
+def _exportar_carpeta(preparada: Dict[str, Any], export_period_sec: int, progress_callback=None,
+                      statistics=("mean",), obrir=None, file_callback=None, cancel_event=None,
+                      output_format: str = "csv", compression: Optional[str] = None,
+                      instrumentacio: Optional[Instrumentacio] = None, cache_agregats=None) -> str:
+    """
+    Exporta una subcarpeta ja preparada al fitxer de sortida i retorna el missatge de resultat
+    (amb les mesures de cada etapa si es passa 'instrumentacio').
+    """
+    source_folder = preparada["source_folder"]
+    output_filename = preparada["output_filename"]
+    log_messages = preparada["log_messages"]
+    marca = preparada["marca"]
+    if preparada["fitxers"] is None:
+        log_messages.append(f"[!] No s'han trobat fitxers de dades a {source_folder}")
+        return "\n".join(log_messages)
+    try:
+        blocs = iterar_agregats(preparada["fitxers"], export_period_sec, progress_callback, obrir=obrir,
+                                file_callback=file_callback, cancel_event=cancel_event,
+                                instrumentacio=instrumentacio, cache_agregats=cache_agregats)
+        rows_written, ultima_fila = escriure_sortida(output_filename, blocs, statistics, output_format, compression,
+                                                     offset=marca["offset"] if marca else None,
+                                                     instrumentacio=instrumentacio, carpeta=source_folder)
+        if preparada["estat"] is not None and (ultima_fila or marca):
+            offset, watermark_ms = ultima_fila or (marca["offset"], marca["watermark_ms"])
+            desar_watermark(output_filename, export_period_sec, statistics, watermark_ms, offset, preparada["estat"])
+    except Exception as e:
+        if marca is not None and os.path.exists(output_filename):
+            # El CSV s'ha restaurat: el watermark anterior continua sent vàlid.
+            desar_watermark(output_filename, export_period_sec, statistics, marca["watermark_ms"], marca["offset"],
+                            marca["fitxers"])
+        if isinstance(e, ExportacioCancellada):
+            msg = f"[!] Exportació cancel·lada: {source_folder}"
+        else:
+            msg = f"[!] Error exportant dades per {source_folder}: {e}"
+        log_messages.append(msg)
+        if instrumentacio is not None:
+            instrumentacio.anotar_pic(source_folder)
+            log_messages.extend(instrumentacio.resum(source_folder))
+        return "\n".join(log_messages)
+
+    if marca is not None:
+        desde = (EPOCH + datetime.timedelta(milliseconds=marca["watermark_ms"])).strftime('%d/%m/%Y %H:%M:%S')
+        msg = f"[OK] Exportació incremental completada: {output_filename} ({rows_written} buckets des de {desde})"
+    elif not rows_written:
+        msg = f"[!] No s'han trobat samples a {source_folder}"
+    else:
+        msg = f"[OK] Exportació completada: {output_filename}"
+    log_messages.append(msg)
+    if instrumentacio is not None:
+        instrumentacio.anotar_pic(source_folder)
+        log_messages.extend(instrumentacio.resum(source_folder))
+    return "\n".join(log_messages)
+
+
+def _exportar_carpeta_periodes(preparada: Dict[str, Any], periodes: Sequence[int], progress_callback=None,
+                               statistics=("mean",), obrir=None, file_callback=None, cancel_event=None,
+                               output_format: str = "csv", compression: Optional[str] = None,
+                               instrumentacio: Optional[Instrumentacio] = None, cache_agregats=None) -> str:
+    """
+    Exporta una subcarpeta ja preparada (al període de 'periode_base') a un fitxer per a cada
+    període de 'periodes' amb una sola lectura dels fitxers, i retorna el missatge de resultat.
+    """
+    source_folder = preparada["source_folder"]
+    log_messages = preparada["log_messages"]
+    if preparada["fitxers"] is None:
+        log_messages.append(f"[!] No s'han trobat fitxers de dades a {source_folder}")
+        return "\n".join(log_messages)
+    export_folder = os.path.dirname(preparada["output_filename"])
+    output_filenames = {export_period_sec: nom_sortida(source_folder, export_folder, output_format, compression,
+                                                       export_period_sec)
+                        for export_period_sec in periodes}
+    try:
+        blocs = iterar_agregats(preparada["fitxers"], periode_base(periodes), progress_callback, obrir=obrir,
+                                file_callback=file_callback, cancel_event=cancel_event,
+                                instrumentacio=instrumentacio, cache_agregats=cache_agregats)
+        rows_written = escriure_sortides(output_filenames, iterar_periodes(blocs, periodes, instrumentacio,
+                                                                           source_folder),
+                                         statistics, output_format, compression, instrumentacio, source_folder)
+    except Exception as e:
+        if isinstance(e, ExportacioCancellada):
+            msg = f"[!] Exportació cancel·lada: {source_folder}"
+        else:
+            msg = f"[!] Error exportant dades per {source_folder}: {e}"
+        log_messages.append(msg)
+    else:
+        if not any(rows_written.values()):
+            log_messages.append(f"[!] No s'han trobat samples a {source_folder}")
+        for export_period_sec, output_filename in output_filenames.items():
+            if rows_written[export_period_sec]:
+                log_messages.append(f"[OK] Exportació completada: {output_filename}")
+    if instrumentacio is not None:
+        instrumentacio.anotar_pic(source_folder)
+        log_messages.extend(instrumentacio.resum(source_folder))
+    return "\n".join(log_messages)
+
+
+def process_subfolder(source_folder: str, export_folder: str, export_period_sec: int, progress_callback=None,
+                      statistics=("mean",), cataleg=None, start_time: Optional[datetime.datetime] = None,
+                      end_time: Optional[datetime.datetime] = None, incremental: bool = False,
+                      file_callback=None, cancel_event=None, output_format: str = "csv",
+                      compression: Optional[str] = None, instrumentacio: Optional[Instrumentacio] = None,
+                      cache_agregats=None, lectura_anticipada: int = 0,
+                      memoria_lectura_mb: float = MEMORIA_LECTURA_MB) -> str:
+    """
+    Processa una subcarpeta llegint fitxers de dades amb una extensió numèrica
+    i exporta les mostres (aggregades segons el període d'exportació) a un CSV amb el nom de la subcarpeta.
+
+    Els fitxers es llegeixen en streaming (vegeu 'iterar_agregats') i els buckets tancats
+    s'escriuen directament al CSV, de manera que la memòria no depèn de la mida de l'arxiu.
+
+    En mode incremental es desa un watermark al costat del CSV ('<csv>.watermark.json'). A les
+    exportacions següents només es llegeixen les mostres posteriors al watermark dels fitxers nous
+    o que han crescut, es recalcula l'últim bucket (que podia estar incomplet) i s'afegeixen els
+    buckets nous al CSV. Si la història anterior al watermark ha canviat, es fa l'export complet.
+
+    Args:
+        source_folder (str): Ruta de la subcarpeta.
+        export_folder (str): Carpeta on es guarda l'export CSV.
+        export_period_sec (int): Interval d'exportació seleccionat (en segons).
+        progress_callback (func, opcional): Funció cridada després de processar cada fitxer.
+        statistics (tuple, opcional): Estadístiques per bucket a exportar (vegeu 'ESTADISTIQUES').
+        cataleg (CatalegCapcaleres, opcional): Catàleg d'on es llegeixen llistats i capçaleres.
+        start_time (datetime, opcional): Inici (inclòs, UTC) de la finestra temporal a exportar.
+        end_time (datetime, opcional): Final (exclòs, UTC) de la finestra temporal a exportar.
+        incremental (bool, opcional): Afegeix al CSV existent només els buckets nous (ignorat amb 'end_time').
+        file_callback (func, opcional): Funció cridada amb la ruta de cada fitxer processat.
+        cancel_event (threading.Event, opcional): Permet aturar l'exportació entre dos fitxers.
+        output_format (str, opcional): Format de sortida: "csv", "parquet" o "feather".
+        compression (str, opcional): Compressió de la sortida (vegeu 'FORMATS_SORTIDA'). L'export
+            incremental només es fa amb CSV sense comprimir.
+        instrumentacio (Instrumentacio, opcional): Mesura cada etapa (llistat, capçaleres, descodificació,
+            agregació, fusió i escriptura) i n'afegeix el resum al missatge de resultat.
+        cache_agregats (CacheAgregats, opcional): Piràmide persistent d'agregats per fitxer: els fitxers
+            ja agregats i sense canvis no es tornen a descodificar, sigui quin sigui el període.
+        lectura_anticipada (int, opcional): Nombre de fitxers que es llegeixen per avançat en un pool
+            de fils mentre es descodifica l'actual (0 = sense lectura anticipada); vegeu 'LecturaAnticipada'.
+            També és el nombre de fils amb què es llegeixen les capçaleres.
+        memoria_lectura_mb (float, opcional): Memòria màxima dels buffers llegits per avançat.
+
+    Returns:
+        str: Missatge indicant el resultat de l'exportació.
+    """
+    preparada = _preparar_carpeta(source_folder, export_folder, export_period_sec, statistics, progress_callback,
+                                  cataleg, datetime_a_epoch_ms(start_time), datetime_a_epoch_ms(end_time),
+                                  incremental, output_format, compression, instrumentacio,
+                                  fils_capcaleres=lectura_anticipada)
+    with _obrir_amb_lectura_anticipada(preparada["fitxers"] or [], export_period_sec, lectura_anticipada,
+                                       memoria_lectura_mb, instrumentacio, cache_agregats) as obrir:
+        return _exportar_carpeta(preparada, export_period_sec, progress_callback, statistics, obrir=obrir,
+                                 file_callback=file_callback, cancel_event=cancel_event,
+                                 output_format=output_format, compression=compression,
+                                 instrumentacio=instrumentacio, cache_agregats=cache_agregats)
+
+
+@contextmanager
+def _obrir_amb_lectura_anticipada(fitxers: Sequence[Dict[str, Any]], export_period_sec: int, fitxers_endavant: int,
+                                  memoria_mb: float = MEMORIA_LECTURA_MB,
+                                  instrumentacio: Optional[Instrumentacio] = None, cache_agregats=None):
+    """
+    Retorna la funció 'obrir' per a 'iterar_agregats' que llegeix els fitxers amb una 'LecturaAnticipada'
+    de 'fitxers_endavant' fitxers, o None (lectura normal) si 'fitxers_endavant' és 0. Els fitxers que
+    ja tenen nivells vàlids a 'cache_agregats' no es llegeixen per avançat.
+    """
+    if fitxers_endavant <= 0 or not fitxers:
+        yield None
+        return
+
+    def a_la_cache(fitxer):
+        return bool(cache_agregats.nivells(fitxer["path"], os.stat(fitxer["path"])))
+
+    with LecturaAnticipada(fitxers, fitxers_endavant, memoria_mb,
+                           ometre=a_la_cache if cache_agregats is not None else None) as lectura:
+        def obrir(fitxer):
+            return lectura.consumir(fitxer["path"], parcials_fitxer(fitxer, export_period_sec,
+                                                                    instrumentacio=instrumentacio,
+                                                                    cache_agregats=cache_agregats,
+                                                                    llegir=lectura.llegir))
+
+        yield obrir
+
+
+def _parcials_fitxer_llista(fitxer: Dict[str, Any], export_period_sec: int, instrumentar: bool = False,
+                            memoria: bool = True, cache_agregats=None
+                            ) -> Tuple[List[Agregat], Optional[Tuple[Dict[str, Any], Dict[str, float]]]]:
+    """
+    Tasca dels processos treballadors: descodifica i agrega un fitxer sencer. Amb 'instrumentar'
+    també retorna les mesures i el pic de memòria del treballador (vegeu 'Instrumentacio.fusionar').
+    """
+    instrumentacio = Instrumentacio(memoria=memoria) if instrumentar else None
+    parts = list(parcials_fitxer(fitxer, export_period_sec, instrumentacio=instrumentacio,
+                                 cache_agregats=cache_agregats))
+    if instrumentacio is None:
+        return parts, None
+    instrumentacio.anotar_pic(fitxer.get("carpeta"))
+    return parts, (instrumentacio.carpetes, instrumentacio.pics)
+
+
+class _CuaTasques:
+    """
+    Envia tasques a un executor mantenint com a màxim 'finestra' resultats pendents per davant
+    del que s'està consumint, i retorna els resultats en l'ordre que es demanen.
+    """
+
+    def __init__(self, executor, tasques: Iterator[Tuple[Any, Callable, tuple]], finestra: int):
+        self.executor = executor
+        self.tasques = tasques
+        self.finestra = finestra
+        self.pendents = {}
+
+    def _omplir(self, clau=None) -> None:
+        while (clau is not None and clau not in self.pendents) or len(self.pendents) < self.finestra:
+            tasca = next(self.tasques, None)
+            if tasca is None:
+                break
+            key, fn, args = tasca
+            self.pendents[key] = self.executor.submit(fn, *args)
+
+    def resultat(self, clau):
+        self._omplir(clau)
+        future = self.pendents.pop(clau)
+        self._omplir()
+        return future.result()
+
+    def cancellar(self) -> None:
+        """Cancel·la les tasques pendents que encara no han començat."""
+        for future in self.pendents.values():
+            future.cancel()
+        self.pendents.clear()
+
+
+@contextmanager
+def _obrir_en_paralel(fitxers: Iterator[Dict[str, Any]], export_period_sec: int, workers: int,
+                      instrumentacio: Optional[Instrumentacio] = None, cache_agregats=None):
+    """
+    Descodifica i agrega 'fitxers' en un pool de processos, amb una finestra limitada de fitxers
+    en curs per davant del que es consumeix. Retorna la funció 'obrir' per a 'iterar_agregats'.
+    Les mesures dels treballadors s'afegeixen a 'instrumentacio' a mesura que es consumeixen.
+    Cada treballador consulta i omple directament 'cache_agregats'.
+    """
+    # Import diferit: les exportacions en sèrie (i la CLI) no han de pagar el cost de multiprocessing.
+    from concurrent.futures import ProcessPoolExecutor
+
+    instrumentar = instrumentacio is not None
+    memoria = instrumentar and instrumentacio.memoria
+    tasques = ((fitxer["path"], _parcials_fitxer_llista,
+                (fitxer, export_period_sec, instrumentar, memoria, cache_agregats))
+               for fitxer in fitxers)
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        cua = _CuaTasques(executor, tasques, finestra=2 * workers)
+
+        def obrir(fitxer):
+            parts, mesures = cua.resultat(fitxer["path"])
+            if mesures:
+                instrumentacio.fusionar(*mesures)
+            return iter(parts)
+
+        try:
+            yield obrir
+        finally:
+            cua.cancellar()
+
+
+def exportar_carpetes(source_folders: Sequence[str], export_folder: str, export_period_sec: Union[int, Sequence[int]],
+                      progress_callback=None, statistics=("mean",), workers: int = 1,
+                      cataleg=None, start_time: Optional[datetime.datetime] = None,
+                      end_time: Optional[datetime.datetime] = None, incremental: bool = False,
+                      file_callback=None, cancel_event=None, output_format: str = "csv",
+                      compression: Optional[str] = None, instrumentacio: Optional[Instrumentacio] = None,
+                      cache_agregats=None, lectura_anticipada: int = 0,
+                      memoria_lectura_mb: float = MEMORIA_LECTURA_MB) -> Iterator[str]:
+    """
+    Exporta diverses subcarpetes i retorna el missatge de resultat de cadascuna en acabar-la.
+
+    Amb 'workers' > 1 els fitxers de totes les subcarpetes es descodifiquen i s'agreguen en un
+    pool de processos, amb una finestra limitada de fitxers en curs que pot avançar-se a la
+    subcarpeta següent. El procés principal fusiona els agregats parcials en el mateix ordre que
+    l'export en sèrie (sumes i comptadors, no mitjanes de mitjanes), de manera que els CSV
+    resultants són idèntics byte a byte. 'progress_callback' es continua cridant un cop per fitxer.
+
+    Amb diversos períodes, cada subcarpeta es llegeix un sol cop: les mostres s'agreguen al MCD dels
+    períodes (vegeu 'periode_base') i cada període es deriva d'aquests acumuladors amb 'iterar_periodes'.
+    S'escriu un fitxer per subcarpeta i període (vegeu 'nom_sortida') i no es fa export incremental.
+
+    Args:
+        source_folders (list): Rutes de les subcarpetes a exportar.
+        export_folder (str): Carpeta on es guarden els CSV.
+        export_period_sec (int o list): Interval d'exportació (en segons) o llista d'intervals.
+        progress_callback (func, opcional): Funció cridada després de processar cada fitxer.
+        statistics (tuple, opcional): Estadístiques per bucket a exportar.
+        workers (int, opcional): Nombre de processos treballadors (1 = en sèrie).
+        cataleg (CatalegCapcaleres, opcional): Catàleg d'on es llegeixen llistats i capçaleres.
+        start_time (datetime, opcional): Inici (inclòs, UTC) de la finestra temporal a exportar.
+        end_time (datetime, opcional): Final (exclòs, UTC) de la finestra temporal a exportar.
+        incremental (bool, opcional): Exportació incremental (vegeu 'process_subfolder').
+        file_callback (func, opcional): Funció cridada amb la ruta de cada fitxer processat.
+        cancel_event (threading.Event, opcional): Permet aturar l'exportació entre dos fitxers; les
+            subcarpetes pendents ja no s'exporten.
+        output_format (str, opcional): Format de sortida (vegeu 'process_subfolder').
+        compression (str, opcional): Compressió de la sortida.
+        instrumentacio (Instrumentacio, opcional): Mesures per etapa (vegeu 'process_subfolder'). En
+            paral·lel, la descodificació i l'agregació es mesuren als processos treballadors.
+        cache_agregats (CacheAgregats, opcional): Piràmide d'agregats per fitxer (vegeu 'process_subfolder').
+        lectura_anticipada (int, opcional): Fitxers llegits per avançat en un pool de fils (vegeu
+            'process_subfolder'). Només s'aplica en sèrie: en paral·lel cada treballador llegeix els seus fitxers.
+        memoria_lectura_mb (float, opcional): Memòria màxima dels buffers llegits per avançat.
+
+    Yields:
+        str: Missatge de resultat de cada subcarpeta, en el mateix ordre que 'source_folders'.
+    """
+    inici_ms, fi_ms = datetime_a_epoch_ms(start_time), datetime_a_epoch_ms(end_time)
+    periodes = normalitzar_periodes(export_period_sec)
+    export_period_sec = periode_base(periodes)
+    incremental = incremental and len(periodes) == 1
+
+    def cancellat():
+        return cancel_event is not None and cancel_event.is_set()
+
+    def exportar(preparada, obrir=None):
+        opcions = dict(file_callback=file_callback, cancel_event=cancel_event, output_format=output_format,
+                       compression=compression, instrumentacio=instrumentacio, cache_agregats=cache_agregats)
+        if len(periodes) == 1:
+            return _exportar_carpeta(preparada, export_period_sec, progress_callback, statistics, obrir=obrir,
+                                     **opcions)
+        return _exportar_carpeta_periodes(preparada, periodes, progress_callback, statistics, obrir=obrir,
+                                          **opcions)
+
+    if workers <= 1:
+        for source_folder in source_folders:
+            if cancellat():
+                return
+            preparada = _preparar_carpeta(source_folder, export_folder, export_period_sec, statistics,
+                                          progress_callback, cataleg, inici_ms, fi_ms, incremental,
+                                          output_format, compression, instrumentacio, lectura_anticipada)
+            with _obrir_amb_lectura_anticipada(preparada["fitxers"] or [], export_period_sec, lectura_anticipada,
+                                               memoria_lectura_mb, instrumentacio, cache_agregats) as obrir:
+                missatge = exportar(preparada, obrir)
+            yield missatge
+        return
+
+    preparades = []
+    for source_folder in source_folders:
+        if cancellat():
+            return
+        preparades.append(_preparar_carpeta(source_folder, export_folder, export_period_sec, statistics,
+                                            progress_callback, cataleg, inici_ms, fi_ms, incremental,
+                                            output_format, compression, instrumentacio))
+    fitxers = (fitxer for preparada in preparades if preparada["fitxers"] for fitxer in preparada["fitxers"])
+    with _obrir_en_paralel(fitxers, export_period_sec, workers, instrumentacio, cache_agregats) as obrir:
+        for preparada in preparades:
+            if cancellat():
+                return
+            yield exportar(preparada, obrir)
+
+
+def nom_columna_etiqueta(preparada: Dict[str, Any]) -> str:
+    """
+    Nom de la columna d'una subcarpeta a la taula ampla: el 'Title' de la capçalera (o el 'LogName'
+    si és buit) i les unitats 'sEngUnits' entre parèntesis. Sense capçalera, el nom de la carpeta.
+    """
+    nom = os.path.basename(os.path.normpath(preparada["source_folder"]))
+    if not preparada["fitxers"]:
+        return nom
+    header_info = preparada["fitxers"][0]["header"]
+    nom = header_info["Title"].strip() or header_info["header"]["LogName"].strip() or nom
+    units = header_info["header"]["sEngUnits"].strip()
+    return f"{nom} ({units})" if units else nom
+
+
+def columnes_taula_ampla(preparades: Sequence[Dict[str, Any]],
+                         statistics: Sequence[str]) -> List[Tuple[str, str]]:
+    """
+    Retorna les columnes (capçalera, estadística) de la taula ampla: per a cada subcarpeta, una
+    columna per estadística. Si dues subcarpetes donen el mateix nom, s'hi afegeix el de la carpeta.
+    """
+    noms = [nom_columna_etiqueta(preparada) for preparada in preparades]
+    repetits = {nom for nom in noms if noms.count(nom) > 1}
+    columnes = []
+    for nom, preparada in zip(noms, preparades):
+        if nom in repetits:
+            nom = f"{os.path.basename(os.path.normpath(preparada['source_folder']))}: {nom}"
+        for name in statistics:
+            columnes.append((nom if name == "mean" else f"{nom} {STATISTIC_HEADERS[name]}", name))
+    return columnes
+
+
+def iterar_taula_ampla(fluxos: Sequence[Iterator[Agregat]], export_period_sec: int,
+                       statistics: Sequence[str] = ("mean",)) -> Iterator[Tuple[np.ndarray, List[np.ndarray]]]:
+    """
+    Alinea sobre una mateixa graella de buckets els fluxos de blocs tancats de diverses subcarpetes
+    (vegeu 'iterar_agregats') sense materialitzar-los: de cada flux només es guarda el bloc en curs.
+
+    Com que cada flux retorna els buckets en ordre i ja no en pot tornar cap d'anterior, es poden
+    emetre tots els buckets fins a l'últim del bloc en curs que acaba abans. Els buckets sense dades
+    en una subcarpeta queden com a NaN.
+
+    Yields:
+        tuple: (inici de cada bucket en ms, [array per columna]), amb les columnes agrupades per
+        flux i, dins de cada flux, en l'ordre de 'statistics'.
+    """
+    period_ms = int(export_period_sec) * 1000
+    fluxos = list(fluxos)
+    pendents = [Agregat.buit(period_ms) for _ in fluxos]
+    actius = set(range(len(fluxos)))
+    while True:
+        for i in sorted(actius):
+            if not len(pendents[i]):
+                bloc = next(fluxos[i], None)
+                while bloc is not None and not len(bloc):
+                    bloc = next(fluxos[i], None)
+                if bloc is None:
+                    actius.discard(i)
+                else:
+                    pendents[i] = bloc
+        if not actius and not any(len(pendent) for pendent in pendents):
+            return
+        if actius:
+            limit = min(int(pendents[i].bucket[-1]) for i in actius)
+            peces = []
+            for i, pendent in enumerate(pendents):
+                peca, pendents[i] = pendent.tallar((limit + 1) * period_ms)
+                peces.append(peca)
+        else:
+            peces, pendents = pendents, [Agregat.buit(period_ms) for _ in fluxos]
+
+        buckets = np.unique(np.concatenate([peca.bucket for peca in peces]))
+        valors = []
+        for peca in peces:
+            posicions = np.searchsorted(buckets, peca.bucket)
+            columns = peca.estadistiques(statistics)
+            for name in statistics:
+                column = np.full(len(buckets), np.nan)
+                column[posicions] = columns[name]
+                valors.append(column)
+        yield buckets * period_ms, valors
+
+
+def escriure_taula_ampla(output_filename: str, files: Iterator[Tuple[np.ndarray, List[np.ndarray]]],
+                         statistics: Sequence[str], columnes: Sequence[Tuple[str, str]],
+                         output_format: str = "csv", compression: Optional[str] = None,
+                         instrumentacio: Optional[Instrumentacio] = None) -> int:
+    """
+    Escriu els blocs de files de 'iterar_taula_ampla' al fitxer de sortida (vegeu 'escriure_sortida').
+    El temps d'escriptura es compta a l'etapa "escriptura" del fitxer de sortida.
+
+    Returns:
+        int: Nombre de files escrites.
+    """
+    escriptor = None
+    rows_written = 0
+    try:
+        for temps_ms, valors in files:
+            if not len(temps_ms):
+                continue
+            with mesurar_etapa(instrumentacio, output_filename, "escriptura") as mesura:
+                if escriptor is None:
+                    escriptor = crear_escriptor(output_filename, statistics, output_format, compression,
+                                                columnes=columnes, codificacio=CODIFICACIO_TAULA_AMPLA)
+                escriptor.escriure_columnes(temps_ms, valors)
+                mesura["files"] += len(temps_ms)
+            rows_written += len(temps_ms)
+    except BaseException:
+        if escriptor is not None:
+            escriptor.avortar()
+        raise
+    if escriptor is not None:
+        with mesurar_etapa(instrumentacio, output_filename, "escriptura") as mesura:
+            escriptor.tancar()
+            mesura["bytes"] += os.path.getsize(output_filename)
+    return rows_written
+
+
+def exportar_taula_ampla(source_folders: Sequence[str], export_folder: str, export_period_sec: int,
+                         progress_callback=None, statistics=("mean",), workers: int = 1,
+                         cataleg=None, start_time: Optional[datetime.datetime] = None,
+                         end_time: Optional[datetime.datetime] = None, file_callback=None,
+                         cancel_event=None, output_format: str = "csv",
+                         compression: Optional[str] = None, instrumentacio: Optional[Instrumentacio] = None,
+                         cache_agregats=None, lectura_anticipada: int = 0,
+                         memoria_lectura_mb: float = MEMORIA_LECTURA_MB) -> str:
+    """
+    Exporta diverses subcarpetes a un sol fitxer amb una columna per etiqueta i una fila per bucket.
+
+    Totes les subcarpetes s'agreguen amb el mateix període, de manera que comparteixen la graella
+    de buckets. Els fluxos de cada subcarpeta es fusionen a mesura que es llegeixen (vegeu
+    'iterar_taula_ampla'): la memòria no depèn de la mida de l'arxiu. El fitxer es diu
+    '<NOM_TAULA_AMPLA>_<període>s' amb l'extensió del format de sortida. No hi ha mode incremental.
+
+    Args:
+        source_folders (list): Rutes de les subcarpetes a exportar.
+        export_folder (str): Carpeta on es guarda el fitxer.
+        export_period_sec (int): Interval d'exportació (en segons).
+        progress_callback (func, opcional): Funció cridada després de processar cada fitxer.
+        statistics (tuple, opcional): Estadístiques per bucket a exportar per a cada etiqueta.
+        workers (int, opcional): Nombre de processos treballadors (1 = en sèrie).
+        cataleg (CatalegCapcaleres, opcional): Catàleg d'on es llegeixen llistats i capçaleres.
+        start_time (datetime, opcional): Inici (inclòs, UTC) de la finestra temporal a exportar.
+        end_time (datetime, opcional): Final (exclòs, UTC) de la finestra temporal a exportar.
+        file_callback (func, opcional): Funció cridada amb la ruta de cada fitxer processat.
+        cancel_event (threading.Event, opcional): Permet aturar l'exportació entre dos fitxers.
+        output_format (str, opcional): Format de sortida: "csv", "parquet" o "feather".
+        compression (str, opcional): Compressió de la sortida.
+        instrumentacio (Instrumentacio, opcional): Mesures per etapa de cada subcarpeta i de l'escriptura.
+        cache_agregats (CacheAgregats, opcional): Piràmide d'agregats per fitxer (vegeu 'process_subfolder').
+        lectura_anticipada (int, opcional): Fitxers llegits per avançat en un pool de fils (vegeu
+            'process_subfolder'), repartits entre les subcarpetes amb almenys un per subcarpeta. Només
+            s'aplica en sèrie: en paral·lel cada treballador llegeix els seus fitxers.
+        memoria_lectura_mb (float, opcional): Memòria màxima dels buffers llegits per avançat, repartida
+            a parts iguals entre les subcarpetes.
+
+    Returns:
+        str: Missatge indicant el resultat de l'exportació.
+    """
+    inici_ms, fi_ms = datetime_a_epoch_ms(start_time), datetime_a_epoch_ms(end_time)
+    output_filename = os.path.join(export_folder, f"{NOM_TAULA_AMPLA}_{export_period_sec}s"
+                                   + extensio_sortida(output_format, compression))
+    log_messages = []
+    preparades = []
+    for source_folder in source_folders:
+        if cancel_event is not None and cancel_event.is_set():
+            log_messages.append(f"[!] Exportació cancel·lada: {output_filename}")
+            return "\n".join(log_messages)
+        preparada = _preparar_carpeta(source_folder, export_folder, export_period_sec, statistics,
+                                      progress_callback, cataleg, inici_ms, fi_ms, instrumentacio=instrumentacio,
+                                      fils_capcaleres=lectura_anticipada)
+        log_messages.extend(preparada["log_messages"])
+        if preparada["fitxers"] is None:
+            log_messages.append(f"[!] No s'han trobat fitxers de dades a {source_folder}")
+            continue
+        preparades.append(preparada)
+    if not preparades:
+        return "\n".join(log_messages)
+
+    columnes = columnes_taula_ampla(preparades, statistics)
+    try:
+        with ExitStack() as obertures:
+            if workers > 1:
+                # Amb processos, les tasques s'envien en l'ordre aproximat en què els fluxos les consumiran.
+                fitxers = heapq.merge(*(preparada["fitxers"] for preparada in preparades),
+                                      key=lambda f: f["start_ms"])
+                obrir = obertures.enter_context(_obrir_en_paralel(fitxers, export_period_sec, workers,
+                                                                  instrumentacio, cache_agregats))
+                obridors = [obrir] * len(preparades)
+            else:
+                # Cada flux consumeix els fitxers de la seva subcarpeta en ordre: una lectura anticipada
+                # per subcarpeta, amb els fitxers i la memòria repartits entre totes.
+                endavant = max(lectura_anticipada // len(preparades), 1) if lectura_anticipada > 0 else 0
+                obridors = [obertures.enter_context(
+                    _obrir_amb_lectura_anticipada(preparada["fitxers"], export_period_sec, endavant,
+                                                  memoria_lectura_mb / len(preparades), instrumentacio,
+                                                  cache_agregats))
+                    for preparada in preparades]
+            fluxos = [iterar_agregats(preparada["fitxers"], export_period_sec, progress_callback, obrir=obrir,
+                                      file_callback=file_callback, cancel_event=cancel_event,
+                                      instrumentacio=instrumentacio, cache_agregats=cache_agregats)
+                      for preparada, obrir in zip(preparades, obridors)]
+            rows_written = escriure_taula_ampla(output_filename,
+                                                iterar_taula_ampla(fluxos, export_period_sec, statistics),
+                                                statistics, columnes, output_format, compression, instrumentacio)
+    except ExportacioCancellada:
+        log_messages.append(f"[!] Exportació cancel·lada: {output_filename}")
+    except Exception as e:
+        log_messages.append(f"[!] Error exportant la taula ampla {output_filename}: {e}")
+    else:
+        if not rows_written:
+            log_messages.append("[!] No s'han trobat samples a les carpetes seleccionades")
+        else:
+            log_messages.append(f"[OK] Exportació completada: {output_filename} "
+                                f"({len(preparades)} etiquetes, {rows_written} buckets)")
+    if instrumentacio is not None:
+        for carpeta in [preparada["source_folder"] for preparada in preparades] + [output_filename]:
+            instrumentacio.anotar_pic(carpeta)
+            log_messages.extend(instrumentacio.resum(carpeta))
+    return "\n".join(log_messages)
+
+
+class ExportacioEnSegonPla:
+    """
+    Executa 'exportar_carpetes' en un fil en segon pla i en publica els esdeveniments en una cua
+    segura entre fils, perquè la GUI els pugui consultar periòdicament sense bloquejar-se.
+
+    Esdeveniments (tuples (tipus, dades)):
+        ("total", n): nombre total de fitxers a processar.
+        ("progres", None): s'ha acabat (o descartat) un fitxer.
+        ("fitxer", ruta): ruta del fitxer que s'acaba de processar.
+        ("resultat", missatge): resultat d'una subcarpeta.
+        ("fi", cancel·lada): l'exportació ha acabat; 'cancel·lada' indica si s'ha aturat abans d'hora.
+        ("error", missatge): error inesperat que ha aturat l'exportació.
+
+    Amb 'taula_ampla' s'executa 'exportar_taula_ampla' (un resultat per període) en lloc de 'exportar_carpetes'.
+    'export_period_sec' pot ser un període o una llista de períodes (vegeu 'exportar_carpetes').
+    """
+
+    def __init__(self, source_folders: Sequence[str], export_folder: str,
+                 export_period_sec: Union[int, Sequence[int]],
+                 taula_ampla: bool = False, **kwargs):
+        self.source_folders = list(source_folders)
+        self.export_folder = export_folder
+        self.export_period_sec = export_period_sec
+        self.taula_ampla = taula_ampla
+        self.kwargs = kwargs
+        self.cua: "queue.Queue[Tuple[str, Any]]" = queue.Queue()
+        self.cancel_event = threading.Event()
+        self._fil = threading.Thread(target=self._executar, daemon=True)
+
+    def iniciar(self) -> None:
+        self._fil.start()
+
+    def cancellar(self) -> None:
+        """Demana aturar l'exportació; es farà efectiu abans del fitxer següent."""
+        self.cancel_event.set()
+
+    def en_curs(self) -> bool:
+        return self._fil.is_alive()
+
+    def esdeveniments(self) -> Iterator[Tuple[str, Any]]:
+        """Retorna, sense bloquejar, els esdeveniments pendents de la cua."""
+        while True:
+            try:
+                yield self.cua.get_nowait()
+            except queue.Empty:
+                return
+
+    def _executar(self) -> None:
+        instrumentacio = self.kwargs.get("instrumentacio")
+        with instrumentacio.perfilant() if instrumentacio is not None else nullcontext():
+            self._exportar()
+
+    def _exportar(self) -> None:
+        try:
+            cataleg = self.kwargs.get("cataleg")
+            total = sum(len(llistar_fitxers_dades(folder, cataleg)) for folder in self.source_folders)
+            periodes = normalitzar_periodes(self.export_period_sec)
+            # La taula ampla es llegeix un cop per període.
+            self.cua.put(("total", total * len(periodes) if self.taula_ampla else total))
+            kwargs = dict(self.kwargs, progress_callback=lambda: self.cua.put(("progres", None)),
+                          file_callback=lambda path: self.cua.put(("fitxer", path)), cancel_event=self.cancel_event)
+            if self.taula_ampla:
+                for export_period_sec in periodes:
+                    if self.cancel_event.is_set():
+                        break
+                    self.cua.put(("resultat", exportar_taula_ampla(self.source_folders, self.export_folder,
+                                                                   export_period_sec, **kwargs)))
+            else:
+                for msg in exportar_carpetes(self.source_folders, self.export_folder, self.export_period_sec,
+                                             **kwargs):
+                    self.cua.put(("resultat", msg))
+            self.cua.put(("fi", self.cancel_event.is_set()))
+        except Exception as e:
+            self.cua.put(("error", str(e)))
@@ -0,0 +1,105 @@
+"""
+Generador de fitxers de tendència sintètics (DATAFILEHEADER + mostres) per a proves i benchmarks.
+
+Exemple:
+    python Generar_Fitxers_Sintetics.py C:\\Temp\\Sintetic --carpetes 3 --fitxers 4 --mostres 100000
+"""
+import os
+import struct
+import argparse
+import datetime
+from typing import List, Optional
+
+import numpy as np
+
+from Llegir_Fitxer_Dades import HEADER_FORMAT, SAMPLE_DTYPE, FILETIME_EPOCH_OFFSET
+
+# Inici per defecte de les dades sintètiques (UTC).
+INICI_PER_DEFECTE = datetime.datetime(2024, 1, 1)
+
+
+def datetime_a_filetime(dt: datetime.datetime) -> int:
+    """Converteix un datetime UTC sense zona horària a FILETIME (ticks de 100 ns des del 1/1/1601)."""
+    return (dt - datetime.datetime(1970, 1, 1)) // datetime.timedelta(microseconds=1) * 10 + FILETIME_EPOCH_OFFSET
+
+
+def escriure_fitxer_dades(path: str, inici: datetime.datetime, sample_period_ms: int, n_samples: int,
+                          nan_density: float = 0.0, seed: int = 0, title: str = "Sintetic",
+                          log_name: str = "SINTETIC", eng_units: str = "degC") -> None:
+    """
+    Escriu un fitxer de dades amb una capçalera DATAFILEHEADER vàlida i 'n_samples' doubles.
+
+    Els valors són una sinusoide amb soroll (reproduïble amb 'seed') i una fracció 'nan_density'
+    de mostres NaN, com els forats que deixa Citect quan no hi ha lectura.
+    """
+    rng = np.random.default_rng(seed)
+    index = np.arange(n_samples, dtype=np.float64)
+    values = 50.0 + 40.0 * np.sin(index * (2 * np.pi / 3600.0)) + rng.normal(0.0, 2.0, n_samples)
+    if nan_density > 0:
+        values[rng.random(n_samples) < nan_density] = np.nan
+
+    start_time = datetime_a_filetime(inici)
+    end_time = start_time + max(n_samples - 1, 0) * sample_period_ms * 10000
+    header = struct.pack(
+        HEADER_FORMAT,
+        title.encode("latin-1"),
+        0.0, 32000.0, 0.0, 100.0,           # RawZero, RawFull, EngZero, EngFull
+        b"TRN",                             # ID
+        1, 2, 0,                            # Type, Version, StartEvNo
+        log_name.encode("latin-1"),
+        0, 0, 0, 0,                         # Mode, Area, Priv, FileType
+        sample_period_ms,
+        eng_units.encode("latin-1"),
+        0,                                  # Format
+        start_time, end_time,
+        n_samples,                          # DataLength
+        0, 0,                               # FilePointer, EndEvNo
+    )
+    with open(path, "wb") as f:
+        f.write(header)
+        f.write(values.astype(SAMPLE_DTYPE, copy=False).tobytes())
+
+
+def generar_carpetes(root: str, n_carpetes: int = 1, fitxers_per_carpeta: int = 1, n_samples: int = 100000,
+                     sample_period_ms: int = 1000, nan_density: float = 0.0,
+                     inici: Optional[datetime.datetime] = None, seed: int = 0) -> List[str]:
+    """
+    Crea 'n_carpetes' subcarpetes 'TAGnnn_TR2' dins de 'root', cadascuna amb 'fitxers_per_carpeta'
+    fitxers consecutius en el temps ('TAGnnn.000', 'TAGnnn.001', ...).
+
+    Returns:
+        list: Rutes de les subcarpetes creades.
+    """
+    inici = inici or INICI_PER_DEFECTE
+    durada = datetime.timedelta(milliseconds=n_samples * sample_period_ms)
+    folders = []
+    for i in range(n_carpetes):
+        tag = f"TAG{i:03d}"
+        folder = os.path.join(root, f"{tag}_TR2")
+        os.makedirs(folder, exist_ok=True)
+        for j in range(fitxers_per_carpeta):
+            escriure_fitxer_dades(os.path.join(folder, f"{tag}.{j:03d}"), inici + j * durada, sample_period_ms,
+                                  n_samples, nan_density, seed=seed + i * fitxers_per_carpeta + j,
+                                  title=f"{tag} sintètic", log_name=tag)
+        folders.append(folder)
+    return folders
+
+
+def main(argv=None) -> None:
+    parser = argparse.ArgumentParser(description="Genera carpetes TR2 amb fitxers de tendència sintètics.")
+    parser.add_argument("root", metavar="CARPETA", help="Carpeta on es creen les subcarpetes TR2.")
+    parser.add_argument("--carpetes", type=int, default=1, help="Nombre de subcarpetes TR2 (per defecte 1).")
+    parser.add_argument("--fitxers", type=int, default=1, help="Fitxers per subcarpeta (per defecte 1).")
+    parser.add_argument("--mostres", type=int, default=100000, help="Mostres per fitxer (per defecte 100000).")
+    parser.add_argument("--periode-mostreig", type=int, default=1000,
+                        help="SamplePeriod en mil·lisegons (per defecte 1000).")
+    parser.add_argument("--nans", type=float, default=0.0, help="Fracció de mostres NaN, de 0 a 1 (per defecte 0).")
+    parser.add_argument("--llavor", type=int, default=0, help="Llavor del generador aleatori.")
+    args = parser.parse_args(argv)
+    for folder in generar_carpetes(args.root, args.carpetes, args.fitxers, args.mostres, args.periode_mostreig,
+                                   args.nans, seed=args.llavor):
+        print(folder)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,34 @@
+from typing import Iterable, List, Sequence, Tuple
+
+
+class IndexFiltre:
+    """
+    Índex per filtrar una llista de noms per subcadena (sense distingir majúscules), pensat per a
+    llistes de desenes de milers de subcarpetes.
+
+    Els noms es passen a minúscules un sol cop en crear l'índex, de manera que cada consulta és
+    una comprovació de subcadena per nom sense cap conversió. Si la consulta amplia l'anterior
+    (p. ex. en escriure una lletra més al filtre) només es revisen els noms del resultat anterior.
+    """
+
+    def __init__(self, items: Iterable[str]):
+        self.items = list(items)
+        self.minuscules = [item.lower() for item in self.items]
+        self._anterior: Tuple[str, Sequence[int]] = ("", range(len(self.items)))
+
+    def __len__(self) -> int:
+        return len(self.items)
+
+    def filtrar(self, text: str) -> List[int]:
+        """Retorna, en l'ordre original, els índexs dels noms que contenen 'text'."""
+        text = text.lower()
+        if not text:
+            resultat = list(range(len(self.items)))
+        else:
+            anterior, candidats = self._anterior
+            if not anterior or anterior not in text:
+                candidats = range(len(self.items))
+            minuscules = self.minuscules
+            resultat = [i for i in candidats if text in minuscules[i]]
+        self._anterior = (text, resultat)
+        return resultat
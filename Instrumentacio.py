@@ -0,0 +1,244 @@
+import os
+import sys
+import json
+import time
+import cProfile
+import threading
+from functools import lru_cache
+from contextlib import contextmanager, nullcontext
+from typing import Any, Dict, List, Optional
+
+# Etapes de l'exportació que es mesuren, en l'ordre en què es mostren.
+ETAPES = ("llistat", "capcaleres", "cache", "descodificacio", "agregacio", "fusio", "escriptura")
+
+# Comptadors que es poden acumular a cada etapa.
+COMPTADORS = ("fitxers", "bytes", "mostres", "nans", "files")
+
+
+@lru_cache(maxsize=None)
+def _modul_psutil():
+    """Mòdul 'psutil' (opcional) si està instal·lat, o None. Només es busca un cop."""
+    try:
+        import psutil
+    except ImportError:
+        return None
+    return psutil
+
+
+def reiniciar_pic_memoria() -> None:
+    """
+    Reinicia el pic de RSS del procés (només Linux; a la resta el pic és acumulat). Afecta tot el
+    procés: només té sentit quan no hi ha cap altre fil treballant (p. ex. entre benchmarks).
+    """
+    try:
+        with open("/proc/self/clear_refs", "w") as f:
+            f.write("5")
+    except OSError:
+        pass
+
+
+def rss_memoria_mb() -> Optional[float]:
+    """Memòria resident actual del procés en MB (Linux o 'psutil'), o None si no es pot saber."""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / (1 << 20)
+    except (OSError, ValueError, AttributeError):
+        pass
+    psutil = _modul_psutil()
+    if psutil is None:
+        return None
+    return psutil.Process().memory_info().rss / (1 << 20)
+
+
+def pic_memoria_mb() -> Optional[float]:
+    """
+    Pic de memòria resident del procés en MB des que va començar (o des de l'últim
+    'reiniciar_pic_memoria'), o None si la plataforma no ho permet. A Windows cal 'psutil'.
+    """
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    psutil = _modul_psutil()
+    if psutil is not None:
+        info = psutil.Process().memory_info()
+        if hasattr(info, "peak_wset"):
+            return info.peak_wset / (1 << 20)
+    try:
+        import resource
+    except ImportError:
+        return None
+    maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return maxrss / (1 << 20) if sys.platform == "darwin" else maxrss / 1024
+
+
+def mesurar_etapa(instrumentacio: Optional["Instrumentacio"], carpeta: str, nom: str):
+    """
+    Retorna el context 'instrumentacio.etapa(carpeta, nom)' o, sense instrumentació, un context
+    buit que també accepta els comptadors, de manera que el codi mesurat és el mateix en tots dos casos.
+    """
+    if instrumentacio is None:
+        return nullcontext(dict.fromkeys(COMPTADORS, 0))
+    return instrumentacio.etapa(carpeta, nom)
+
+
+def _etapa_buida() -> Dict[str, Any]:
+    etapa = {"temps_s": 0.0, "crides": 0, "delta_rss_mb": None}
+    etapa.update((nom, 0) for nom in COMPTADORS)
+    return etapa
+
+
+class Instrumentacio:
+    """
+    Recull, per a cada subcarpeta i etapa de l'exportació (vegeu 'ETAPES'), el temps de rellotge,
+    el nombre de crides, els bytes llegits o escrits, les mostres descodificades, els NaN descartats,
+    les files escrites i la variació de la memòria resident ('delta_rss_mb': RSS en sortir menys
+    RSS en entrar, sumada per a totes les crides). Amb altres fils treballant alhora (p. ex. la
+    lectura anticipada), la variació també inclou el que ells reserven.
+
+    El pic real de memòria es mesura un cop per subcarpeta amb 'anotar_pic', en acabar-la: és el
+    pic del procés fins aquell moment (el màxim de tots els processos que hi han treballat).
+
+    Es pot compartir entre fils. Als processos treballadors se'n crea una de nova i el procés
+    principal n'hi afegeix els resultats amb 'fusionar'. Amb 'perfilar' també es pot fer un perfil
+    cProfile del fil que executa l'exportació (vegeu 'perfilant').
+    """
+
+    def __init__(self, memoria: bool = True, perfilar: bool = False):
+        self.memoria = memoria
+        self.carpetes: Dict[str, Dict[str, Dict[str, Any]]] = {}
+        self.pics: Dict[str, float] = {}
+        self.perfil = cProfile.Profile() if perfilar else None
+        self._lock = threading.Lock()
+
+    def afegir(self, carpeta: str, nom: str, temps_s: float = 0.0, crides: int = 0,
+               delta_rss_mb: Optional[float] = None, **comptadors) -> None:
+        """Acumula una mesura a l'etapa 'nom' de 'carpeta'."""
+        with self._lock:
+            etapa = self.carpetes.setdefault(carpeta, {}).setdefault(nom, _etapa_buida())
+            etapa["temps_s"] += temps_s
+            etapa["crides"] += crides
+            for clau, valor in comptadors.items():
+                etapa[clau] += valor
+            if delta_rss_mb is not None:
+                etapa["delta_rss_mb"] = (etapa["delta_rss_mb"] or 0.0) + delta_rss_mb
+
+    def anotar_pic(self, carpeta: str, pic_mb: Optional[float] = None) -> None:
+        """
+        Anota el pic de memòria de 'carpeta': 'pic_mb' o, per defecte, el pic actual del procés.
+        Es queda el màxim de totes les anotacions (p. ex. del procés principal i dels treballadors).
+        """
+        if pic_mb is None:
+            if not self.memoria:
+                return
+            pic_mb = pic_memoria_mb()
+            if pic_mb is None:
+                return
+        with self._lock:
+            if pic_mb > self.pics.get(carpeta, 0.0):
+                self.pics[carpeta] = pic_mb
+
+    @contextmanager
+    def etapa(self, carpeta: str, nom: str):
+        """
+        Mesura el bloc com una crida a l'etapa 'nom' de 'carpeta'. Retorna un diccionari on el bloc
+        pot sumar-hi els comptadors ('fitxers', 'bytes', 'mostres', 'nans', 'files').
+        """
+        comptadors = dict.fromkeys(COMPTADORS, 0)
+        rss = rss_memoria_mb() if self.memoria else None
+        inici = time.perf_counter()
+        try:
+            yield comptadors
+        finally:
+            durada = time.perf_counter() - inici
+            delta = None
+            if rss is not None:
+                rss_final = rss_memoria_mb()
+                delta = rss_final - rss if rss_final is not None else None
+            self.afegir(carpeta, nom, durada, 1, delta, **comptadors)
+
+    def fusionar(self, carpetes: Dict[str, Dict[str, Dict[str, Any]]],
+                 pics: Optional[Dict[str, float]] = None) -> None:
+        """Afegeix les mesures i els pics d'una altra instrumentació (p. ex. d'un procés treballador)."""
+        for carpeta, etapes in carpetes.items():
+            for nom, etapa in etapes.items():
+                etapa = dict(etapa)
+                self.afegir(carpeta, nom, etapa.pop("temps_s"), etapa.pop("crides"), etapa.pop("delta_rss_mb"),
+                            **etapa)
+        for carpeta, pic_mb in (pics or {}).items():
+            self.anotar_pic(carpeta, pic_mb)
+
+    @contextmanager
+    def perfilant(self):
+        """Activa el perfil cProfile (si s'ha demanat) durant el bloc, per al fil actual."""
+        if self.perfil is None:
+            yield
+            return
+        self.perfil.enable()
+        try:
+            yield
+        finally:
+            self.perfil.disable()
+
+    def total(self, carpeta: str) -> Dict[str, Any]:
+        """Suma de totes les etapes d'una subcarpeta, amb el pic de memòria anotat ('pic_mb')."""
+        total = _etapa_buida()
+        for etapa in self.carpetes.get(carpeta, {}).values():
+            total["temps_s"] += etapa["temps_s"]
+            total["crides"] += etapa["crides"]
+            for clau in COMPTADORS:
+                total[clau] += etapa[clau]
+            if etapa["delta_rss_mb"] is not None:
+                total["delta_rss_mb"] = (total["delta_rss_mb"] or 0.0) + etapa["delta_rss_mb"]
+        total["pic_mb"] = self.pics.get(carpeta)
+        return total
+
+    def resum(self, carpeta: str) -> List[str]:
+        """Línies per al log amb el temps i els comptadors de cada etapa d'una subcarpeta."""
+        etapes = self.carpetes.get(carpeta)
+        if not etapes:
+            return []
+        linies = [f"[i] Etapes de {carpeta}:"]
+        for nom in sorted(etapes, key=lambda n: ETAPES.index(n) if n in ETAPES else len(ETAPES)):
+            etapa = etapes[nom]
+            detalls = []
+            if etapa["fitxers"]:
+                detalls.append(f"{etapa['fitxers']} fitxers")
+            if etapa["bytes"]:
+                detalls.append(f"{etapa['bytes'] / 1e6:.1f} MB")
+            if etapa["mostres"]:
+                detalls.append(f"{etapa['mostres']} mostres")
+            if etapa["nans"]:
+                detalls.append(f"{etapa['nans']} NaN descartats")
+            if etapa["files"]:
+                detalls.append(f"{etapa['files']} files")
+            if etapa["delta_rss_mb"] is not None:
+                detalls.append(f"RSS {etapa['delta_rss_mb']:+.1f} MB")
+            detalls = f"  ({', '.join(detalls)})" if detalls else ""
+            linies.append(f"    {nom:<15}{etapa['temps_s']:>9.3f} s{detalls}")
+        total = self.total(carpeta)
+        pic = f"  (pic {total['pic_mb']:.0f} MB)" if total["pic_mb"] is not None else ""
+        linies.append(f"    {'total':<15}{total['temps_s']:>9.3f} s{pic}")
+        return linies
+
+    def informe(self) -> Dict[str, Any]:
+        """Informe complet: mesures per subcarpeta i etapa, i total de cada subcarpeta."""
+        with self._lock:
+            carpetes = {carpeta: {nom: dict(etapa) for nom, etapa in etapes.items()}
+                        for carpeta, etapes in self.carpetes.items()}
+        return {
+            "data": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "carpetes": carpetes,
+            "totals": {carpeta: self.total(carpeta) for carpeta in carpetes},
+        }
+
+    def desar(self, json_path: Optional[str] = None, perfil_path: Optional[str] = None) -> None:
+        """Desa l'informe en JSON i/o el perfil cProfile (llegible amb 'pstats' o snakeviz)."""
+        if json_path:
+            with open(json_path, "w", encoding="utf-8") as f:
+                json.dump(self.informe(), f, ensure_ascii=False, indent=1)
+        if perfil_path and self.perfil is not None:
+            self.perfil.dump_stats(perfil_path)
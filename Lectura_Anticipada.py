@@ -0,0 +1,214 @@
+import logging
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from Llegir_Fitxer_Dades import (HEADER_SIZE, SAMPLE_DTYPE, llegir_header_datafile, llegir_dades_columnes,
+                                 descodificar_mostres, filetime_a_epoch_ms)
+
+# Nombre per defecte de fitxers que es llegeixen per avançat (i de fils de lectura).
+FITXERS_ENDAVANT = 4
+
+# Memòria màxima per defecte (en MB) dels buffers llegits per avançat i encara no consumits.
+MEMORIA_LECTURA_MB = 256
+
+# Mida de cada petició de lectura: poques peticions grans en lloc de moltes de petites.
+MIDA_LECTURA = 8 << 20
+
+
+def llegir_mostres_crues(file_path: str, primera_mostra: int, nombre_mostres: int,
+                         mida_lectura: int = MIDA_LECTURA) -> np.ndarray:
+    """
+    Llegeix les mostres [primera_mostra, primera_mostra + nombre_mostres) d'un fitxer amb una sola
+    obertura i peticions seqüencials de 'mida_lectura' bytes, directament a un array de doubles.
+    Si el fitxer és més curt, es retornen només les mostres presents.
+    """
+    raw = np.empty(max(nombre_mostres, 0), dtype=SAMPLE_DTYPE)
+    buffer = memoryview(raw).cast("B")
+    llegits = 0
+    with open(file_path, "rb", buffering=0) as f:
+        f.seek(HEADER_SIZE + primera_mostra * SAMPLE_DTYPE.itemsize)
+        while llegits < len(buffer):
+            n = f.readinto(buffer[llegits:llegits + mida_lectura])
+            if not n:
+                break
+            llegits += n
+    return raw[:llegits // SAMPLE_DTYPE.itemsize]
+
+
+def llegir_capcaleres(paths: Sequence[str], fils: int) -> List[Tuple[str, Optional[Dict[str, Any]]]]:
+    """Llegeix les capçaleres de 'paths' en un pool de 'fils' fils i les retorna en el mateix ordre."""
+    if fils <= 1 or len(paths) <= 1:
+        return [(path, llegir_header_datafile(path)) for path in paths]
+    with ThreadPoolExecutor(max_workers=fils) as executor:
+        return list(zip(paths, executor.map(llegir_header_datafile, paths)))
+
+
+class LecturaAnticipada:
+    """
+    Lectura anticipada (read-ahead) dels fitxers d'una exportació, pensada per a arxius en unitats
+    de xarxa amb latència alta: mentre es descodifica i s'agrega un fitxer, un pool de fils ja en
+    llegeix els següents, de manera que la CPU i la xarxa treballen alhora.
+
+    'fitxers' són els fitxers preparats (vegeu 'preparar_fitxers') en l'ordre en què es consumiran.
+    De cada fitxer es llegeix l'interval de mostres ('primera_mostra', 'nombre_mostres') amb una sola
+    obertura i peticions grans (vegeu 'llegir_mostres_crues'). Hi ha com a màxim 'fitxers_endavant'
+    fitxers en curs i els buffers encara no consumits no passen de 'memoria_mb'. Els fitxers que no hi
+    caben sols, i els que 'ometre' indica (p. ex. els que ja té la memòria cau d'agregats), no es
+    llegeixen per avançat.
+
+    'llegir' té la mateixa signatura que 'llegir_dades_columnes': respon des del buffer si el té i,
+    si no, llegeix del disc com sempre ('encerts' i 'errades' en compten les crides). El buffer d'un
+    fitxer s'allibera quan se'n llegeix l'última part o quan el consumidor l'abandona a mitges (vegeu
+    'consumir'), perquè no ocupi el pressupost de memòria de les lectures següents.
+    """
+
+    def __init__(self, fitxers: Iterable[Dict[str, Any]], fitxers_endavant: int = FITXERS_ENDAVANT,
+                 memoria_mb: float = MEMORIA_LECTURA_MB, mida_lectura: int = MIDA_LECTURA,
+                 ometre: Optional[Callable[[Dict[str, Any]], bool]] = None):
+        self.fitxers_endavant = max(int(fitxers_endavant), 1)
+        self.memoria = int(memoria_mb * (1 << 20))
+        self.mida_lectura = mida_lectura
+        self.ometre = ometre
+        self._fitxers = iter(fitxers)
+        self._seguent: Optional[Dict[str, Any]] = None
+        # path -> (primera mostra, bytes reservats, future amb les mostres crues), en ordre de consum.
+        self._pendents: Dict[str, Tuple[int, int, Future]] = {}
+        self._consumint: Dict[str, Tuple[int, np.ndarray, int]] = {}
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=self.fitxers_endavant)
+        self.encerts = 0
+        self.errades = 0
+        self._omplir()
+
+    def __enter__(self) -> "LecturaAnticipada":
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.tancar()
+
+    def tancar(self) -> None:
+        """Cancel·la les lectures que no han començat i allibera els buffers."""
+        with self._lock:
+            for _, _, future in self._pendents.values():
+                future.cancel()
+            self._pendents.clear()
+            self._consumint.clear()
+            self._bytes = 0
+        self._executor.shutdown(wait=True)
+
+    def _omplir(self) -> None:
+        """Envia lectures mentre hi hagi lloc a la finestra de fitxers i al pressupost de memòria."""
+        while len(self._pendents) + len(self._consumint) < self.fitxers_endavant:
+            if self._seguent is None:
+                self._seguent = next(self._fitxers, None)
+                if self._seguent is None:
+                    return
+            fitxer = self._seguent
+            mida = fitxer["nombre_mostres"] * SAMPLE_DTYPE.itemsize
+            if mida > self.memoria or fitxer["path"] in self._pendents or (self.ometre and self.ometre(fitxer)):
+                self._seguent = None
+                continue
+            if self._bytes + mida > self.memoria:
+                return
+            self._seguent = None
+            self._bytes += mida
+            self._pendents[fitxer["path"]] = (
+                fitxer["primera_mostra"], mida,
+                self._executor.submit(llegir_mostres_crues, fitxer["path"], fitxer["primera_mostra"],
+                                      fitxer["nombre_mostres"], self.mida_lectura))
+
+    def _buffer(self, path: str) -> Optional[Tuple[int, np.ndarray]]:
+        """Buffer (primera mostra, mostres crues) del fitxer, esperant que s'acabi de llegir si cal."""
+        with self._lock:
+            if path in self._consumint:
+                return self._consumint[path][:2]
+            if path not in self._pendents:
+                # Aquest fitxer no s'ha llegit per avançat: es llegirà del disc. Si és el que esperava
+                # lloc al pressupost, tots els pendents són anteriors i ja no es demanaran.
+                if self._seguent is not None and self._seguent["path"] == path:
+                    self._seguent = None
+                    self._descartar_anteriors(None)
+                self._omplir()
+                return None
+            self._descartar_anteriors(path)
+            primera, mida, future = self._pendents.pop(path)
+        try:
+            raw = future.result()
+        except Exception as e:
+            logging.warning(f"Error en la lectura anticipada de {path}: {e}")
+            raw = None
+        with self._lock:
+            if raw is None:
+                self._bytes -= mida
+                self._omplir()
+                return None
+            self._consumint[path] = (primera, raw, mida)
+            return primera, raw
+
+    def _descartar_anteriors(self, path: Optional[str]) -> None:
+        """Descarta les lectures no començades a consumir dels fitxers anteriors a 'path' (amb None, totes)."""
+        for anterior in list(self._pendents):
+            if anterior == path:
+                break
+            _, mida, future = self._pendents.pop(anterior)
+            future.cancel()
+            self._bytes -= mida
+
+    def alliberar(self, path: str) -> None:
+        """Allibera el buffer del fitxer (o en cancel·la la lectura pendent) i deixa lloc per als següents."""
+        with self._lock:
+            entrada = self._consumint.pop(path, None)
+            if entrada is not None:
+                self._bytes -= entrada[2]
+            elif path in self._pendents:
+                _, mida, future = self._pendents.pop(path)
+                future.cancel()
+                self._bytes -= mida
+            else:
+                return
+            self._omplir()
+
+    def consumir(self, path: str, parts: Iterator[Any]) -> Iterator[Any]:
+        """
+        Retorna els elements de 'parts' (p. ex. els agregats parcials del fitxer llegits amb 'llegir') i,
+        en acabar, allibera el buffer del fitxer encara que no se n'hagi llegit tot: error de lectura,
+        final de la finestra, excepció de l'escriptor o cancel·lació.
+        """
+        try:
+            yield from parts
+        finally:
+            self.alliberar(path)
+
+    def llegir(self, file_path: str, header_info: Dict[str, Any], decimals: Optional[int] = 3,
+               primera_mostra: int = 0,
+               nombre_mostres: Optional[int] = None) -> Optional[Tuple[np.ndarray, np.ndarray]]:
+        """Com 'llegir_dades_columnes', però des del buffer llegit per avançat si conté l'interval demanat."""
+        buffer = self._buffer(file_path)
+        if buffer is None:
+            self.errades += 1
+            return llegir_dades_columnes(file_path, header_info, decimals, primera_mostra, nombre_mostres)
+        self.encerts += 1
+        primera, raw = buffer
+        inici = primera_mostra - primera
+        fi = len(raw) if nombre_mostres is None else inici + nombre_mostres
+        try:
+            if inici < 0 or fi > len(raw):
+                # El fitxer ha canviat des de la lectura anticipada: es llegeix del disc.
+                return llegir_dades_columnes(file_path, header_info, decimals, primera_mostra, nombre_mostres)
+            start_ms = filetime_a_epoch_ms(header_info['header']['StartTime'])
+            if start_ms is None:
+                logging.error("StartTime convertit a datetime és None.")
+                return None
+            return descodificar_mostres(raw[inici:fi], start_ms, header_info['header']['SamplePeriod'],
+                                        primera_mostra, decimals)
+        except Exception as e:
+            logging.error(f"Error al llegir les dades: {e}")
+            return None
+        finally:
+            if fi >= len(raw):
+                # Última part del buffer: s'allibera i es pot llegir un altre fitxer.
+                self.alliberar(file_path)
@@ -1,18 +1,26 @@
+import os
 import struct
 import datetime
 import logging
-import math
-from typing import Optional, Dict, Any, List
+from typing import Optional, Dict, Any, Iterator, List, Tuple
+
+import numpy as np
 
 logging.basicConfig(level=logging.INFO, format='%(levelname)s: %message)s')
 
+# Mida en bytes i format (struct) de la capçalera DATAFILEHEADER, i format de cada mostra.
+HEADER_SIZE = 304
+HEADER_FORMAT = "<112s4f8sHHq12x80sIHHHI8sIQQIIq6x"
+SAMPLE_DTYPE = np.dtype("<f8")
+FILETIME_EPOCH_OFFSET = 116444736000000000
+
 
 def convert_filetime_to_datetime(filetime_ticks: int) -> Optional[datetime.datetime]:
     """
     Converteix un FILETIME (ticks, intervals de 100 ns des del 1/1/1601) a un objecte datetime UTC.
     Si el càlcul resulta en un valor fora del rang, retorna None.
     """
-    offset = 116444736000000000
+    offset = FILETIME_EPOCH_OFFSET
     try:
         seconds = (filetime_ticks - offset) / 10000000
         if seconds < 0:
@@ -36,9 +44,8 @@ def llegir_header_datafile(file_path: str) -> Optional[Dict[str, Any]]:
     """
     try:
         with open(file_path, 'rb') as f:
-            header_bytes = f.read(304)
-            format_string = "<112s4f8sHHq12x80sIHHHI8sIQQIIq6x"
-            unpacked = struct.unpack(format_string, header_bytes)
+            header_bytes = f.read(HEADER_SIZE)
+            unpacked = struct.unpack(HEADER_FORMAT, header_bytes)
             header_data = {
                 "Title": unpacked[0].decode('latin-1').strip('\x00'),
                 "scales": {
@@ -73,50 +80,184 @@ def llegir_header_datafile(file_path: str) -> Optional[Dict[str, Any]]:
         return None
 
 
-def llegir_dades(file_path: str, header_info: Dict[str, Any]) -> Optional[List[Dict[str, Any]]]:
+def filetime_a_epoch_ms(filetime_ticks: int) -> Optional[int]:
     """
-    Llegeix les dades del fitxer a partir de la capçalera.
-    
+    Converteix un FILETIME (ticks de 100 ns des del 1/1/1601) a mil·lisegons des de l'epoch UNIX.
+    Retorna None si el resultat és anterior a l'epoch.
+    """
+    ms = (filetime_ticks - FILETIME_EPOCH_OFFSET) // 10000
+    if ms < 0:
+        logging.warning(f"Timestamp {filetime_ticks} resultant en un valor negatiu de segons.")
+        return None
+    return ms
+
+
+def nombre_mostres_fitxer(file_path: str, header_info: Dict[str, Any], avisar: bool = True) -> int:
+    """
+    Retorna el nombre de mostres que es poden llegir del fitxer: 'DataLength' limitat
+    pels bytes realment presents després de la capçalera. Amb 'avisar' es registra un avís
+    si el fitxer és truncat (només s'ha de fer un cop per fitxer, no a cada bloc).
+    """
+    n_samples = header_info['header']['DataLength']
+    available = max(os.path.getsize(file_path) - HEADER_SIZE, 0) // SAMPLE_DTYPE.itemsize
+    if available < n_samples:
+        if avisar:
+            logging.warning(f"Alerta: bytes insuficients a la mostra {available}")
+        n_samples = available
+    return max(n_samples, 0)
+
+
+def mostres_escrites(file_path: str, header_info: Dict[str, Any]) -> int:
+    """
+    Retorna el nombre de mostres ja escrites d'un fitxer que Citect encara omple: les de
+    'nombre_mostres_fitxer' (sense avisar si en falten, perquè el fitxer creix) limitades per
+    'EndTime', el temps de l'última mostra escrita, quan la capçalera el porta.
+    """
+    header = header_info['header']
+    n_samples = nombre_mostres_fitxer(file_path, header_info, avisar=False)
+    start_ms = filetime_a_epoch_ms(header['StartTime'])
+    if start_ms is not None and header['EndTime'] > header['StartTime'] and header['SamplePeriod'] > 0:
+        end_ms = filetime_a_epoch_ms(header['EndTime'])
+        n_samples = min(n_samples, (end_ms - start_ms) // header['SamplePeriod'] + 1)
+    return n_samples
+
+
+def llegir_dades_columnes(file_path: str, header_info: Dict[str, Any], decimals: Optional[int] = 3,
+                          primera_mostra: int = 0,
+                          nombre_mostres: Optional[int] = None) -> Optional[Tuple[np.ndarray, np.ndarray]]:
+    """
+    Llegeix les dades del fitxer en format columnar mapejant a memòria el bloc de mostres.
+
+    El bloc comença just després de la capçalera (304 bytes) i conté 'DataLength' doubles
+    de 8 bytes. Els timestamps es calculen com StartTime + índex * SamplePeriod i les
+    mostres NaN es descarten amb una màscara.
+
     Args:
         file_path (str): Ruta al fitxer.
         header_info (dict): Diccionari amb les dades de la capçalera.
-    
+        decimals (int, opcional): Decimals als quals s'arrodoneixen els valors (None per no arrodonir).
+        primera_mostra (int, opcional): Índex de la primera mostra a llegir.
+        nombre_mostres (int, opcional): Nombre màxim de mostres a llegir (per defecte, fins al final).
+
     Returns:
-        list: Llista de diccionaris amb 'value' i 'time', o None en cas d'error.
+        tuple: (timestamps, valors) com a arrays int64 (mil·lisegons epoch UTC) i float64,
+        o None en cas d'error.
     """
     try:
-        with open(file_path, 'rb') as f:
-            f.seek(304)
-            n_samples = header_info['header']['DataLength']
-            samples: List[Dict[str, Any]] = []
-            sample_format = "<d"
-            sample_size = struct.calcsize(sample_format)
-            start_dt = convert_filetime_to_datetime(header_info['header']['StartTime'])
-            if start_dt is None:
-                logging.error("StartTime convertit a datetime és None.")
-                return None
-            delta = datetime.timedelta(milliseconds=header_info['header']['SamplePeriod'])
-            nan_count = 0  # Comptador de NaN
-            for i in range(n_samples):
-                sample_bytes = f.read(sample_size)
-                if len(sample_bytes) != sample_size:
-                    logging.warning(f"Alerta: bytes insuficients a la mostra {i}")
-                    break
-                value = struct.unpack(sample_format, sample_bytes)[0]
-                
-                # Control per si el valor és NaN  
-                if math.isnan(value):
-                    nan_count += 1
-                    continue
-
-                value = round(value, 3)
-                sample_time = start_dt + i * delta
-                # Mantenim sample_time com a datetime
-                samples.append({"value": value, "time": sample_time})
-            if nan_count:
-                logging.debug(f"NaN sample values descartats: {nan_count}")
-            return samples
+        start_ms = filetime_a_epoch_ms(header_info['header']['StartTime'])
+        if start_ms is None:
+            logging.error("StartTime convertit a datetime és None.")
+            return None
+        period_ms = header_info['header']['SamplePeriod']
+
+        # Amb 'nombre_mostres' el bloc ja s'ha calculat (p. ex. amb 'blocs_mostres'), que ja ha avisat.
+        n_samples = nombre_mostres_fitxer(file_path, header_info, avisar=nombre_mostres is None) - primera_mostra
+        if nombre_mostres is not None:
+            n_samples = min(n_samples, nombre_mostres)
+        if n_samples <= 0:
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float64)
+
+        raw = np.memmap(file_path, dtype=SAMPLE_DTYPE, mode='r',
+                        offset=HEADER_SIZE + primera_mostra * SAMPLE_DTYPE.itemsize, shape=(n_samples,))
+        try:
+            return descodificar_mostres(raw, start_ms, period_ms, primera_mostra, decimals)
+        finally:
+            del raw
     except Exception as e:
         logging.error(f"Error al llegir les dades: {e}")
         return None
 
+
+def descodificar_mostres(raw: np.ndarray, start_ms: int, period_ms: int, primera_mostra: int = 0,
+                         decimals: Optional[int] = 3) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Converteix un bloc de mostres crues (doubles a partir de la mostra 'primera_mostra', ja siguin
+    mapejades a memòria o llegides a un buffer) en (timestamps, valors) sense els NaN.
+    """
+    mask = ~np.isnan(raw)
+    values = np.asarray(raw[mask], dtype=np.float64)
+    index = np.flatnonzero(mask)
+    timestamps = start_ms + (index.astype(np.int64) + primera_mostra) * period_ms
+
+    nan_count = len(raw) - len(values)
+    if nan_count:
+        logging.debug(f"NaN sample values descartats: {nan_count}")
+    if decimals is not None:
+        np.round(values, decimals, out=values)
+    return timestamps, values
+
+
+def rang_mostres(header_info: Dict[str, Any], inici_ms: Optional[int] = None,
+                 fi_ms: Optional[int] = None) -> Tuple[int, int]:
+    """
+    Calcula l'interval d'índexs [primera, última) de les mostres del fitxer amb timestamp dins
+    de la finestra [inici_ms, fi_ms), sense llegir cap mostra: com que són doubles de 8 bytes
+    a intervals regulars, la mostra i és a l'offset 304 + 8 * i i té temps StartTime + i * SamplePeriod.
+
+    Returns:
+        tuple: (primera, última). Si la finestra no intersecta el fitxer, primera >= última.
+    """
+    n_samples = header_info['header']['DataLength']
+    start_ms = filetime_a_epoch_ms(header_info['header']['StartTime'])
+    period_ms = header_info['header']['SamplePeriod']
+    if start_ms is None:
+        return 0, 0
+    primera, ultima = 0, n_samples
+    if period_ms <= 0:
+        dins = (inici_ms is None or start_ms >= inici_ms) and (fi_ms is None or start_ms < fi_ms)
+        return (0, n_samples) if dins else (0, 0)
+    if inici_ms is not None:
+        primera = max(primera, -(-(inici_ms - start_ms) // period_ms))
+    if fi_ms is not None:
+        ultima = min(ultima, -(-(fi_ms - start_ms) // period_ms))
+    return primera, ultima
+
+
+def iterar_blocs_columnes(file_path: str, header_info: Dict[str, Any], mida_bloc: int = 1 << 20,
+                          primera_mostra: int = 0,
+                          nombre_mostres: Optional[int] = None) -> Iterator[Tuple[np.ndarray, np.ndarray]]:
+    """
+    Llegeix el fitxer en blocs consecutius de com a màxim 'mida_bloc' mostres.
+
+    Cada bloc es retorna com a (timestamps, valors) igual que 'llegir_dades_columnes', de manera
+    que la memòria necessària no depèn de la mida del fitxer. Amb 'primera_mostra' i
+    'nombre_mostres' només es llegeix aquest interval de mostres. Si un bloc no es pot llegir,
+    s'atura la iteració (l'error ja queda registrat al log).
+    """
+    for primera, n_samples in blocs_mostres(file_path, header_info, mida_bloc, primera_mostra, nombre_mostres):
+        columns = llegir_dades_columnes(file_path, header_info, primera_mostra=primera, nombre_mostres=n_samples)
+        if columns is None:
+            return
+        yield columns
+
+
+def blocs_mostres(file_path: str, header_info: Dict[str, Any], mida_bloc: int = 1 << 20, primera_mostra: int = 0,
+                  nombre_mostres: Optional[int] = None) -> List[Tuple[int, int]]:
+    """Retorna (primera mostra, nombre de mostres) de cada bloc que llegeix 'iterar_blocs_columnes'."""
+    fi = nombre_mostres_fitxer(file_path, header_info)
+    if nombre_mostres is not None:
+        fi = min(fi, primera_mostra + nombre_mostres)
+    return [(primera, min(mida_bloc, fi - primera)) for primera in range(primera_mostra, fi, mida_bloc)]
+
+
+def llegir_dades(file_path: str, header_info: Dict[str, Any]) -> Optional[List[Dict[str, Any]]]:
+    """
+    Vista de compatibilitat sobre 'llegir_dades_columnes' que retorna una mostra per diccionari.
+
+    Només s'ha de fer servir quan cal el format antic; per a volums grans cal treballar
+    directament amb els arrays de 'llegir_dades_columnes'.
+
+    Args:
+        file_path (str): Ruta al fitxer.
+        header_info (dict): Diccionari amb les dades de la capçalera.
+
+    Returns:
+        list: Llista de diccionaris amb 'value' i 'time', o None en cas d'error.
+    """
+    columns = llegir_dades_columnes(file_path, header_info)
+    if columns is None:
+        return None
+    timestamps, values = columns
+    epoch = datetime.datetime(1970, 1, 1)
+    return [{"value": value, "time": epoch + datetime.timedelta(milliseconds=ts)}
+            for ts, value in zip(timestamps.tolist(), values.tolist())]
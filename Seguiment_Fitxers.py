@@ -0,0 +1,218 @@
+import os
+import datetime
+import threading
+from typing import Any, Dict, Iterator, List, Optional, Sequence
+
+from Llegir_Fitxer_Dades import (llegir_header_datafile, iterar_blocs_columnes, mostres_escrites,
+                                 nombre_mostres_fitxer, rang_mostres)
+from Agregar_Mostres import EPOCH, Agregat
+from Escriptors_Sortida import crear_escriptor
+from Exportar_Dades import (MIDA_BLOC, llistar_fitxers_dades, preparar_fitxers, aplicar_finestra, rang_temporal,
+                            process_subfolder, nom_sortida, llegir_watermark, desar_watermark, datetime_a_epoch_ms)
+
+# Interval per defecte (en segons) entre dues consultes dels fitxers actius.
+INTERVAL_SEGUIMENT = 10
+
+
+def ruta_seguent(path: str, numero: Optional[int] = None) -> str:
+    """
+    Ruta del fitxer amb l'extensió numèrica següent ('TAG.007' -> 'TAG.008') amb el mateix nombre
+    de xifres, o la del número 'numero' (p. ex. 0 per al primer fitxer de la sèrie).
+    """
+    base, ext = os.path.splitext(path)
+    xifres = ext[1:]
+    if numero is None:
+        numero = int(xifres) + 1
+    return f"{base}.{numero:0{len(xifres)}d}"
+
+
+class SeguimentCarpeta:
+    """
+    Manté al dia el CSV d'una subcarpeta mentre Citect hi escriu (mode seguiment).
+
+    'iniciar' posa al dia el CSV amb l'exportació incremental i recalcula en memòria l'últim bucket
+    escrit. A partir d'aquí, cada 'actualitzar' només rellegeix la capçalera del fitxer actiu i les
+    mostres afegides des de la consulta anterior, reescriu la fila de l'últim bucket, hi afegeix
+    els buckets nous i desa el watermark, de manera que una exportació incremental posterior continua
+    des del mateix punt.
+
+    Quan el fitxer amb l'extensió numèrica següent (o el primer de la sèrie, si Citect torna a
+    començar) té un 'StartTime' més recent que l'actiu, s'acaba de llegir l'actiu i se segueix el nou.
+    """
+
+    def __init__(self, source_folder: str, export_folder: str, export_period_sec: int,
+                 statistics: Sequence[str] = ("mean",), cataleg=None):
+        self.source_folder = source_folder
+        self.export_period_sec = export_period_sec
+        self.statistics = tuple(statistics)
+        self.cataleg = cataleg
+        self.csv_filename = nom_sortida(source_folder, export_folder)
+        # Buckets des de la fila de l'offset: l'últim escrit (encara pot rebre mostres) i els nous.
+        self.obert = Agregat.buit(export_period_sec * 1000)
+        self.offset: Optional[int] = None
+        self.watermark_ms: Optional[int] = None
+        # Inici de la finestra de l'exportació ('start_time'): les mostres anteriors no se segueixen.
+        self.inici_ms: Optional[int] = None
+        # Fitxer actiu: 'path', 'header' i nombre de mostres ja llegides ('llegides').
+        self.actiu: Optional[Dict[str, Any]] = None
+        self.estat: Dict[str, Dict[str, int]] = {}
+
+    def iniciar(self, **kwargs) -> str:
+        """
+        Exporta la subcarpeta amb 'process_subfolder' en mode incremental (amb les opcions de
+        'kwargs') i prepara el seguiment a partir del watermark resultant. Retorna el missatge de l'exportació.
+        """
+        msg = process_subfolder(self.source_folder, os.path.dirname(self.csv_filename), self.export_period_sec,
+                                statistics=self.statistics, cataleg=self.cataleg, incremental=True, **kwargs)
+        self.inici_ms = datetime_a_epoch_ms(kwargs.get("start_time"))
+        marca = llegir_watermark(self.csv_filename)
+        if marca is not None:
+            self.offset, self.watermark_ms, self.estat = marca["offset"], marca["watermark_ms"], marca["fitxers"]
+        fitxers = preparar_fitxers(self.source_folder, llistar_fitxers_dades(self.source_folder, self.cataleg), [],
+                                   cataleg=self.cataleg)
+        if not fitxers:
+            return msg
+        if self.watermark_ms is not None:
+            # Es tornen a llegir les mostres de l'últim bucket escrit: les dels fitxers anteriors ara i
+            # les de l'actiu a la primera actualització.
+            parts = [self.obert]
+            for fitxer in aplicar_finestra(fitxers[:-1], self._des_de_ms()):
+                parts.extend(self._agregar(fitxer["path"], fitxer["header"], fitxer["primera_mostra"],
+                                           fitxer["primera_mostra"] + fitxer["nombre_mostres"]))
+            self.obert = Agregat.fusionar(parts)
+        # Sense watermark, l'exportació no ha escrit cap fila: els fitxers anteriors no tenen mostres
+        # a la finestra i el seguiment comença a l'actiu.
+        actiu = fitxers[-1]
+        self.actiu = {"path": actiu["path"], "header": actiu["header"], "llegides": self._primera(actiu["header"])}
+        return msg
+
+    def _des_de_ms(self) -> Optional[int]:
+        """Primer timestamp que cal agregar: l'inici de l'últim bucket escrit, mai abans de 'start_time'."""
+        limits = [ms for ms in (self.watermark_ms, self.inici_ms) if ms is not None]
+        return max(limits) if limits else None
+
+    def _primera(self, header_info: Dict[str, Any]) -> int:
+        """Índex de la primera mostra del fitxer a partir de '_des_de_ms'."""
+        des_de = self._des_de_ms()
+        return max(rang_mostres(header_info, des_de)[0], 0) if des_de is not None else 0
+
+    def _agregar(self, path: str, header_info: Dict[str, Any], primera: int, fi: int) -> List[Agregat]:
+        """Agrega les mostres [primera, fi) del fitxer, descartant les anteriors a '_des_de_ms'."""
+        parts = []
+        des_de = self._des_de_ms()
+        for timestamps, values in iterar_blocs_columnes(path, header_info, MIDA_BLOC, primera, fi - primera):
+            if des_de is not None:
+                # Les files anteriors a l'offset ja són definitives: aquestes mostres les recollirà
+                # la propera exportació completa. Les anteriors a 'start_time' no s'exporten.
+                posteriors = timestamps >= des_de
+                timestamps, values = timestamps[posteriors], values[posteriors]
+            parts.append(Agregat.des_de_mostres(timestamps, values, self.export_period_sec))
+        return parts
+
+    def _anotar_estat(self, path: str, header_info: Dict[str, Any]) -> None:
+        rang = rang_temporal(header_info)
+        if rang is None:
+            return
+        st = os.stat(path)
+        self.estat[os.path.basename(path)] = {"size": st.st_size, "mtime_ns": st.st_mtime_ns,
+                                              "start_ms": rang[0], "end_ms": rang[1]}
+
+    def _fitxer_seguent(self) -> Optional[Dict[str, Any]]:
+        """Fitxer que Citect ha començat a escriure després de l'actiu, o None si encara no n'hi ha."""
+        path = self.actiu["path"]
+        start_time = self.actiu["header"]["header"]["StartTime"]
+        for candidat in (ruta_seguent(path), ruta_seguent(path, 0)):
+            if candidat == path or not os.path.exists(candidat):
+                continue
+            header_info = llegir_header_datafile(candidat)
+            if header_info is not None and header_info["header"]["StartTime"] > start_time:
+                return {"path": candidat, "header": header_info, "llegides": 0}
+        return None
+
+    def _buscar_actiu(self) -> bool:
+        """Pren com a actiu el fitxer de 'StartTime' més recent de la subcarpeta (si n'hi ha)."""
+        fitxers = preparar_fitxers(self.source_folder, llistar_fitxers_dades(self.source_folder), [])
+        if not fitxers:
+            return False
+        self.actiu = {"path": fitxers[-1]["path"], "header": fitxers[-1]["header"],
+                      "llegides": self._primera(fitxers[-1]["header"])}
+        return True
+
+    def _llegir_noves(self) -> List[Agregat]:
+        """Agrega les mostres escrites des de l'última consulta, passant als fitxers següents si cal."""
+        parts = []
+        while self.actiu is not None or self._buscar_actiu():
+            path = self.actiu["path"]
+            header_info = llegir_header_datafile(path)
+            if header_info is None:
+                break
+            if header_info["header"]["StartTime"] != self.actiu["header"]["header"]["StartTime"]:
+                # Citect ha tornat a començar aquest fitxer.
+                self.actiu["llegides"] = 0
+            self.actiu["header"] = header_info
+            seguent = self._fitxer_seguent()
+            # Un cop Citect ha passat al fitxer següent, l'actiu ja és complet.
+            fi = nombre_mostres_fitxer(path, header_info) if seguent else mostres_escrites(path, header_info)
+            if fi > self.actiu["llegides"]:
+                parts.extend(self._agregar(path, header_info, self.actiu["llegides"], fi))
+                self.actiu["llegides"] = fi
+            self._anotar_estat(path, header_info)
+            if seguent is None:
+                break
+            self.actiu = seguent
+        return parts
+
+    def actualitzar(self) -> int:
+        """
+        Llegeix les mostres noves i actualitza el CSV i el watermark. Retorna el nombre de buckets
+        escrits (l'últim, reescrit, i els nous), o 0 si no hi ha mostres noves.
+        """
+        parts = self._llegir_noves()
+        if not parts:
+            return 0
+        obert = Agregat.fusionar([self.obert] + parts)
+        if not len(obert):
+            return 0
+        escriptor = crear_escriptor(self.csv_filename, self.statistics, offset=self.offset)
+        try:
+            escriptor.escriure(obert)
+        except Exception:
+            escriptor.avortar()
+            raise
+        escriptor.tancar()
+        self.offset, self.watermark_ms = escriptor.ultima_fila
+        self.obert = obert.seleccionar(slice(-1, None))
+        desar_watermark(self.csv_filename, self.export_period_sec, self.statistics, self.watermark_ms, self.offset,
+                        self.estat)
+        return len(obert)
+
+
+def seguir_carpetes(source_folders: Sequence[str], export_folder: str, export_period_sec: int,
+                    interval_sec: float = INTERVAL_SEGUIMENT, statistics: Sequence[str] = ("mean",), cataleg=None,
+                    cancel_event: Optional[threading.Event] = None, **kwargs) -> Iterator[str]:
+    """
+    Exporta les subcarpetes en mode incremental i després les segueix (vegeu 'SeguimentCarpeta'),
+    consultant els fitxers actius cada 'interval_sec' segons fins que s'activa 'cancel_event'.
+
+    Retorna primer un missatge per subcarpeta amb el resultat de l'exportació inicial (com
+    'exportar_carpetes') i després un missatge per cada CSV actualitzat. Les opcions de 'kwargs'
+    (p. ex. 'progress_callback' o 'instrumentacio') només s'apliquen a l'exportació inicial.
+    """
+    aturar = cancel_event if cancel_event is not None else threading.Event()
+    seguiments = []
+    for source_folder in source_folders:
+        seguiment = SeguimentCarpeta(source_folder, export_folder, export_period_sec, statistics, cataleg)
+        yield seguiment.iniciar(cancel_event=cancel_event, **kwargs)
+        if aturar.is_set():
+            return
+        seguiments.append(seguiment)
+    while not aturar.wait(interval_sec):
+        for seguiment in seguiments:
+            try:
+                buckets = seguiment.actualitzar()
+            except Exception as e:
+                yield f"[!] Error actualitzant {seguiment.csv_filename}: {e}"
+                continue
+            if buckets:
+                fins = (EPOCH + datetime.timedelta(milliseconds=seguiment.watermark_ms)).strftime('%d/%m/%Y %H:%M:%S')
+                yield f"[OK] Seguiment actualitzat: {seguiment.csv_filename} ({buckets} buckets fins a {fins})"
@@ -0,0 +1,236 @@
+"""
+Punt d'entrada en línia de comandes (sense GUI) per a exportacions programades o per lots.
+
+Exemples:
+    python main_cli.py D:\\Trends -o D:\\Exports --periode "1 minut"
+    python main_cli.py D:\\Trends -o D:\\Exports --filtre "*_TR2" --periode 600 --format parquet --processos 4
+    python main_cli.py D:\\Trends -o D:\\Exports --periode "20 segons,10 minuts,1 hora,1 dia"
+    python main_cli.py D:\\Trends -o D:\\Exports --des-de 2026-01-01 --fins-a 2026-02-01 --taula-ampla
+    python main_cli.py D:\\Trends -o D:\\Exports --informe informe.json --perfil export.prof
+    python main_cli.py D:\\Trends -o D:\\Exports --periode "1 minut" --seguir 10
+    python main_cli.py --gui
+
+El resultat s'escriu a la sortida estàndard com a JSON. El nucli d'exportació només s'importa
+després de validar els arguments, i la GUI (customtkinter/tkinter) només amb '--gui'.
+
+Amb '--seguir' els CSV es mantenen al dia fins que s'interromp el procés (Ctrl+C): cada
+actualització s'escriu a la sortida d'errors i el resum JSON en acabar.
+"""
+import sys
+import json
+import time
+import argparse
+import datetime
+import itertools
+from contextlib import nullcontext
+
+# Formats acceptats per a '--des-de' i '--fins-a' (UTC), a més d'ISO 8601.
+FORMATS_DATA = ("%d/%m/%Y %H:%M", "%d/%m/%Y")
+
+
+def parse_data(text: str) -> datetime.datetime:
+    """Converteix una data de la línia de comandes (ISO 8601 o dd/mm/aaaa [hh:mm], UTC) a datetime."""
+    try:
+        return datetime.datetime.fromisoformat(text)
+    except ValueError:
+        pass
+    for fmt in FORMATS_DATA:
+        try:
+            return datetime.datetime.strptime(text, fmt)
+        except ValueError:
+            continue
+    raise argparse.ArgumentTypeError(f"data no vàlida: {text!r}")
+
+
+def crear_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(
+        description="Exporta a CSV, Parquet o Feather les dades de tendència de Citect.")
+    parser.add_argument("source_folder", nargs="?", metavar="ORIGEN",
+                        help="Carpeta d'origen amb les subcarpetes de dades.")
+    parser.add_argument("-o", "--sortida", dest="export_folder", metavar="CARPETA",
+                        help="Carpeta on es guarden els fitxers exportats.")
+    parser.add_argument("--filtre", default="TR2", metavar="FILTRE",
+                        help="Subcarpetes a exportar: text que ha d'aparèixer al nom o patró glob (per defecte TR2).")
+    parser.add_argument("--periode", default="20 segons", metavar="PERÍODE",
+                        help="Període d'exportació: segons o una etiqueta de la GUI, p. ex. '1 minut' "
+                             "(per defecte 20 segons). Amb diversos períodes separats per comes es llegeixen "
+                             "les dades un sol cop i s'escriu un fitxer per subcarpeta i període.")
+    parser.add_argument("--des-de", type=parse_data, metavar="DATA", help="Inici (inclòs, UTC) del rang temporal.")
+    parser.add_argument("--fins-a", type=parse_data, metavar="DATA", help="Final (exclòs, UTC) del rang temporal.")
+    parser.add_argument("--columnes", default="mean", metavar="LLISTA",
+                        help="Estadístiques separades per comes: mean, min, max, count, first, last, std.")
+    parser.add_argument("--format", dest="output_format", default="csv", choices=("csv", "parquet", "feather"),
+                        help="Format de sortida (per defecte csv).")
+    parser.add_argument("--compressio", dest="compression", default=None, metavar="COMPRESSIÓ",
+                        help="Compressió de la sortida: gzip o zstd (csv), snappy, gzip o zstd (parquet), "
+                             "lz4 o zstd (feather).")
+    parser.add_argument("--processos", dest="workers", type=int, default=1, metavar="N",
+                        help="Nombre de processos treballadors (per defecte 1, en sèrie).")
+    parser.add_argument("--lectura-anticipada", dest="lectura_anticipada", type=int, default=0, metavar="N",
+                        help="Llegeix per avançat els N fitxers següents en un pool de fils mentre es descodifica "
+                             "l'actual (útil en unitats de xarxa; per defecte 0, desactivat).")
+    parser.add_argument("--memoria-lectura", dest="memoria_lectura_mb", type=float, default=256, metavar="MB",
+                        help="Memòria màxima dels fitxers llegits per avançat (per defecte 256 MB).")
+    parser.add_argument("--incremental", action="store_true", help="Afegeix als CSV existents només els buckets nous.")
+    parser.add_argument("--seguir", type=float, metavar="SEGONS",
+                        help="Després de l'exportació (incremental, CSV i un sol període) segueix els fitxers que "
+                             "Citect està escrivint i actualitza els CSV cada SEGONS segons fins a Ctrl+C.")
+    parser.add_argument("--taula-ampla", action="store_true",
+                        help="Exporta totes les subcarpetes a un sol fitxer amb una columna per etiqueta.")
+    parser.add_argument("--cataleg", metavar="FITXER", help="Fitxer SQLite del catàleg de capçaleres (opcional).")
+    parser.add_argument("--cache-agregats", metavar="FITXER",
+                        help="Fitxer SQLite de la memòria cau d'agregats per fitxer (opcional): les exportacions "
+                             "següents a qualsevol període no tornen a descodificar els fitxers sense canvis.")
+    parser.add_argument("--informe", metavar="FITXER",
+                        help="Desa en JSON el temps, els comptadors i el pic de memòria de cada etapa.")
+    parser.add_argument("--perfil", metavar="FITXER",
+                        help="Desa un perfil cProfile de l'exportació (llegible amb pstats o snakeviz).")
+    parser.add_argument("--gui", action="store_true", help="Obre la interfície gràfica.")
+    return parser
+
+
+def periode_en_segons(text: str, export_periods) -> int:
+    """Interpreta '--periode' com a nombre de segons o com a etiqueta de 'EXPORT_PERIODS'."""
+    if text in export_periods:
+        return export_periods[text]
+    if text.isdigit() and int(text) > 0:
+        return int(text)
+    raise ValueError(f"període no vàlid: {text!r} (opcions: {', '.join(export_periods)} o un nombre de segons)")
+
+
+def resultat_json(missatge: str, **camps) -> dict:
+    """Converteix el missatge de resultat d'una exportació en una entrada del resum JSON."""
+    linies = missatge.splitlines()
+    estat = "ok" if any(linia.startswith("[OK]") for linia in linies) else "failed"
+    return dict(camps, status=estat, messages=linies)
+
+
+def executar(args) -> dict:
+    """Executa l'exportació descrita pels arguments i en retorna el resum."""
+    # Imports diferits: '--help' i els errors d'arguments no carreguen numpy ni el nucli d'exportació.
+    from Agregar_Mostres import ESTADISTIQUES, EXPORT_PERIODS
+    from Escriptors_Sortida import extensio_sortida
+    from Exportar_Dades import exportar_carpetes, exportar_taula_ampla, llistar_subcarpetes
+    from Instrumentacio import Instrumentacio
+
+    periodes = sorted({periode_en_segons(text.strip(), EXPORT_PERIODS)
+                       for text in args.periode.split(",") if text.strip()})
+    if not periodes:
+        raise ValueError(f"període no vàlid: {args.periode!r}")
+    export_period_sec = periodes[0] if len(periodes) == 1 else periodes
+    statistics = tuple(name.strip() for name in args.columnes.split(",") if name.strip())
+    desconegudes = [name for name in statistics if name not in ESTADISTIQUES]
+    if not statistics or desconegudes:
+        raise ValueError(f"estadístiques no vàlides: {args.columnes!r} (opcions: {', '.join(ESTADISTIQUES)})")
+    extensio_sortida(args.output_format, args.compression)
+    if args.seguir is not None and (args.taula_ampla or len(periodes) > 1 or args.fins_a
+                                    or args.output_format != "csv" or args.compression):
+        raise ValueError("--seguir només admet CSV sense comprimir, un sol període i sense --fins-a ni --taula-ampla")
+
+    cataleg = None
+    if args.cataleg:
+        from Cataleg_Capcaleres import CatalegCapcaleres
+        cataleg = CatalegCapcaleres(args.cataleg)
+    cache_agregats = None
+    if args.cache_agregats:
+        from Cache_Agregats import CacheAgregats
+        cache_agregats = CacheAgregats(args.cache_agregats)
+
+    instrumentacio = None
+    if args.informe or args.perfil:
+        instrumentacio = Instrumentacio(perfilar=bool(args.perfil))
+
+    inici = time.monotonic()
+    fitxers_processats = 0
+
+    def progress_callback():
+        nonlocal fitxers_processats
+        fitxers_processats += 1
+
+    source_folders = llistar_subcarpetes(args.source_folder, args.filtre, cataleg)
+    opcions = dict(progress_callback=progress_callback, statistics=statistics, workers=args.workers,
+                   cataleg=cataleg, start_time=args.des_de, end_time=args.fins_a,
+                   output_format=args.output_format, compression=args.compression, instrumentacio=instrumentacio,
+                   cache_agregats=cache_agregats, lectura_anticipada=args.lectura_anticipada,
+                   memoria_lectura_mb=args.memoria_lectura_mb)
+    actualitzacions = 0
+    with instrumentacio.perfilant() if instrumentacio is not None else nullcontext():
+        if args.seguir is not None:
+            from Seguiment_Fitxers import seguir_carpetes
+            missatges = seguir_carpetes(source_folders, args.export_folder, export_period_sec, args.seguir,
+                                        statistics, cataleg, progress_callback=progress_callback,
+                                        start_time=args.des_de, instrumentacio=instrumentacio,
+                                        cache_agregats=cache_agregats, lectura_anticipada=args.lectura_anticipada,
+                                        memoria_lectura_mb=args.memoria_lectura_mb)
+            results = [resultat_json(msg, folder=folder)
+                       for folder, msg in zip(source_folders, itertools.islice(missatges, len(source_folders)))]
+            try:
+                for msg in missatges:
+                    actualitzacions += 1
+                    sys.stderr.write(msg + "\n")
+                    sys.stderr.flush()
+            except KeyboardInterrupt:
+                pass
+        elif args.taula_ampla:
+            # La taula ampla s'exporta període a període.
+            results = [resultat_json(exportar_taula_ampla(source_folders, args.export_folder, periode, **opcions),
+                                     folders=source_folders, period_sec=periode)
+                       for periode in (periodes if source_folders else [])]
+        else:
+            missatges = exportar_carpetes(source_folders, args.export_folder, export_period_sec,
+                                          incremental=args.incremental, **opcions)
+            results = [resultat_json(msg, folder=folder) for folder, msg in zip(source_folders, missatges)]
+
+    resum = {
+        "source_folder": args.source_folder,
+        "export_folder": args.export_folder,
+        "filter": args.filtre,
+        "period_sec": export_period_sec,
+        "statistics": list(statistics),
+        "output_format": args.output_format,
+        "compression": args.compression,
+        "start_time": args.des_de.isoformat() if args.des_de else None,
+        "end_time": args.fins_a.isoformat() if args.fins_a else None,
+        "wide_table": args.taula_ampla,
+        "follow_sec": args.seguir,
+        "follow_updates": actualitzacions,
+        "folders_found": len(source_folders),
+        "files_processed": fitxers_processats,
+        "elapsed_sec": round(time.monotonic() - inici, 3),
+        "ok": bool(results) and all(result["status"] == "ok" for result in results),
+        "results": results,
+    }
+    if instrumentacio is not None:
+        resum["stages"] = instrumentacio.informe()["totals"]
+        instrumentacio.desar(args.informe, args.perfil)
+    return resum
+
+
+def main(argv=None) -> int:
+    parser = crear_parser()
+    args = parser.parse_args(argv)
+    if args.gui:
+        from main_gui import main as main_gui
+        main_gui()
+        return 0
+    if not args.source_folder or not args.export_folder:
+        parser.error("cal indicar la carpeta d'origen i la de sortida (-o), o bé --gui")
+    if args.workers < 1:
+        parser.error("--processos ha de ser 1 o més")
+    if args.lectura_anticipada < 0 or args.memoria_lectura_mb <= 0:
+        parser.error("--lectura-anticipada ha de ser 0 o més i --memoria-lectura, positiva")
+    if args.seguir is not None and args.seguir <= 0:
+        parser.error("--seguir ha de ser un nombre de segons positiu")
+    try:
+        resum = executar(args)
+    except (OSError, ValueError, ImportError) as e:
+        json.dump({"ok": False, "error": str(e)}, sys.stdout, ensure_ascii=False, indent=1)
+        sys.stdout.write("\n")
+        return 2
+    json.dump(resum, sys.stdout, ensure_ascii=False, indent=1)
+    sys.stdout.write("\n")
+    return 0 if resum["ok"] else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
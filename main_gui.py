@@ -1,111 +1,77 @@
 import os
-import csv
+import time
 import datetime
 import customtkinter as ctk
 from tkinter import filedialog, messagebox, BooleanVar
 
-from Llegir_Fitxer_Dades import llegir_header_datafile, llegir_dades
-
-# Afegim el diccionari de períodes d'exportació (en segons)
-EXPORT_PERIODS = {
-    "20 segons": 20,
-    "1 minut": 60,
-    "10 minuts": 600,
-    "30 minuts": 1800,
-    "1 hora": 3600,
-    "12 hores": 43200,
-    "1 dia": 86400
+from Agregar_Mostres import ESTADISTIQUES, EXPORT_PERIODS
+from Cataleg_Capcaleres import CatalegCapcaleres
+from Cache_Agregats import CacheAgregats
+from Exportar_Dades import ExportacioEnSegonPla
+from Instrumentacio import Instrumentacio
+from Index_Filtre import IndexFiltre
+from Lectura_Anticipada import FITXERS_ENDAVANT
+
+# Columnes que es poden afegir a l'export, amb la capçalera CSV de cada estadística.
+EXPORT_STATISTICS = {
+    "Mitjana": ("mean",),
+    "Mitjana, mínim i màxim": ("mean", "min", "max"),
+    "Totes": ESTADISTIQUES,
 }
 
-def aggregate_samples(samples: list, export_period_sec: int) -> list:
-    """
-    Agrupa les mostres basant-se en buckets de temps amb la durada 'export_period_sec'.
-    Calcula la mitjana dels valors de cada bucket.
-    """
-    groups = {}
-    for sample in samples:
-        # Utilitzem el timestamp per agrupar. Es calcula el bucket com a interval interger.
-        ts = sample["time"].timestamp()
-        bucket = int(ts // export_period_sec) * export_period_sec
-        groups.setdefault(bucket, []).append(sample["value"])
-    aggregated = []
-    for bucket, values in groups.items():
-        avg_value = round(sum(values)/len(values), 3)
-        bucket_time = datetime.datetime.fromtimestamp(bucket)
-        aggregated.append({"time": bucket_time, "value": avg_value})
-    aggregated.sort(key=lambda s: s["time"])
-    return aggregated
-
-def process_subfolder(source_folder: str, export_folder: str, export_period_sec: int, progress_callback=None) -> str:
-    """
-    Processa una subcarpeta llegint fitxers de dades amb una extensió numèrica
-    i exporta les mostres (aggregades segons el període d'exportació) a un CSV amb el nom de la subcarpeta.
-    
-    Args:
-        source_folder (str): Ruta de la subcarpeta.
-        export_folder (str): Carpeta on es guarda l'export CSV.
-        export_period_sec (int): Interval d'exportació seleccionat (en segons).
-        progress_callback (func, opcional): Funció cridada després de processar cada fitxer.
-    
-    Returns:
-        str: Missatge indicant el resultat de l'exportació.
-    """
-    log_messages = []
-    data_files = [f for f in os.listdir(source_folder)
-                  if os.path.splitext(f)[1][1:].isdigit()]
-    if not data_files:
-        msg = f"[!] No s'han trobat fitxers de dades a {source_folder}"
-        log_messages.append(msg)
-        return "\n".join(log_messages)
-    data_files.sort()
-
-    all_samples = []
-    for data_file in data_files:
-        data_file_path = os.path.join(source_folder, data_file)
-        header_info = llegir_header_datafile(data_file_path)
-        if not header_info:
-            msg = f"[!] Error llegint la capçalera del fitxer: {data_file_path}"
-            log_messages.append(msg)
-            if progress_callback:
-                progress_callback()
-            continue
-        samples = llegir_dades(data_file_path, header_info)
-        if samples:
-            all_samples.extend(samples)
-        if progress_callback:
-            progress_callback()
-
-    if not all_samples:
-        msg = f"[!] No s'han trobat samples a {source_folder}"
-        log_messages.append(msg)
-        return "\n".join(log_messages)
-
-    all_samples.sort(key=lambda s: s["time"])
-    # Agrupació de mostres segons el període seleccionat
-    aggregated_samples = aggregate_samples(all_samples, export_period_sec)
-    csv_filename = os.path.join(export_folder, os.path.basename(source_folder) + ".csv")
-    try:
-        with open(csv_filename, "w", newline="") as csvfile:
-            writer = csv.writer(csvfile)
-            writer.writerow(["Time", "Value"])
-            for sample in aggregated_samples:
-                writer.writerow([
-                    sample["time"].strftime('%d/%m/%Y %H:%M:%S'),
-                    sample["value"]
-                ])
-        msg = f"[OK] Exportació completada: {csv_filename}"
-        log_messages.append(msg)
-    except Exception as e:
-        msg = f"[!] Error exportant CSV per {source_folder}: {e}"
-        log_messages.append(msg)
-
-    return "\n".join(log_messages)
+# Nombre de processos treballadors que es poden triar per a l'export (1 = en sèrie).
+WORKER_OPTIONS = sorted({"1", "2", "4", str(os.cpu_count() or 1)}, key=int)
+
+# Formats de sortida que es poden triar: (format, compressió). Parquet i Feather necessiten
+# 'pyarrow' i la compressió zstd del CSV necessita 'zstandard'.
+OUTPUT_FORMATS = {
+    "CSV": ("csv", None),
+    "CSV (gzip)": ("csv", "gzip"),
+    "CSV (zstd)": ("csv", "zstd"),
+    "Parquet": ("parquet", "snappy"),
+    "Feather": ("feather", "zstd"),
+}
+
+# Alçada aproximada (px) d'una fila de la llista de subcarpetes (switch i marge inferior).
+ROW_HEIGHT = 34
+
+# Files que es desplaça la llista de subcarpetes per cada pas de la roda del ratolí.
+SCROLL_ROWS = 3
+
+# Espera (ms) després de l'última tecla abans d'aplicar el filtre de subcarpetes.
+FILTER_DEBOUNCE_MS = 150
+
+# Caselles per fila del selector de períodes.
+PERIOD_COLUMNS = 3
+
+# Interval (ms) amb què la GUI consulta els esdeveniments de l'exportació en segon pla.
+EXPORT_POLL_MS = 100
 
+# Format de les dates del rang temporal d'exportació.
+TIME_RANGE_FORMAT = "%d/%m/%Y %H:%M"
+TIME_RANGE_PLACEHOLDER = "dd/mm/aaaa hh:mm"
+
+def parse_time_range_entry(text: str):
+    """Converteix el text d'una entrada del rang temporal a datetime (None si és buida)."""
+    text = text.strip()
+    if not text:
+        return None
+    return datetime.datetime.strptime(text, TIME_RANGE_FORMAT)
+
+def format_eta(seconds: float) -> str:
+    """Formata el temps restant d'una exportació com a 'h:mm:ss' o 'm:ss'."""
+    minutes, secs = divmod(int(seconds), 60)
+    hours, minutes = divmod(minutes, 60)
+    return f"{hours}:{minutes:02d}:{secs:02d}" if hours else f"{minutes}:{secs:02d}"
 
 class FilterableItemFrame(ctk.CTkFrame):
     """
     Widget que mostra una llista filtrable d'elements amb un CTkSwitch per a cada element.
     Permet seleccionar i deseleccionar elements amb feedback visual canviant el color del text.
+
+    La llista és virtualitzada: només es creen els switches de les files que caben a la vista i,
+    en desplaçar-se o filtrar, es reutilitzen canviant-ne el text i l'estat. El filtre es resol
+    amb un 'IndexFiltre', de manera que la llista respon igual amb desenes de milers d'elements.
     """
 
     def __init__(self, master, item_list: list = None, command=None, **kwargs):
@@ -114,80 +80,128 @@ class FilterableItemFrame(ctk.CTkFrame):
         self.command = command  # Funció opcional a executar en canviar la selecció.
         self.full_item_list = item_list  # Llista completa d'elements.
         self.selected_items = set()  # Conjunt d'elements seleccionats.
-        self.item_widgets = {}  # Diccionari per emmagatzemar els widgets per a cada element.
+        self.index = IndexFiltre(item_list)  # Índex per filtrar la llista completa.
+        self.visible_items = list(range(len(item_list)))  # Índexs dels elements que passen el filtre.
+        self.first_row = 0  # Posició (dins de visible_items) de la primera fila mostrada.
+        self.rows = []  # Files reutilitzables: (switch, variable).
 
         # Entrada per filtrar amb text per defecte en negre.
         self.filter_entry = ctk.CTkEntry(self, placeholder_text="Filtra...", text_color="black")
         self.filter_entry.pack(pady=(5, 10), padx=5, fill="x")
         self.filter_entry.bind("<KeyRelease>", self._on_filter_change)
 
-        # Marc scrollable per mostrar els elements.
-        self.scrollable_frame = ctk.CTkScrollableFrame(self)
-        self.scrollable_frame.pack(padx=5, pady=5, fill="both", expand=True)
+        # Marc amb les files visibles i la barra de desplaçament.
+        list_frame = ctk.CTkFrame(self)
+        list_frame.pack(padx=5, pady=5, fill="both", expand=True)
+        self.scrollbar = ctk.CTkScrollbar(list_frame, command=self._on_scrollbar)
+        self.scrollbar.pack(side="right", fill="y")
+        self.rows_frame = ctk.CTkFrame(list_frame, fg_color="transparent")
+        self.rows_frame.pack(side="left", fill="both", expand=True)
+        # La mida la decideix el contenidor, no les files: així el nombre de files no la fa créixer.
+        self.rows_frame.grid_propagate(False)
+        self.rows_frame.bind("<Configure>", self._on_resize)
+        self._bind_mousewheel(self.rows_frame)
 
         # Dibuixa la llista inicial.
-        self._draw_items(self.full_item_list)
-
-    def _draw_items(self, items: list):
+        self._draw_items()
+
+    def _bind_mousewheel(self, widget):
+        widget.bind("<MouseWheel>", self._on_mousewheel)
+        widget.bind("<Button-4>", self._on_mousewheel)
+        widget.bind("<Button-5>", self._on_mousewheel)
+
+    def _on_resize(self, event):
+        """Ajusta el nombre de files reutilitzables a l'alçada disponible."""
+        needed = max(1, event.height // ROW_HEIGHT)
+        while len(self.rows) < needed:
+            k = len(self.rows)
+            var = BooleanVar(value=False)
+            switch = ctk.CTkSwitch(self.rows_frame, text="", variable=var, command=lambda k=k: self._toggle_row(k))
+            switch.grid(row=k, column=0, pady=(0, 10), padx=5, sticky="w")
+            self._bind_mousewheel(switch)
+            self.rows.append((switch, var))
+        while len(self.rows) > needed:
+            switch, _ = self.rows.pop()
+            switch.destroy()
+        self._scroll_to(self.first_row)
+
+    def _draw_items(self):
         """
-        Dibuixa tots els elements de la llista 'items' en el scrollable_frame.
-        Esborra primer els widgets existents i omple el diccionari item_widgets.
+        Mostra a les files reutilitzables els elements visibles a partir de 'first_row' i
+        actualitza la barra de desplaçament.
         """
-        for widget in self.scrollable_frame.winfo_children():
-            widget.destroy()
-        self.item_widgets = {}
-        for i, item in enumerate(items):
-            var = BooleanVar(value=(item in self.selected_items))
-            color = "blue" if item in self.selected_items else "black"
-            switch = ctk.CTkSwitch(
-                self.scrollable_frame,
-                text=item,
-                text_color=color,
-                variable=var,
-                command=lambda item=item, var=var: self._toggle_item(item, var)
-            )
-            switch.grid(row=i, column=0, pady=(0, 10), padx=5, sticky="w")
-            self.item_widgets[item] = switch
-
-    def _toggle_item(self, item: str, var: BooleanVar):
+        for k, (switch, var) in enumerate(self.rows):
+            position = self.first_row + k
+            if position >= len(self.visible_items):
+                switch.grid_remove()
+                continue
+            item = self.full_item_list[self.visible_items[position]]
+            selected = item in self.selected_items
+            var.set(selected)
+            switch.configure(text=item, text_color="blue" if selected else "black")
+            switch.grid()
+        total = len(self.visible_items)
+        if total:
+            self.scrollbar.set(self.first_row / total, min(1.0, (self.first_row + len(self.rows)) / total))
+        else:
+            self.scrollbar.set(0.0, 1.0)
+
+    def _scroll_to(self, first_row: int):
+        """Desplaça la vista perquè la primera fila mostrada sigui 'first_row' (dins dels límits)."""
+        self.first_row = max(0, min(first_row, len(self.visible_items) - len(self.rows)))
+        self._draw_items()
+
+    def _on_scrollbar(self, action, amount, unit=None):
+        """Respon a la barra de desplaçament ('moveto' o 'scroll' per unitats o pàgines)."""
+        if action == "moveto":
+            self._scroll_to(int(float(amount) * len(self.visible_items)))
+        elif action == "scroll":
+            step = len(self.rows) if unit == "pages" else 1
+            self._scroll_to(self.first_row + int(amount) * step)
+
+    def _on_mousewheel(self, event):
+        if event.num == 4 or event.delta > 0:
+            self._scroll_to(self.first_row - SCROLL_ROWS)
+        elif event.num == 5 or event.delta < 0:
+            self._scroll_to(self.first_row + SCROLL_ROWS)
+
+    def _toggle_row(self, k: int):
         """
-        Alterna la selecció d'un element i actualitza l'aspecte del seu widget.
+        Alterna la selecció de l'element que mostra la fila 'k' i actualitza l'aspecte del seu widget.
         """
+        position = self.first_row + k
+        if position >= len(self.visible_items):
+            return
+        item = self.full_item_list[self.visible_items[position]]
+        switch, var = self.rows[k]
         if var.get():
             self.selected_items.add(item)
         else:
             self.selected_items.discard(item)
-
-        widget = self.item_widgets.get(item)
-        if widget is not None:
-            new_color = "blue" if item in self.selected_items else "black"
-            widget.configure(text=item, text_color=new_color)
-        else:
-            current_filter = self.filter_entry.get().strip().lower()
-            filtered = [it for it in self.full_item_list if current_filter in it.lower()]
-            self._draw_items(filtered)
+        switch.configure(text=item, text_color="blue" if item in self.selected_items else "black")
 
         if self.command:
             self.command()
 
     def _on_filter_change(self, event):
-        """Aplicació d'un debounce per evitar redibuixar la llista en cada tecla."""
+        """Aplicació d'un debounce per evitar filtrar la llista en cada tecla."""
         if hasattr(self, "_filter_job"):
             self.after_cancel(self._filter_job)
-        self._filter_job = self.after(300, self._apply_filter)
+        self._filter_job = self.after(FILTER_DEBOUNCE_MS, self._apply_filter)
 
     def _apply_filter(self):
-        """Aplica el filtre segons el text introduït i redibuixa la llista."""
-        filter_text = self.filter_entry.get().lower()
-        filtered = [item for item in self.full_item_list if filter_text in item.lower()]
-        self._draw_items(filtered)
+        """Aplica el filtre segons el text introduït i torna a l'inici de la llista."""
+        self.visible_items = self.index.filtrar(self.filter_entry.get())
+        self._scroll_to(0)
 
     def update_items(self, item_list: list):
         """Actualitza la llista completa d'elements i reinicia la selecció."""
         self.full_item_list = item_list
+        self.index = IndexFiltre(item_list)
+        self.visible_items = list(range(len(item_list)))
         self.selected_items.clear()
         self.filter_entry.delete(0, "end")
-        self._draw_items(item_list)
+        self._scroll_to(0)
 
     def get_selected_items(self) -> list:
         """Retorna una llista dels elements seleccionats."""
@@ -203,7 +217,8 @@ class App(ctk.CTk):
     def __init__(self):
         super().__init__()
         self.title("Exportador de CSV")
-        self.geometry("400x600")
+        self.geometry("700x820")
+        self.minsize(560, 640)
 
         # Marc superior amb botons de selecció de carpeta i exportació
         top_frame = ctk.CTkFrame(self)
@@ -211,34 +226,125 @@ class App(ctk.CTk):
         source_btn = ctk.CTkButton(top_frame, text="Selecciona carpeta d'origen",
                                    command=self.select_source_folder)
         source_btn.grid(row=0, column=0, padx=10, sticky="w")
-        export_btn = ctk.CTkButton(top_frame, text="Exporta a CSV",
-                                   command=self.export_selected_folders)
-        export_btn.grid(row=0, column=1, padx=10, sticky="w")
+        self.export_btn = ctk.CTkButton(top_frame, text="Exporta a CSV",
+                                        command=self.export_selected_folders)
+        self.export_btn.grid(row=0, column=1, padx=10, sticky="w")
         
         # Nou frame per al selector d'interval d'exportació amb menys marge inferior
         selector_frame = ctk.CTkFrame(self)
         selector_frame.pack(pady=(0, 10), padx=20, fill="x")  # abans tenia pady=(0,20)
-        label = ctk.CTkLabel(selector_frame, text="Període:")
-        label.grid(row=0, column=0, padx=5, sticky="w")
-        self.export_period_option = ctk.CTkOptionMenu(selector_frame, values=list(EXPORT_PERIODS.keys()))
-        self.export_period_option.set("20 segons")
-        self.export_period_option.grid(row=0, column=1, padx=5, sticky="w")
+        label = ctk.CTkLabel(selector_frame, text="Períodes:")
+        label.grid(row=0, column=0, padx=5, sticky="nw")
+        # Es poden marcar diversos períodes: es calculen tots amb una sola lectura de les dades.
+        periods_frame = ctk.CTkFrame(selector_frame, fg_color="transparent")
+        periods_frame.grid(row=0, column=1, padx=5, sticky="w")
+        self.export_period_vars = {}
+        for i, period_label in enumerate(EXPORT_PERIODS):
+            var = BooleanVar(value=period_label == "20 segons")
+            period_check = ctk.CTkCheckBox(periods_frame, text=period_label, variable=var, width=90)
+            period_check.grid(row=i // PERIOD_COLUMNS, column=i % PERIOD_COLUMNS, pady=2, sticky="w")
+            self.export_period_vars[period_label] = var
+        statistics_label = ctk.CTkLabel(selector_frame, text="Columnes:")
+        statistics_label.grid(row=1, column=0, padx=5, sticky="w")
+        self.export_statistics_option = ctk.CTkOptionMenu(selector_frame, values=list(EXPORT_STATISTICS.keys()))
+        self.export_statistics_option.set("Mitjana")
+        self.export_statistics_option.grid(row=1, column=1, padx=5, sticky="w")
+        workers_label = ctk.CTkLabel(selector_frame, text="Processos:")
+        workers_label.grid(row=2, column=0, padx=5, sticky="w")
+        self.workers_option = ctk.CTkOptionMenu(selector_frame, values=WORKER_OPTIONS)
+        self.workers_option.set("1")
+        self.workers_option.grid(row=2, column=1, padx=5, sticky="w")
+        start_label = ctk.CTkLabel(selector_frame, text="Des de (UTC):")
+        start_label.grid(row=3, column=0, padx=5, sticky="w")
+        self.start_time_entry = ctk.CTkEntry(selector_frame, placeholder_text=TIME_RANGE_PLACEHOLDER)
+        self.start_time_entry.grid(row=3, column=1, padx=5, sticky="w")
+        end_label = ctk.CTkLabel(selector_frame, text="Fins a (UTC):")
+        end_label.grid(row=4, column=0, padx=5, sticky="w")
+        self.end_time_entry = ctk.CTkEntry(selector_frame, placeholder_text=TIME_RANGE_PLACEHOLDER)
+        self.end_time_entry.grid(row=4, column=1, padx=5, sticky="w")
+
+        # Opcions avançades en un marc plegable, tancat per defecte, perquè la llista, el log i la
+        # barra de progrés hi càpiguen.
+        self.advanced_btn = ctk.CTkButton(selector_frame, text="Opcions avançades ▸", width=160,
+                                          fg_color="transparent", border_width=1,
+                                          command=self.toggle_advanced_options)
+        self.advanced_btn.grid(row=5, column=0, columnspan=2, padx=5, pady=(5, 0), sticky="w")
+        self.advanced_frame = ctk.CTkFrame(selector_frame, fg_color="transparent")
+        self.advanced_frame.grid(row=6, column=0, columnspan=2, sticky="w")
+        self.advanced_frame.grid_remove()
+        self.incremental_var = BooleanVar(value=False)
+        incremental_check = ctk.CTkCheckBox(self.advanced_frame, text="Exportació incremental",
+                                            variable=self.incremental_var)
+        incremental_check.grid(row=0, column=0, columnspan=2, padx=5, pady=(5, 0), sticky="w")
+        format_label = ctk.CTkLabel(self.advanced_frame, text="Format:")
+        format_label.grid(row=1, column=0, padx=5, sticky="w")
+        self.output_format_option = ctk.CTkOptionMenu(self.advanced_frame, values=list(OUTPUT_FORMATS.keys()))
+        self.output_format_option.set("CSV")
+        self.output_format_option.grid(row=1, column=1, padx=5, sticky="w")
+        self.wide_table_var = BooleanVar(value=False)
+        wide_table_check = ctk.CTkCheckBox(self.advanced_frame,
+                                           text="Taula ampla (totes les carpetes en un sol fitxer)",
+                                           variable=self.wide_table_var)
+        wide_table_check.grid(row=2, column=0, columnspan=2, padx=5, pady=(5, 0), sticky="w")
+        self.report_var = BooleanVar(value=False)
+        report_check = ctk.CTkCheckBox(self.advanced_frame, text="Informe de rendiment (JSON i cProfile)",
+                                       variable=self.report_var)
+        report_check.grid(row=3, column=0, columnspan=2, padx=5, pady=(5, 0), sticky="w")
+        self.rollup_cache_var = BooleanVar(value=False)
+        rollup_cache_check = ctk.CTkCheckBox(self.advanced_frame,
+                                             text="Memòria cau d'agregats (canvis de període ràpids)",
+                                             variable=self.rollup_cache_var)
+        rollup_cache_check.grid(row=4, column=0, columnspan=2, padx=5, pady=(5, 0), sticky="w")
+        self.read_ahead_var = BooleanVar(value=False)
+        read_ahead_check = ctk.CTkCheckBox(self.advanced_frame,
+                                           text="Lectura anticipada (arxius en unitats de xarxa)",
+                                           variable=self.read_ahead_var)
+        read_ahead_check.grid(row=5, column=0, columnspan=2, padx=5, pady=(5, 0), sticky="w")
         
+        # Àrea de log per mostrar missatges d'exportació. Es col·loca a baix abans que la llista, de
+        # manera que si falta alçada s'encongeix la llista i no el log ni la barra de progrés.
+        self.log_textbox = ctk.CTkTextbox(self, height=100, state="disabled", font=("Helvetica", 11))
+        self.log_textbox.pack(side="bottom", padx=20, pady=(5, 20), fill="x")
+
         # Widget filtrable per la llista de subcarpetes amb menys marge superior
         self.item_frame = FilterableItemFrame(self, item_list=[], width=650, height=300)
-        self.item_frame.pack(padx=20, pady=(5, 20), fill="both", expand=True)  # abans tenia pady=20
+        self.item_frame.pack(padx=20, pady=(5, 0), fill="both", expand=True)
 
         # Diccionari {nom_subcarpeta: ruta_completa}.
         self.subfolder_mapping = {}
 
-        # Àrea de log per mostrar missatges d'exportació.
-        self.log_textbox = ctk.CTkTextbox(self, height=100, state="disabled", font=("Helvetica", 11))
-        self.log_textbox.pack(padx=20, pady=(5, 20), fill="x")
+        # Exportació en segon pla en curs (ExportacioEnSegonPla) o None.
+        self.export_job = None
 
-        # Fitxer de configuració.
+        # Fitxer de configuració, i catàleg de capçaleres i memòria cau d'agregats al costat. Els
+        # fitxers SQLite només es creen quan es fan servir (vegeu '_get_cataleg' i '_get_cache_agregats').
         self.config_file = "config.txt"
+        self.config_dir = os.path.dirname(os.path.abspath(self.config_file))
+        self.cataleg = None
+        self.cache_agregats = None
         self.load_source_folder_from_config()
 
+    def _get_cataleg(self) -> CatalegCapcaleres:
+        """Catàleg de capçaleres, creat la primera vegada que es carrega una carpeta d'origen."""
+        if self.cataleg is None:
+            self.cataleg = CatalegCapcaleres(os.path.join(self.config_dir, "cataleg.sqlite"))
+        return self.cataleg
+
+    def _get_cache_agregats(self) -> CacheAgregats:
+        """Memòria cau d'agregats, creada la primera vegada que s'exporta amb l'opció activada."""
+        if self.cache_agregats is None:
+            self.cache_agregats = CacheAgregats(os.path.join(self.config_dir, "agregats.sqlite"))
+        return self.cache_agregats
+
+    def toggle_advanced_options(self):
+        """Mostra o amaga el marc d'opcions avançades."""
+        if self.advanced_frame.winfo_ismapped():
+            self.advanced_frame.grid_remove()
+            self.advanced_btn.configure(text="Opcions avançades ▸")
+        else:
+            self.advanced_frame.grid()
+            self.advanced_btn.configure(text="Opcions avançades ▾")
+
     def load_source_folder_from_config(self):
         """Carrega automàticament la carpeta d'origen si existeix i és vàlida."""
         if os.path.exists(self.config_file):
@@ -246,9 +352,7 @@ class App(ctk.CTk):
                 source_folder = f.read().strip()
             if os.path.isdir(source_folder):
                 try:
-                    subdirs = [os.path.join(source_folder, name)
-                               for name in os.listdir(source_folder)
-                               if os.path.isdir(os.path.join(source_folder, name)) and "TR2" in name]
+                    subdirs = self._get_cataleg().llistar_subcarpetes(source_folder, "TR2")
                 except Exception as e:
                     messagebox.showerror("Error", f"No s'ha pogut llegir la carpeta.\n{e}")
                     return
@@ -269,11 +373,7 @@ class App(ctk.CTk):
             f.write(source_folder)
 
         try:
-            subdirs = [
-                os.path.join(source_folder, name)
-                for name in os.listdir(source_folder)
-                if os.path.isdir(os.path.join(source_folder, name)) and "TR2" in name
-            ]
+            subdirs = self._get_cataleg().llistar_subcarpetes(source_folder, "TR2")
         except Exception as e:
             messagebox.showerror("Error", f"No s'ha pogut llegir la carpeta.\n{e}")
             return
@@ -300,14 +400,31 @@ class App(ctk.CTk):
         if not selected_items:
             messagebox.showinfo("Informació", "No s'han seleccionat subcarpetes.")
             return
+        # Períodes d'exportació seleccionats, en segons. Amb un de sol es manté el nom de sortida
+        # de sempre; amb diversos s'escriu un fitxer per període.
+        export_periods = [EXPORT_PERIODS[label] for label, var in self.export_period_vars.items() if var.get()]
+        if not export_periods:
+            messagebox.showinfo("Informació", "No s'ha seleccionat cap període d'exportació.")
+            return
+        export_period_sec = export_periods[0] if len(export_periods) == 1 else export_periods
+
+        try:
+            start_time = parse_time_range_entry(self.start_time_entry.get())
+            end_time = parse_time_range_entry(self.end_time_entry.get())
+        except ValueError:
+            messagebox.showerror("Error", f"El rang temporal ha de tenir el format {TIME_RANGE_PLACEHOLDER}.")
+            return
+        if start_time and end_time and start_time >= end_time:
+            messagebox.showerror("Error", "L'inici del rang temporal ha de ser anterior al final.")
+            return
 
         export_folder = filedialog.askdirectory(title="Selecciona carpeta d'exportació")
         if not export_folder:
             return
 
-        # Recuperem el període d'exportació seleccionat i la seva durada en segons
-        export_period_label = self.export_period_option.get()
-        export_period_sec = EXPORT_PERIODS.get(export_period_label, 20)
+        statistics = EXPORT_STATISTICS.get(self.export_statistics_option.get(), ("mean",))
+        workers = int(self.workers_option.get())
+        output_format, compression = OUTPUT_FORMATS.get(self.output_format_option.get(), ("csv", None))
 
         # Neteja l'àrea de log
         self.log_textbox.configure(state="normal")
@@ -316,46 +433,120 @@ class App(ctk.CTk):
         
         # Registra al log que s'ha iniciat l'exportació
         self.log_message("Exportació iniciada.")
-
-        # Comptar el nombre total de fitxers en totes les subcarpetes seleccionades
-        total_files = 0
-        for item in selected_items:
-            folder_path = self.subfolder_mapping.get(item)
-            if folder_path:
-                files = [f for f in os.listdir(folder_path)
-                         if os.path.splitext(f)[1][1:].isdigit()]
-                total_files += len(files)
-        if total_files == 0:
-            self.log_message("No s'han trobat fitxers de dades en les subcarpetes seleccionades.")
+        wide_table = self.wide_table_var.get()
+        options = {}
+        if self.read_ahead_var.get():
+            options["lectura_anticipada"] = FITXERS_ENDAVANT
+        if not wide_table:
+            options["incremental"] = self.incremental_var.get()
+        elif self.incremental_var.get():
+            self.log_message("[!] La taula ampla s'exporta sempre sencera (sense mode incremental).")
+        if len(export_periods) > 1 and self.incremental_var.get() and not wide_table:
+            self.log_message("[!] Amb diversos períodes l'exportació es fa sencera (sense mode incremental).")
+
+        # L'exportació (inclòs el recompte de fitxers) s'executa en segon pla; la GUI en consulta
+        # els esdeveniments amb after() i continua responent.
+        # Només s'instrumenta si s'ha demanat l'informe: llavors el temps de cada etapa es mostra
+        # al log i l'informe JSON i el perfil cProfile es desen en acabar.
+        folder_paths = [self.subfolder_mapping[item] for item in selected_items if self.subfolder_mapping.get(item)]
+        self.export_report = self.report_var.get()
+        self.export_folder = export_folder
+        self.instrumentacio = Instrumentacio(perfilar=True) if self.export_report else None
+        cache_agregats = self._get_cache_agregats() if self.rollup_cache_var.get() else None
+        self.export_job = ExportacioEnSegonPla(folder_paths, export_folder, export_period_sec,
+                                               statistics=statistics, workers=workers, cataleg=self.cataleg,
+                                               start_time=start_time, end_time=end_time,
+                                               output_format=output_format, compression=compression,
+                                               taula_ampla=wide_table, instrumentacio=self.instrumentacio,
+                                               cache_agregats=cache_agregats, **options)
+        self.export_btn.configure(state="disabled")
+
+        # Crea la progress bar amb la mateixa amplada que l'àrea de log, amb el botó de cancel·lar
+        # i l'estat (fitxers/s i temps restant) al costat.
+        self.progress_frame = ctk.CTkFrame(self)
+        self.progress_frame.pack(side="bottom", pady=(0, 20), padx=20, fill="x", before=self.log_textbox)
+        self.progress_bar = ctk.CTkProgressBar(self.progress_frame)
+        self.progress_bar.set(0)
+        self.progress_bar.grid(row=0, column=0, padx=(0, 10), sticky="ew")
+        cancel_btn = ctk.CTkButton(self.progress_frame, text="Cancel·la", width=80,
+                                   command=self.cancel_export)
+        cancel_btn.grid(row=0, column=1, sticky="e")
+        self.progress_label = ctk.CTkLabel(self.progress_frame, text="Comptant fitxers...", anchor="w")
+        self.progress_label.grid(row=1, column=0, columnspan=2, sticky="w")
+        self.progress_frame.grid_columnconfigure(0, weight=1)
+
+        self.export_total_files = 0
+        self.export_done_files = 0
+        self.export_current_file = ""
+        self.export_start = time.monotonic()
+        self.export_job.iniciar()
+        self.after(EXPORT_POLL_MS, self._poll_export)
+
+    def cancel_export(self):
+        """Demana aturar l'exportació en curs abans del fitxer següent."""
+        if self.export_job is not None:
+            self.export_job.cancellar()
+            self.progress_label.configure(text="Cancel·lant...")
+
+    def _poll_export(self):
+        """Processa els esdeveniments de l'exportació en segon pla i actualitza la GUI."""
+        finished = None
+        for kind, data in self.export_job.esdeveniments():
+            if kind == "total":
+                self.export_total_files = data
+                if data == 0:
+                    self.log_message("No s'han trobat fitxers de dades en les subcarpetes seleccionades.")
+            elif kind == "progres":
+                self.export_done_files += 1
+            elif kind == "fitxer":
+                self.export_current_file = os.path.basename(data)
+            elif kind == "resultat":
+                print(data)
+                self.log_message(data)
+            elif kind == "error":
+                self.log_message(f"[!] Error inesperat durant l'exportació: {data}")
+                finished = "Exportació interrompuda."
+            elif kind == "fi":
+                finished = "Exportació cancel·lada." if data else "Exportació finalitzada."
+
+        if self.export_total_files:
+            done, total = self.export_done_files, self.export_total_files
+            self.progress_bar.set(min(done / total, 1))
+            elapsed = time.monotonic() - self.export_start
+            rate = done / elapsed if elapsed > 0 else 0
+            eta = format_eta((total - done) / rate) if rate else "--:--"
+            if not self.export_job.cancel_event.is_set():
+                self.progress_label.configure(
+                    text=f"{done}/{total} fitxers · {rate:.1f} fitxers/s · ETA {eta} · {self.export_current_file}")
+
+        if finished is None:
+            self.after(EXPORT_POLL_MS, self._poll_export)
             return
-
-        # Crea la progress bar amb la mateixa amplada que l'àrea de log
-        progress_bar = ctk.CTkProgressBar(self)
-        progress_bar.pack(pady=(0, 20), padx=20, fill="x")
-        self.update()
-
-        # Contador mutable per emmagatzemar el nombre de fitxers processats
-        progress_counter = [0]
-
-        def update_progress():
-            progress_counter[0] += 1
-            progress_bar.set(progress_counter[0] / total_files)
-            self.update_idletasks()
-
-        # Processa cada subcarpeta passant el callback per actualitzar la progress bar
-        for item in selected_items:
-            folder_path = self.subfolder_mapping.get(item)
-            if folder_path:
-                result_msg = process_subfolder(folder_path, export_folder, export_period_sec, progress_callback=update_progress)
-                print(result_msg)
-                self.log_message(result_msg)
-
-        self.log_message("Exportació finalitzada.")
-        progress_bar.destroy()
+        self.log_message(finished)
+        if self.export_report:
+            self._save_report()
+        self.progress_frame.destroy()
+        self.export_btn.configure(state="normal")
+        self.export_job = None
+
+    def _save_report(self):
+        """Desa l'informe de rendiment (JSON) i el perfil cProfile a la carpeta d'exportació."""
+        base = os.path.join(self.export_folder,
+                            f"informe_rendiment_{datetime.datetime.now():%Y%m%d_%H%M%S}")
+        try:
+            self.instrumentacio.desar(base + ".json", base + ".prof")
+        except OSError as e:
+            self.log_message(f"[!] No s'ha pogut desar l'informe de rendiment: {e}")
+            return
+        self.log_message(f"[OK] Informe de rendiment desat: {base}.json, {base}.prof")
 
 
-if __name__ == "__main__":
+def main():
     ctk.set_appearance_mode("System")
     ctk.set_default_color_theme("blue")
     app = App()
-    app.mainloop()
\ No newline at end of file
+    app.mainloop()
+
+
+if __name__ == "__main__":
+    main()